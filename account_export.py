@@ -0,0 +1,179 @@
+"""
+Exportación de todas las cuentas a un único ZIP con un CSV por servidor.
+
+Las cuentas se leen con una sola consulta ordenada por servidor mediante un
+cursor del lado del servidor (yield_per), en bloques de EXPORT_YIELD_PER
+filas. Cada bloque se convierte a CSV y se comprime en un hilo aparte
+mientras se lee el siguiente, de modo que el bucle de eventos no se bloquea.
+El ZIP se escribe en un SpooledTemporaryFile: se mantiene en memoria mientras
+es pequeño y pasa a disco si crece, así que la memoria usada no depende del
+número de cuentas.
+
+Usage:
+    export = await export_accounts_zip(session)
+    await update.message.reply_document(document=export.file, filename=export.filename)
+"""
+import asyncio
+import csv
+import io
+import logging
+import tempfile
+import zipfile
+from datetime import datetime
+
+from sqlalchemy import select
+
+from config import EXPORT_YIELD_PER
+from database import Account, Server, User
+
+logger = logging.getLogger(__name__)
+
+# Tamaño a partir del cual el ZIP temporal pasa de memoria a disco
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+CSV_HEADERS = ["Usuario Cuenta", "Vencimiento", "Creado Por", "ID Telegram", "Estado"]
+
+
+class AccountExport:
+    """Resultado de una exportación: el ZIP (posicionado al inicio) y las cuentas de cada servidor"""
+
+    def __init__(self, file, filename, server_counts):
+        self.file = file
+        self.filename = filename
+        # Lista de [nombre del servidor, cuentas exportadas] en el orden del ZIP
+        self.server_counts = server_counts
+
+    @property
+    def total_accounts(self):
+        return sum(count for _, count in self.server_counts)
+
+
+def _safe_name(name):
+    # Limpiar nombre del servidor de caracteres inválidos para archivo
+    return "".join(c for c in name if c.isalnum() or c in (' ', '_', '-')).strip()
+
+
+def _format_row(row):
+    # Nombre del creador
+    if row.creator_username:
+        creator_name = f"@{row.creator_username}"
+    elif row.creator_full_name:
+        creator_name = row.creator_full_name
+    else:
+        creator_name = "Desconocido"
+
+    return [
+        row.username,
+        row.expiry_date.strftime("%Y-%m-%d"),
+        creator_name,
+        str(row.creator_telegram_id) if row.creator_telegram_id else "N/A",
+        "Activo" if row.is_active else "Inactivo/Pendiente"
+    ]
+
+
+class _ZipCsvWriter:
+    """Escribe filas ordenadas por servidor en un ZIP, abriendo un CSV nuevo al cambiar de servidor"""
+
+    def __init__(self, fileobj, date_str):
+        self._zip = zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED)
+        self._date_str = date_str
+        self._server_id = None
+        self._entry = None
+        self._text = None
+        self._writer = None
+        self._names = set()
+        self.server_counts = []
+
+    def _open_entry(self, row):
+        self._close_entry()
+
+        name = f"{_safe_name(row.server_name)}_{row.service}_{self._date_str}.csv"
+        if name in self._names:
+            # Dos servidores con el mismo nombre: distinguirlos por su ID
+            name = f"{_safe_name(row.server_name)}_{row.server_id}_{row.service}_{self._date_str}.csv"
+        self._names.add(name)
+
+        self._server_id = row.server_id
+        self._entry = self._zip.open(name, "w", force_zip64=True)
+        self._text = io.TextIOWrapper(self._entry, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(CSV_HEADERS)
+        self.server_counts.append([row.server_name, 0])
+
+    def _close_entry(self):
+        if self._text is not None:
+            # Cierra también la entrada del ZIP
+            self._text.close()
+            self._text = self._entry = self._writer = None
+
+    def write_rows(self, rows):
+        """Escribe un bloque de filas (se ejecuta fuera del bucle de eventos)"""
+        for row in rows:
+            if row.server_id != self._server_id:
+                self._open_entry(row)
+            self._writer.writerow(_format_row(row))
+            self.server_counts[-1][1] += 1
+
+    def close(self):
+        self._close_entry()
+        self._zip.close()
+
+
+async def export_accounts_zip(session, yield_per=EXPORT_YIELD_PER):
+    """
+    Exporta todas las cuentas a un ZIP con un CSV por servidor.
+
+    Args:
+        session: AsyncSession de la base de datos
+        yield_per: Filas leídas del cursor en cada bloque
+
+    Returns:
+        AccountExport (server_counts vacío si no hay cuentas)
+    """
+    query = (
+        select(
+            Server.id.label("server_id"),
+            Server.name.label("server_name"),
+            Server.service,
+            Account.username,
+            Account.expiry_date,
+            Account.is_active,
+            User.username.label("creator_username"),
+            User.full_name.label("creator_full_name"),
+            User.telegram_id.label("creator_telegram_id")
+        )
+        .join(Server, Account.server_id == Server.id)
+        .outerjoin(User, Account.user_id == User.id)
+        .order_by(Server.id, Account.expiry_date.asc())
+        .execution_options(yield_per=yield_per)
+    )
+
+    date_str = datetime.now().strftime("%Y%m%d")
+    fileobj = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    writer = _ZipCsvWriter(fileobj, date_str)
+    pending = None
+
+    try:
+        result = await session.stream(query)
+        async for rows in result.partitions():
+            # El bloque anterior se termina de escribir mientras se leía este
+            if pending is not None:
+                await pending
+            pending = asyncio.create_task(asyncio.to_thread(writer.write_rows, rows))
+        if pending is not None:
+            await pending
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        # No cerrar el archivo mientras el hilo aún escribe en él
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        fileobj.close()
+        raise
+
+    fileobj.seek(0)
+    export = AccountExport(fileobj, f"cuentas_servidores_{date_str}.zip", writer.server_counts)
+    logger.info(
+        f"Exportación de cuentas generada: {export.total_accounts} cuentas "
+        f"en {len(export.server_counts)} servidores"
+    )
+    return export
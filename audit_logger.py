@@ -4,7 +4,8 @@ Registra todas las operaciones importantes del sistema
 """
 import logging
 from datetime import datetime
-from database import Session, User
+from sqlalchemy import select
+from database import get_async_db_session, User
 from config import ADMIN_IDS
 
 # Configurar logger de auditoría
@@ -166,12 +167,11 @@ def log_device_limit_enforcement(user_count, devices_removed, servers_details):
     )
 
 
-def get_user_info_for_log(telegram_id):
+async def get_user_info_for_log(telegram_id):
     """Obtiene información resumida del usuario para logs"""
     try:
-        session = Session()
-        user = session.query(User).filter_by(telegram_id=telegram_id).first()
-        session.close()
+        async with get_async_db_session() as session:
+            user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
 
         if user:
             return f"{user.full_name} (@{user.username if user.username else 'N/A'})"
@@ -0,0 +1,105 @@
+"""
+Caché en memoria de autorización y rol de los usuarios del bot.
+
+check_authorization se ejecuta en cada mensaje y callback, y casi todos los
+handlers solo necesitan el rol, el estado de autorización o los créditos del
+usuario que envía la actualización. Esta caché guarda una instantánea de esos
+campos por telegram_id con expiración (TTL) y desalojo LRU, de modo que la
+autorización en la ruta caliente sea una búsqueda en un diccionario.
+
+Los comandos que modifican usuarios (/adduser, /deluser, /credits, /role) y
+las operaciones que descuentan créditos deben invalidar la entrada afectada.
+"""
+import time
+import threading
+import logging
+from collections import OrderedDict, namedtuple
+
+from config import AUTH_CACHE_TTL, AUTH_CACHE_MAX_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Instantánea de solo lectura de un usuario. Para modificarlo hay que cargar el
+# objeto User desde la sesión de base de datos.
+CachedUser = namedtuple("CachedUser", ["id", "telegram_id", "role", "is_authorized", "credits"])
+
+
+def snapshot_user(user):
+    """Crea una instantánea CachedUser a partir de un objeto User de la base de datos"""
+    return CachedUser(
+        id=user.id,
+        telegram_id=user.telegram_id,
+        role=user.role,
+        is_authorized=user.is_authorized,
+        credits=user.credits
+    )
+
+
+class AuthCache:
+    """Caché TTL + LRU de instantáneas de usuario indexada por telegram_id"""
+
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_size=AUTH_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id):
+        """
+        Devuelve la instantánea de un usuario si está en caché y no ha expirado.
+
+        Returns:
+            CachedUser o None
+        """
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                return None
+
+            expires_at, snapshot = entry
+            if expires_at < time.monotonic():
+                del self._entries[telegram_id]
+                return None
+
+            # Marcar como usado recientemente
+            self._entries.move_to_end(telegram_id)
+            return snapshot
+
+    def set(self, user):
+        """
+        Guarda la instantánea de un usuario en la caché.
+
+        Args:
+            user: Objeto User de la base de datos
+
+        Returns:
+            CachedUser: La instantánea guardada
+        """
+        snapshot = snapshot_user(user)
+        if self.ttl <= 0 or self.max_size <= 0:
+            return snapshot
+
+        with self._lock:
+            self._entries[user.telegram_id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(user.telegram_id)
+
+            # Desalojar los usuarios menos usados si se supera el tamaño máximo
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        return snapshot
+
+    def invalidate(self, telegram_id):
+        """Elimina de la caché la entrada de un usuario"""
+        with self._lock:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        """Vacía toda la caché"""
+        with self._lock:
+            self._entries.clear()
+        logger.info("Caché de autorización vaciada")
+
+
+# Instancia global compartida por el middleware y los handlers
+auth_cache = AuthCache()
@@ -0,0 +1,127 @@
+"""
+Benchmark de la evaluación de límites de dispositivos.
+
+Compara la evaluación agrupada (device_limits.evaluate_device_limits) con el
+recorrido anterior, que buscaba la cuenta de cada usuario con next(...) sobre
+todas las cuentas y filtraba todos los dispositivos para cada usuario
+(O(usuarios × (cuentas + dispositivos))). Solo mide la evaluación en memoria,
+no las peticiones HTTP.
+
+Usage:
+    python benchmarks/device_limits_benchmark.py > bench_output.txt
+"""
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_limits import DEVICE_LIMITS, evaluate_device_limits, group_devices_by_user  # noqa: E402
+
+SIZES = [100, 1_000, 5_000, 10_000, 25_000, 50_000]
+# El recorrido anterior es cuadrático: por encima de este tamaño no se mide
+LEGACY_MAX_DEVICES = 10_000
+DEVICES_PER_USER = 3
+REPEAT = 3
+
+BenchAccount = namedtuple("BenchAccount", "service_user_id plan")
+
+
+def build_server(device_count, seed=42):
+    """Genera usuarios, cuentas y dispositivos sintéticos (≈3 dispositivos por usuario)"""
+    rng = random.Random(seed)
+    plans = list(DEVICE_LIMITS['EMBY'])
+    user_count = max(1, device_count // DEVICES_PER_USER)
+    now = datetime(2024, 1, 1)
+
+    users = [{'Id': f'user-{i}', 'Name': f'user{i}', 'Policy': {}} for i in range(user_count)]
+    accounts = [BenchAccount(f'user-{i}', rng.choice(plans)) for i in range(user_count)]
+    devices = []
+    for i in range(device_count):
+        device = {
+            'Id': f'device-{i}',
+            'Name': f'Device {i}',
+            'AppName': 'Bench',
+            'LastUserId': f'user-{rng.randrange(user_count)}'
+        }
+        # Una parte de los dispositivos no tiene fecha de actividad
+        if rng.random() > 0.1:
+            device['DateLastActivity'] = (now - timedelta(minutes=rng.randrange(100_000))).isoformat() + 'Z'
+        devices.append(device)
+
+    return users, accounts, devices
+
+
+def legacy_evaluate(users, accounts, devices, plan_to_limit):
+    """Recorrido anterior: búsqueda lineal de la cuenta y filtrado de todos los dispositivos por usuario"""
+    to_remove = []
+    for user in users:
+        user_id = user.get('Id')
+        account = next((acc for acc in accounts if acc.service_user_id == user_id), None)
+        if not account:
+            continue
+
+        device_limit = plan_to_limit.get(account.plan, 1)
+        user_devices = [d for d in devices if d.get('LastUserId') == user_id]
+        if len(user_devices) <= device_limit:
+            continue
+
+        with_date = []
+        without_date = []
+        for device in user_devices:
+            last_activity = device.get('DateLastActivity')
+            if last_activity:
+                with_date.append((datetime.fromisoformat(last_activity.replace('Z', '+00:00')), device))
+            else:
+                without_date.append(device)
+        with_date.sort(key=lambda item: item[0])
+        excess = len(user_devices) - device_limit
+        to_remove.extend((without_date + [device for _, device in with_date])[:excess])
+    return to_remove
+
+
+def grouped_evaluate(users, accounts, devices, plan_to_limit):
+    devices_by_user = group_devices_by_user(devices)
+    evaluations, _ = evaluate_device_limits(users, accounts, devices_by_user, plan_to_limit)
+    return [device for evaluation in evaluations for device in evaluation['to_remove']]
+
+
+def best_time(func, *args):
+    best = None
+    result = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    plan_to_limit = DEVICE_LIMITS['EMBY']
+    print(f"{'dispositivos':>12} {'usuarios':>9} {'a eliminar':>11} {'agrupado (ms)':>14} {'anterior (ms)':>14} {'mejora':>8}")
+
+    for size in SIZES:
+        users, accounts, devices = build_server(size)
+        grouped_time, grouped_result = best_time(grouped_evaluate, users, accounts, devices, plan_to_limit)
+
+        if size <= LEGACY_MAX_DEVICES:
+            legacy_time, legacy_result = best_time(legacy_evaluate, users, accounts, devices, plan_to_limit)
+            assert {d['Id'] for d in legacy_result} == {d['Id'] for d in grouped_result}
+            legacy_ms = f"{legacy_time * 1000:14.1f}"
+            speedup = f"{legacy_time / grouped_time:7.0f}x"
+        else:
+            legacy_ms = f"{'-':>14}"
+            speedup = f"{'-':>8}"
+
+        print(
+            f"{size:>12} {len(users):>9} {len(grouped_result):>11} "
+            f"{grouped_time * 1000:14.1f} {legacy_ms} {speedup}"
+        )
+
+
+if __name__ == "__main__":
+    main()
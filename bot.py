@@ -1,13 +1,18 @@
 import logging
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, CallbackContext
-from config import BOT_TOKEN
-from database import init_db
+from config import BOT_TOKEN, STATUS_POLL_INTERVAL, STATUS_POLL_JITTER, WARM_POOL_SIZE, WARM_POOL_REFILL_INTERVAL, UPDATE_CONCURRENCY, DEVICE_LIMITS_INTERVAL
+from sqlalchemy import select
+from database import init_db, get_async_db_session, Server
+from http_pool import warm_http_clients, close_all_http_clients
+from status_poller import refresh_server_status_snapshots
+from warm_pool import refill_warm_pools
+from message_queue import start_message_queue, stop_message_queue
 from handlers.command_handler import start_command, price_command, adduser_command, deluser_command, credits_command, role_command, monitor_command, reset_command, list_command, handle_download_accounts, checkdevices_command, demos_command, check_expired_command, list_accounts_command, cleanup_orphaned_command
 from handlers.menu_handler import handle_callback_query, handle_server_input, handle_username_delete, handle_renewal_input
 from handlers.auth_handler import check_authorization, unauthorized_message
 from utils.keyboards import main_menu_keyboard
-from scheduled_tasks import check_expired_accounts, send_servers_status_to_admins, cleanup_orphaned_devices, check_and_enforce_device_limits
+from scheduled_tasks import check_expired_accounts, send_servers_status_to_admins, run_device_maintenance
 
 # Configurar logging
 logging.basicConfig(
@@ -18,15 +23,45 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+def unit_of_work(func):
+    """
+    Abre una única sesión de base de datos por actualización de Telegram.
+
+    La sesión queda disponible en context.db_session (y el usuario que la envía
+    en context.db_user tras check_authorization) para que middleware y handler
+    compartan la misma conexión. Se hace commit al terminar y rollback si hay error.
+
+    La sesión solo ocupa una conexión del pool mientras tiene una transacción
+    abierta: auth_middleware la confirma tras la autorización, y los handlers que
+    consultan context.db_session deben confirmarla antes de llamar a un servidor
+    multimedia, crear o renovar cuentas (que abren su propia sesión) o enviar
+    archivos, para no quedar "idle in transaction" durante esas esperas.
+    """
+    async def wrapped(update, context):
+        async with get_async_db_session() as session:
+            context.db_session = session
+            context.db_user = None
+            try:
+                return await func(update, context)
+            finally:
+                context.db_session = None
+                context.db_user = None
+    return wrapped
+
 async def auth_middleware(update: Update, context):
     """Middleware para verificar autorización antes de procesar comandos"""
-    if not await check_authorization(update, context): 
+    authorized = await check_authorization(update, context)
+    # context.db_user es una instantánea: terminar la transacción de la consulta de
+    # autorización devuelve la conexión al pool mientras se ejecuta el handler
+    await context.db_session.commit()
+    if not authorized:
         await unauthorized_message(update, context)
         return False
     return True
 
 # Envoltorio para comandos que requieren autorización
 def auth_wrapper(func):
+    @unit_of_work
     async def wrapped(update, context):
         if await auth_middleware(update, context):
             await func(update, context)
@@ -48,6 +83,7 @@ async def error_handler(update, context):
         logger.error(f"Error al enviar mensaje de error: {e}")
 
 # Manejador para callbacks que requieren autorización
+@unit_of_work
 async def auth_callback_query_handler(update, context):
     """Verifica autorización antes de procesar callbacks"""
     query = update.callback_query
@@ -60,6 +96,7 @@ async def auth_callback_query_handler(update, context):
         await query.answer("No estás autorizado para usar este bot")
 
 # Manejador para mensajes de texto (para procesos de entrada como agregar servidor)
+@unit_of_work
 async def text_message_handler(update: Update, context: CallbackContext):
     """Maneja mensajes de texto para diversos procesos interactivos"""
     # Verificar si hay procesos activos que requieren entrada de texto
@@ -133,20 +170,30 @@ async def setup_jobs_background(context):
         first=120  # Empezar después de 2 minutos
     )
 
-    # Programar la limpieza de dispositivos huérfanos cada 12 horas
+    # Refrescar la caché de estado de los servidores (con desfase aleatorio entre sondeos)
     context.job_queue.run_repeating(
-        callback=cleanup_orphaned_devices,
-        interval=43200,  # 12 horas en segundos
-        first=300  # Empezar después de 5 minutos
+        callback=refresh_server_status_snapshots,
+        interval=STATUS_POLL_INTERVAL,
+        first=30,  # Empezar después de 30 segundos
+        job_kwargs={'jitter': STATUS_POLL_JITTER}
     )
 
-    # Programar la verificación de límites de dispositivos cada 3 horas
+    # Programar la verificación de límites de dispositivos (cada 3 horas por defecto) y, en
+    # uno de cada ORPHAN_CLEANUP_INTERVAL, la limpieza de huérfanos sobre el mismo inventario
     context.job_queue.run_repeating(
-        callback=check_and_enforce_device_limits,
-        interval=10800,  # 3 horas en segundos
-        first=600  # Empezar después de 10 minutos
+        callback=run_device_maintenance,
+        interval=DEVICE_LIMITS_INTERVAL,
+        first=300  # Empezar después de 5 minutos
     )
     
+    # Conciliar y reponer el pool de usuarios precreados (solo si está activado)
+    if WARM_POOL_SIZE > 0:
+        context.job_queue.run_repeating(
+            callback=refill_warm_pools,
+            interval=WARM_POOL_REFILL_INTERVAL,
+            first=60  # Empezar después de 1 minuto
+        )
+    
     logger.info("Tareas programadas configuradas correctamente en segundo plano.")
 
 async def post_init(application):
@@ -174,6 +221,22 @@ async def post_init(application):
     
     await application.bot.set_my_commands(commands)
     logger.info("Comandos del bot configurados correctamente en Telegram")
+    
+    # Arrancar los workers de la cola de salida de mensajes
+    start_message_queue()
+    
+    # Precalentar los clientes HTTP de los servidores activos
+    try:
+        async with get_async_db_session() as session:
+            servers = (await session.scalars(select(Server).filter_by(is_active=True))).all()
+        await warm_http_clients(servers)
+    except Exception as e:
+        logger.error(f"Error al precalentar los clientes HTTP: {e}")
+
+async def post_shutdown(application):
+    """Detiene la cola de salida de mensajes y cierra las conexiones HTTP persistentes al detener el bot"""
+    await stop_message_queue()
+    await close_all_http_clients()
 
 def main():
     """Función principal que inicia el bot"""
@@ -181,7 +244,14 @@ def main():
     init_db()
     
     # Crear aplicación
-    application = ApplicationBuilder().token(BOT_TOKEN).post_init(post_init).build()
+    application = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Registrar manejador de errores
     application.add_error_handler(error_handler)
@@ -193,7 +263,7 @@ def main():
     
     # Registrar manejadores
     # El comando start no requiere autorización previa
-    application.add_handler(CommandHandler("start", start_command))
+    application.add_handler(CommandHandler("start", unit_of_work(start_command)))
     
     # Comandos que requieren autorización
     application.add_handler(CommandHandler("price", auth_wrapper(price_command)))
@@ -0,0 +1,182 @@
+"""
+Compra masiva: N cuentas del mismo plan en una sola acción.
+
+Las plazas se reservan de una vez (db_locks.reserve_server_slots, repartidas
+entre servidores si BULK_SPREAD_ACROSS_SERVERS) y los créditos se cobran con
+un único cargo condicional. Después se crean los N usuarios en paralelo, con
+un máximo de BULK_CONCURRENCY_PER_SERVER creaciones simultáneas por servidor,
+y las cuentas creadas se registran en una sola transacción.
+
+Las creaciones que fallan devuelven su plaza y su parte del cargo; si falla el
+registro en la base de datos, los usuarios ya creados se eliminan de los
+servidores y se devuelve todo. Las credenciales se entregan como un único CSV.
+
+Usage:
+    success, result = await bulk_create_accounts(user.id, "EMBY", "1_screen", 10)
+    if success:
+        await message.reply_document(document=result["document"].getvalue(), filename=result["document"].filename)
+"""
+import asyncio
+import logging
+from collections import Counter
+
+from sqlalchemy import select
+
+from audit_logger import log_account_created
+from auth_cache import auth_cache
+from config import BULK_CONCURRENCY_PER_SERVER, BULK_MAX_ACCOUNTS
+from credits import charge_credits, refund_credits
+from database import Account, Price, User, get_async_db_session
+from db_locks import release_server_slot, reserve_server_slots
+from handlers.emby_handler import create_emby_user, delete_emby_user
+from handlers.jellyfin_handler import create_jellyfin_user, delete_jellyfin_user
+from report_builder import ReportDocument
+
+logger = logging.getLogger(__name__)
+
+CREATE_USER = {"EMBY": create_emby_user, "JELLYFIN": create_jellyfin_user}
+DELETE_USER = {"EMBY": delete_emby_user, "JELLYFIN": delete_jellyfin_user}
+
+CSV_COLUMNS = ["usuario", "contraseña", "servidor", "url", "plan", "vencimiento"]
+
+
+async def get_bulk_price(session, db_user, service, plan):
+    """Precio unitario del plan para el usuario (0 para administradores, None si no está disponible)"""
+    if db_user.role in ["SUPER_ADMIN", "ADMIN"]:
+        return 0.0
+
+    price = await session.scalar(select(Price).filter_by(service=service, role=db_user.role, plan=plan))
+    return float(price.amount) if price else None
+
+
+async def _create_on_server(create_user, server, plan, duration_days, semaphore):
+    """Crea una cuenta; cualquier excepción cuenta como creación fallida para devolver su plaza y su cargo"""
+    async with semaphore:
+        try:
+            return server, await create_user(server, plan, duration_days)
+        except Exception as e:
+            logger.error(f"Error al crear una cuenta de la compra masiva en {server.name}: {e}")
+            return server, (False, f"Error: {str(e)}")
+
+
+async def _delete_created(service, created):
+    """Elimina de los servidores los usuarios que no llegaron a registrarse en la base de datos"""
+    results = await asyncio.gather(
+        *(DELETE_USER[service](server, result["user_id"]) for server, result in created),
+        return_exceptions=True
+    )
+    for (server, result), outcome in zip(created, results):
+        if isinstance(outcome, Exception) or not outcome[0]:
+            logger.error(f"No se pudo eliminar {result['username']} del servidor {server.name} al deshacer la compra masiva")
+
+
+async def bulk_create_accounts(telegram_user_id, service, plan, quantity, duration_days=30):
+    """
+    Crea quantity cuentas del mismo plan para un usuario.
+
+    Returns:
+        Tuple (success, result): result es un mensaje de error o un diccionario con
+        created, failed, errors (motivo -> veces), charged y document (ReportDocument)
+    """
+    service = service.upper()
+    if plan == 'demo':
+        return False, "Las demos no se pueden comprar de forma masiva"
+    if not 1 <= quantity <= BULK_MAX_ACCOUNTS:
+        return False, f"La cantidad debe estar entre 1 y {BULK_MAX_ACCOUNTS}"
+
+    async with get_async_db_session() as session:
+        db_user = await session.scalar(select(User).filter_by(telegram_id=telegram_user_id))
+        if not db_user:
+            return False, "Usuario no encontrado"
+
+        price = await get_bulk_price(session, db_user, service, plan)
+        if price is None:
+            return False, "Plan no disponible para tu rol"
+
+    # 1. Plazas y créditos, una sola vez para todo el pedido
+    reservations = await reserve_server_slots(service, quantity, plan=plan)
+    if reservations is None:
+        return False, f"No hay {quantity} plazas libres en los servidores {service}"
+
+    total = price * quantity
+    reference = f"{service}:{plan}x{quantity}"
+    if total > 0:
+        if await charge_credits(db_user.id, total, "purchase", reference) is None:
+            for server, reserved in reservations:
+                await release_server_slot(server.id, reserved)
+            return False, f"Créditos insuficientes. Necesitas ${total:,.0f}"
+        auth_cache.invalidate(db_user.telegram_id)
+
+    # 2. Creación en paralelo, limitada por servidor
+    create_user = CREATE_USER[service]
+    tasks = []
+    for server, reserved in reservations:
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY_PER_SERVER)
+        tasks.extend(
+            _create_on_server(create_user, server, plan, duration_days, semaphore)
+            for _ in range(reserved)
+        )
+    results = await asyncio.gather(*tasks)
+
+    created = [(server, result) for server, (success, result) in results if success]
+    errors = Counter(result for _, (success, result) in results if not success)
+    failed_by_server = Counter(server.id for server, (success, _) in results if not success)
+
+    # 3. Registro de todas las cuentas creadas en una transacción
+    if created:
+        try:
+            async with get_async_db_session() as session:
+                session.add_all([
+                    Account(
+                        user_id=db_user.id,
+                        service=service,
+                        username=result["username"],
+                        password=result["password"],
+                        plan=plan,
+                        server_id=server.id,
+                        service_user_id=result["user_id"],
+                        expiry_date=result["expiry_date"],
+                        is_active=True
+                    )
+                    for server, result in created
+                ])
+        except Exception as e:
+            logger.error(f"Error al registrar la compra masiva de {telegram_user_id}: {e}")
+            await _delete_created(service, created)
+            errors[f"Error al registrar las cuentas: {e}"] += len(created)
+            failed_by_server.update(server.id for server, _ in created)
+            created = []
+
+    # 4. Devolver plazas y créditos de lo que no se creó
+    for server_id, failed in failed_by_server.items():
+        await release_server_slot(server_id, failed)
+
+    failed = quantity - len(created)
+    if failed and price > 0:
+        await refund_credits(db_user.id, price * failed, reference)
+        auth_cache.invalidate(db_user.telegram_id)
+
+    logger.info(f"Compra masiva {reference} de {telegram_user_id}: {len(created)} creadas, {failed} fallidas")
+
+    if not created:
+        return False, f"No se pudo crear ninguna cuenta: {errors.most_common(1)[0][0]}"
+
+    document = ReportDocument(f"cuentas_{service.lower()}_{plan}", CSV_COLUMNS, fmt="csv")
+    for server, result in created:
+        log_account_created(db_user.id, service, plan, server.id, result["username"])
+        document.add_row(
+            result["username"],
+            result["password"],
+            server.name,
+            server.url,
+            plan,
+            result["expiry_date"].strftime("%Y-%m-%d")
+        )
+
+    return True, {
+        "created": len(created),
+        "failed": failed,
+        "errors": errors,
+        "charged": price * len(created),
+        "document": document
+    }
@@ -0,0 +1,145 @@
+"""
+Circuit breaker por servidor Emby/Jellyfin.
+
+Cuando un servidor acumula CIRCUIT_BREAKER_FAILURE_THRESHOLD fallos seguidos
+(errores de conexión, timeouts o respuestas 5xx) su circuito se abre y las
+llamadas siguientes fallan de inmediato en lugar de esperar el timeout HTTP.
+Pasados CIRCUIT_BREAKER_RECOVERY_TIMEOUT segundos el circuito pasa a
+semiabierto y deja pasar una única petición de prueba: si responde, se
+cierra; si falla, vuelve a abrirse.
+
+Todas las llamadas a los servidores pasan por MediaServerClient._request,
+que consulta el circuito del servidor antes de cada petición.
+"""
+import logging
+import time
+
+from config import CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_LABELS = {
+    CLOSED: "🟢 Cerrado",
+    OPEN: "🔴 Abierto",
+    HALF_OPEN: "🟡 Semiabierto",
+}
+
+
+class CircuitBreaker:
+    """Estado del circuito de un servidor (solo se usa desde el event loop, no requiere locks)"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout=CIRCUIT_BREAKER_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failure_count = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probe_in_flight = False
+
+    def retry_in(self):
+        """Segundos que faltan para permitir una petición de prueba (0 si no está abierto)"""
+        if self.state != OPEN:
+            return 0
+        return max(0, int(self.opened_at + self.recovery_timeout - time.monotonic()))
+
+    def allow_request(self):
+        """
+        Indica si se puede realizar una petición al servidor.
+
+        En estado abierto, una vez vencido el tiempo de recuperación, pasa a
+        semiabierto y autoriza una sola petición de prueba.
+        """
+        if self.state == CLOSED:
+            return True
+
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                return False
+            self.state = HALF_OPEN
+            logger.info(f"Circuito de {self.name} semiabierto: enviando petición de prueba")
+
+        # Semiabierto: solo una petición de prueba a la vez
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"Circuito de {self.name} cerrado: el servidor vuelve a responder")
+        self.state = CLOSED
+        self.failure_count = 0
+        self.opened_at = None
+        self.last_error = None
+        self._probe_in_flight = False
+
+    def record_failure(self, error):
+        self.failure_count += 1
+        self.last_error = str(error)
+        self._probe_in_flight = False
+
+        if self.state == HALF_OPEN or self.failure_count >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning(
+                    f"Circuito de {self.name} abierto tras {self.failure_count} fallos: {self.last_error}"
+                )
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Libera la petición de prueba si se canceló o falló antes de obtener respuesta"""
+        self._probe_in_flight = False
+
+    def status_label(self):
+        """Texto del estado para los informes de servidores"""
+        label = STATE_LABELS[self.state]
+        if self.state == OPEN:
+            return f"{label} (reintento en {self.retry_in()}s)"
+        return label
+
+
+# server_id -> CircuitBreaker
+_breakers = {}
+
+
+def get_breaker(server_id, name=None):
+    """Obtiene el circuito de un servidor, creándolo si no existe"""
+    breaker = _breakers.get(server_id)
+    if breaker is None:
+        breaker = CircuitBreaker(name or f"servidor {server_id}")
+        _breakers[server_id] = breaker
+    return breaker
+
+
+def is_available(server_id):
+    """True si el circuito del servidor no está abierto (no consume la petición de prueba)"""
+    breaker = _breakers.get(server_id)
+    if breaker is None or breaker.state != OPEN:
+        return True
+    return time.monotonic() - breaker.opened_at >= breaker.recovery_timeout
+
+
+def is_healthy(server_id):
+    """True si el circuito está cerrado y sin fallos recientes"""
+    breaker = _breakers.get(server_id)
+    return breaker is None or (breaker.state == CLOSED and breaker.failure_count == 0)
+
+
+def circuit_status_label(server_id):
+    """Estado del circuito de un servidor para mostrarlo en los informes"""
+    breaker = _breakers.get(server_id)
+    if breaker is None:
+        return STATE_LABELS[CLOSED]
+    return breaker.status_label()
+
+
+def reset_breaker(server_id):
+    """Olvida el estado del circuito (al cambiar la configuración o eliminar el servidor)"""
+    _breakers.pop(server_id, None)
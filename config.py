@@ -15,6 +15,26 @@ DB_URL = os.getenv("DB_URL")
 if not DB_URL:
     raise ValueError("DB_URL no está configurado en las variables de entorno")
 
+# Conexión asíncrona a la base de datos (usada por los handlers y las tareas programadas)
+# Si no se define ASYNC_DB_URL, se deriva de DB_URL cambiando el driver por uno asíncrono
+def _derive_async_db_url(url):
+    """Convierte una URL síncrona de SQLAlchemy a su equivalente con driver asíncrono"""
+    for sync_prefix, async_prefix in (
+        ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+        ("postgres://", "postgresql+asyncpg://"),
+        ("sqlite://", "sqlite+aiosqlite://"),
+    ):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+ASYNC_DB_URL = os.getenv("ASYNC_DB_URL") or _derive_async_db_url(DB_URL)
+
+# Pool de conexiones a la base de datos (conexiones permanentes y adicionales cuando se necesiten)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+
 # NOTA DE SEGURIDAD: Esta variable ya no se usa. Las contraseñas se generan aleatoriamente.
 # Se mantiene por compatibilidad pero debe eliminarse en futuras versiones.
 DEFAULT_ACCOUNT_PASSWORD = os.getenv("DEFAULT_ACCOUNT_PASSWORD", "")
@@ -33,6 +53,62 @@ ADMIN_IDS = SUPER_ADMIN_IDS.copy()
 if additional_admins:
     ADMIN_IDS.extend([int(id.strip()) for id in additional_admins.split(",") if id.strip()])
 
+# Caché de autorización (segundos de vida y número máximo de usuarios en memoria)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+AUTH_CACHE_MAX_SIZE = int(os.getenv("AUTH_CACHE_MAX_SIZE", "1000"))
+
+# Clientes HTTP hacia los servidores Emby/Jellyfin (uno persistente por servidor)
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_MAX_CONNECTIONS_PER_SERVER = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_SERVER", "10"))
+HTTP_MAX_KEEPALIVE_PER_SERVER = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_SERVER", "5"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Actualizaciones de Telegram procesadas a la vez (una petición lenta a Emby/Jellyfin
+# o una compra masiva no bloquea al resto de chats). Una compra usa hasta dos
+# conexiones a la vez (la sesión de la actualización y la de la reserva o el cobro),
+# así que por defecto se procesan la mitad de DB_POOL_SIZE + DB_MAX_OVERFLOW para que
+# ninguna actualización espere una conexión; un valor mayor debe ir con un pool mayor.
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", str(max(1, (DB_POOL_SIZE + DB_MAX_OVERFLOW) // 2))))
+
+# Circuit breaker por servidor (fallos seguidos para abrirlo y segundos hasta la petición de prueba)
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", "3"))
+CIRCUIT_BREAKER_RECOVERY_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RECOVERY_TIMEOUT", "60"))
+
+# Servidores consultados simultáneamente al generar los informes de estado
+SERVER_STATUS_CONCURRENCY = int(os.getenv("SERVER_STATUS_CONCURRENCY", "8"))
+
+# Sondeo en segundo plano del estado de los servidores (intervalo y desfase aleatorio máximo, en segundos)
+STATUS_POLL_INTERVAL = int(os.getenv("STATUS_POLL_INTERVAL", "120"))
+STATUS_POLL_JITTER = int(os.getenv("STATUS_POLL_JITTER", "15"))
+
+# Segundos durante los que se reutiliza el inventario de usuarios/dispositivos/sesiones de un servidor
+INVENTORY_MAX_AGE = int(os.getenv("INVENTORY_MAX_AGE", "300"))
+
+# Mantenimiento de dispositivos: el control de límites se ejecuta en cada ciclo y la
+# limpieza de huérfanos en el mismo ciclo (antes que el control) cada ORPHAN_CLEANUP_INTERVAL
+# segundos, de modo que ambas consumen la misma sincronización del inventario
+DEVICE_LIMITS_INTERVAL = int(os.getenv("DEVICE_LIMITS_INTERVAL", "10800"))
+ORPHAN_CLEANUP_INTERVAL = int(os.getenv("ORPHAN_CLEANUP_INTERVAL", "43200"))
+
+# Ubicación de cuentas nuevas: peso de la ocupación de plazas, de dispositivos y de las reproducciones en curso
+PLACEMENT_WEIGHT_USERS = float(os.getenv("PLACEMENT_WEIGHT_USERS", "1.0"))
+PLACEMENT_WEIGHT_DEVICES = float(os.getenv("PLACEMENT_WEIGHT_DEVICES", "1.0"))
+PLACEMENT_WEIGHT_STREAMS = float(os.getenv("PLACEMENT_WEIGHT_STREAMS", "1.0"))
+# Reproducciones directas que equivalen a una transcodificación
+PLACEMENT_TRANSCODE_COST = float(os.getenv("PLACEMENT_TRANSCODE_COST", "3"))
+# Penalización de servidores offline o con fallos recientes y antigüedad máxima (s) del estado en vivo usado
+PLACEMENT_UNHEALTHY_PENALTY = float(os.getenv("PLACEMENT_UNHEALTHY_PENALTY", "1.0"))
+PLACEMENT_STATUS_MAX_AGE = int(os.getenv("PLACEMENT_STATUS_MAX_AGE", "600"))
+
+# Eliminación de dispositivos (simultáneas por servidor, reintentos y espera base en segundos)
+DEVICE_DELETE_CONCURRENCY = int(os.getenv("DEVICE_DELETE_CONCURRENCY", "8"))
+DEVICE_DELETE_MAX_RETRIES = int(os.getenv("DEVICE_DELETE_MAX_RETRIES", "3"))
+DEVICE_DELETE_BACKOFF = float(os.getenv("DEVICE_DELETE_BACKOFF", "0.5"))
+
+# Limpieza de cuentas vencidas (eliminaciones simultáneas por servidor y cuentas por transacción)
+EXPIRED_ACCOUNTS_CONCURRENCY_PER_SERVER = int(os.getenv("EXPIRED_ACCOUNTS_CONCURRENCY_PER_SERVER", "5"))
+EXPIRED_ACCOUNTS_BATCH_SIZE = int(os.getenv("EXPIRED_ACCOUNTS_BATCH_SIZE", "200"))
+
 # Environment
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 
@@ -71,3 +147,32 @@ DEFAULT_ROLES = [
     {"name": "ADMIN", "description": "Administrador del sistema", "is_admin": True},
     {"name": "SUPERRESELLER", "description": "Revendedor premium con precios especiales", "is_admin": False}
 ]
+
+# Cola de salida de mensajes de Telegram (mensajes/s global, por chat privado y por grupo; workers y reintentos)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "0.33"))
+TELEGRAM_SEND_WORKERS = int(os.getenv("TELEGRAM_SEND_WORKERS", "8"))
+TELEGRAM_SEND_MAX_RETRIES = int(os.getenv("TELEGRAM_SEND_MAX_RETRIES", "3"))
+
+# Informes a administradores: filas de detalle a partir de las cuales se envían como archivo (csv o ndjson)
+REPORT_ATTACHMENT_THRESHOLD = int(os.getenv("REPORT_ATTACHMENT_THRESHOLD", "30"))
+REPORT_ATTACHMENT_FORMAT = os.getenv("REPORT_ATTACHMENT_FORMAT", "csv").lower()
+
+# Exportación de cuentas (/list_accounts): filas leídas de la base de datos en cada bloque
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "2000"))
+
+# Usuarios por página en /list
+USER_LIST_PAGE_SIZE = int(os.getenv("USER_LIST_PAGE_SIZE", "10"))
+
+# Compras masivas: cuentas máximas por pedido, creaciones simultáneas por servidor y reparto entre servidores
+BULK_MAX_ACCOUNTS = int(os.getenv("BULK_MAX_ACCOUNTS", "50"))
+BULK_CONCURRENCY_PER_SERVER = int(os.getenv("BULK_CONCURRENCY_PER_SERVER", "4"))
+BULK_SPREAD_ACROSS_SERVERS = os.getenv("BULK_SPREAD_ACROSS_SERVERS", "true").lower() == "true"
+
+# Pool de usuarios precreados (deshabilitados) por servidor y plan para crear cuentas al instante; 0 lo desactiva
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "0"))
+WARM_POOL_PLANS = [plan.strip() for plan in os.getenv("WARM_POOL_PLANS", "1_screen").split(",") if plan.strip()]
+# Segundos entre reposiciones/conciliaciones del pool y creaciones simultáneas por servidor al reponerlo
+WARM_POOL_REFILL_INTERVAL = int(os.getenv("WARM_POOL_REFILL_INTERVAL", "600"))
+WARM_POOL_CONCURRENCY = int(os.getenv("WARM_POOL_CONCURRENCY", "2"))
@@ -0,0 +1,154 @@
+"""
+Libro de movimientos de créditos (credit_transactions).
+
+Cada cambio de saldo es un UPDATE condicional de users.credits en una sola
+sentencia más una fila en credit_transactions, ambos en la misma transacción:
+
+    UPDATE users SET credits = credits - :p WHERE id = :id AND credits >= :p
+
+La base de datos decide si hay saldo, así que dos compras simultáneas del mismo
+usuario nunca dejan el saldo en negativo ni pierden un descuento, y el bloqueo
+de la fila solo dura lo que tarda esa transacción corta (no las peticiones a
+Emby/Jellyfin). El saldo de cualquier usuario se puede reconstruir sumando sus
+movimientos (ledger_balance).
+
+Las compras cobran antes de crear la cuenta (charge_credits) y devuelven el
+importe si la creación falla (refund_credits), igual que la reserva de plazas
+de db_locks.
+
+Usage:
+    new_balance = await charge_credits(db_user.id, price, "purchase", reference="EMBY:1_screen")
+    if new_balance is None:
+        return False, "Créditos insuficientes"
+"""
+import logging
+
+from sqlalchemy import func, select, update
+
+from database import CreditTransaction, User, get_async_db_session
+
+logger = logging.getLogger(__name__)
+
+# Movimientos mostrados por /credits history
+CREDIT_HISTORY_LIMIT = 15
+
+
+def _record(session, user_id, amount, balance_after, reason, reference):
+    session.add(CreditTransaction(
+        user_id=user_id,
+        amount=amount,
+        balance_after=balance_after,
+        reason=reason,
+        reference=reference
+    ))
+
+
+async def debit_credits(session, user_id, amount, reason, reference=None):
+    """
+    Descuenta créditos solo si el usuario tiene saldo suficiente.
+
+    Args:
+        session: AsyncSession; el cargo se confirma con su transacción
+        user_id: ID interno (users.id) del usuario
+        amount: Importe a descontar (positivo)
+        reason: Motivo del movimiento ("purchase", "renewal", "admin_remove", ...)
+        reference: Texto opcional que identifica el origen del movimiento
+
+    Returns:
+        float: Saldo tras el cargo, o None si el saldo no alcanzaba
+    """
+    new_balance = await session.scalar(
+        update(User)
+        .where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .returning(User.credits)
+    )
+    if new_balance is None:
+        return None
+
+    _record(session, user_id, -amount, new_balance, reason, reference)
+    return new_balance
+
+
+async def credit_credits(session, user_id, amount, reason, reference=None):
+    """
+    Abona créditos a un usuario.
+
+    Returns:
+        float: Saldo tras el abono, o None si el usuario no existe
+    """
+    new_balance = await session.scalar(
+        update(User)
+        .where(User.id == user_id)
+        .values(credits=User.credits + amount)
+        .returning(User.credits)
+    )
+    if new_balance is None:
+        return None
+
+    _record(session, user_id, amount, new_balance, reason, reference)
+    return new_balance
+
+
+async def set_credits(session, user_id, credits, reason, reference=None):
+    """
+    Fija el saldo de un usuario registrando la diferencia como un movimiento.
+
+    Los saldos infinitos (administradores) no se registran en el libro; al
+    pasar de infinito a un saldo finito la diferencia se calcula respecto a la
+    suma de los movimientos, para que el libro vuelva a cuadrar.
+
+    Returns:
+        float: Saldo anterior, o None si el usuario no existe
+    """
+    old_credits = await session.scalar(
+        select(User.credits).where(User.id == user_id).with_for_update()
+    )
+    if old_credits is None:
+        return None
+
+    await session.execute(update(User).where(User.id == user_id).values(credits=credits))
+    if credits != float('inf'):
+        previous = old_credits if old_credits != float('inf') else await ledger_balance(session, user_id)
+        if credits != previous:
+            _record(session, user_id, credits - previous, credits, reason, reference)
+    return old_credits
+
+
+async def charge_credits(user_id, amount, reason, reference=None):
+    """
+    Cobra una compra en su propia transacción, confirmada antes de crear la cuenta.
+
+    Returns:
+        float: Saldo tras el cargo, o None si el saldo no alcanzaba
+    """
+    async with get_async_db_session() as session:
+        return await debit_credits(session, user_id, amount, reason, reference)
+
+
+async def refund_credits(user_id, amount, reference=None):
+    """Devuelve un cargo de charge_credits si la creación de la cuenta falló"""
+    try:
+        async with get_async_db_session() as session:
+            await credit_credits(session, user_id, amount, "refund", reference)
+    except Exception as e:
+        logger.error(f"Error al devolver {amount} créditos al usuario {user_id}: {e}")
+
+
+async def get_credit_history(session, user_id, limit=CREDIT_HISTORY_LIMIT):
+    """Últimos movimientos de un usuario, del más reciente al más antiguo"""
+    result = await session.scalars(
+        select(CreditTransaction)
+        .where(CreditTransaction.user_id == user_id)
+        .order_by(CreditTransaction.created_date.desc(), CreditTransaction.id.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def ledger_balance(session, user_id):
+    """Saldo de un usuario reconstruido a partir de sus movimientos"""
+    return await session.scalar(
+        select(func.coalesce(func.sum(CreditTransaction.amount), 0.0))
+        .where(CreditTransaction.user_id == user_id)
+    ) or 0.0
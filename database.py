@@ -1,15 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean, JSON, DateTime, BigInteger, text, inspect
+from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Boolean, JSON, DateTime, BigInteger, Index, text, inspect
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, select, func, case
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 import datetime
-from config import DB_URL, DEFAULT_EMBY_PRICES, DEFAULT_JELLYFIN_PRICES, DEFAULT_ROLES, SUPER_ADMIN_IDS
+from config import DB_URL, ASYNC_DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DEFAULT_EMBY_PRICES, DEFAULT_JELLYFIN_PRICES, DEFAULT_ROLES, SUPER_ADMIN_IDS
 
 # Configurar engine con connection pooling
 engine = create_engine(
     DB_URL,
-    pool_size=10,  # Número de conexiones permanentes en el pool
-    max_overflow=20,  # Conexiones adicionales cuando se necesiten
+    pool_size=DB_POOL_SIZE,  # Número de conexiones permanentes en el pool
+    max_overflow=DB_MAX_OVERFLOW,  # Conexiones adicionales cuando se necesiten
     pool_pre_ping=True,  # Verificar conexión antes de usar
     pool_recycle=3600,  # Reciclar conexiones cada hora
     echo=False  # No mostrar SQL en logs (cambiar a True para debugging)
@@ -17,9 +18,25 @@ engine = create_engine(
 Base = declarative_base()
 Session = sessionmaker(bind=engine)
 
+# Engine asíncrono para los handlers y tareas programadas.
+# Comparte la misma configuración de pool que el engine síncrono, que queda
+# reservado para la inicialización de la base de datos al arrancar.
+# aiosqlite usa NullPool, que no admite pool_size ni max_overflow.
+_async_pool_options = {} if ASYNC_DB_URL.startswith("sqlite") else {"pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW}
+async_engine = create_async_engine(
+    ASYNC_DB_URL,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    echo=False,
+    **_async_pool_options
+)
+# expire_on_commit=False: en modo asíncrono no se pueden recargar atributos de forma
+# perezosa, así que los objetos deben seguir siendo legibles después del commit
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 
 # Context manager para manejar sesiones de forma segura
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 
 
 @contextmanager
@@ -44,6 +61,29 @@ def get_db_session():
     finally:
         session.close()
 
+
+@asynccontextmanager
+async def get_async_db_session():
+    """
+    Equivalente asíncrono de get_db_session.
+    Las consultas se ejecutan sin bloquear el event loop del bot.
+
+    Usage:
+        async with get_async_db_session() as session:
+            user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+            # ... operaciones ...
+        # commit/rollback y close se ejecutan automáticamente al salir del contexto
+    """
+    session = AsyncSessionLocal()
+    try:
+        yield session
+        await session.commit()
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        await session.close()
+
 class Role(Base):
     __tablename__ = 'roles'
     
@@ -89,9 +129,18 @@ class User(Base):
     joined_date = Column(DateTime, default=datetime.datetime.utcnow)
     
     accounts = relationship("Account", back_populates="user")
+    
+    __table_args__ = (
+        # Paginación por clave de /list (orden por rol e id)
+        Index('ix_users_role_id', 'role', 'id'),
+    )
 
 class Price(Base):
     __tablename__ = 'prices'
+    __table_args__ = (
+        # Un único precio por servicio, rol y plan (el código lo busca con .first())
+        Index('uq_prices_service_role_plan', 'service', 'role', 'plan', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     service = Column(String)  # "EMBY" or "JELLYFIN"
@@ -148,13 +197,30 @@ class Account(Base):
     username = Column(String)
     password = Column(String)
     plan = Column(String)  # "1_screen", "2_screens", etc.
-    server_id = Column(Integer)
+    server_id = Column(Integer, ForeignKey('servers.id', ondelete='SET NULL', name='fk_accounts_server_id'))
     service_user_id = Column(String)  # ID del usuario en el servicio (Emby/Jellyfin)
     expiry_date = Column(DateTime)
     is_active = Column(Boolean, default=True)
     created_date = Column(DateTime, default=datetime.datetime.utcnow)
     
     user = relationship("User", back_populates="accounts")
+    # Cargar con joinedload(Account.server) al recorrer varias cuentas (la sesión asíncrona no admite carga diferida)
+    server = relationship("Server", back_populates="accounts")
+    
+    __table_args__ = (
+        # Cuentas activas por servidor (conteos, reportes y límites de dispositivos)
+        Index('ix_accounts_server_active', 'server_id', 'is_active'),
+        # Búsqueda por nombre de usuario al renovar o eliminar
+        Index('ix_accounts_service_username', 'service', 'username'),
+        # Índice parcial: check_expired_accounts solo recorre cuentas activas
+        Index(
+            'ix_accounts_active_expiry', 'expiry_date',
+            postgresql_where=text('is_active'),
+            sqlite_where=text('is_active')
+        ),
+        # Conteo diario de demos en check_demo_limit y listado de cuentas por usuario
+        Index('ix_accounts_user_plan_active_created', 'user_id', 'plan', 'is_active', 'created_date'),
+    )
 
 class Server(Base):
     __tablename__ = 'servers'
@@ -170,14 +236,50 @@ class Server(Base):
     max_users = Column(Integer)      # Límite máximo de usuarios
     current_users = Column(Integer, default=0)
     is_active = Column(Boolean, default=True)
+    
+    # Al eliminar un servidor la base de datos deja server_id en NULL en sus cuentas
+    accounts = relationship("Account", back_populates="server", passive_deletes=True)
 
-def check_demo_limit(user_id, session=None):
+class PooledUser(Base):
+    __tablename__ = 'pooled_users'
+
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, ForeignKey('servers.id', ondelete='CASCADE'), nullable=False)
+    plan = Column(String, nullable=False)
+    username = Column(String, nullable=False)
+    password = Column(String, nullable=False)
+    service_user_id = Column(String, nullable=False)  # Usuario deshabilitado ya creado en el servidor
+    created_date = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Reclamar y contar usuarios libres de un servidor y plan
+        Index('ix_pooled_users_server_plan', 'server_id', 'plan'),
+    )
+
+class CreditTransaction(Base):
+    __tablename__ = 'credit_transactions'
+
+    id = Column(Integer, primary_key=True)
+    # SET NULL: los movimientos se conservan aunque se elimine el usuario (/deluser)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    amount = Column(Float, nullable=False)  # Negativo en los cargos, positivo en abonos y devoluciones
+    balance_after = Column(Float, nullable=False)  # Saldo del usuario tras el movimiento
+    reason = Column(String, nullable=False)  # "purchase", "renewal", "refund", "admin_add", ...
+    reference = Column(String, nullable=True)  # Cuenta o comando que originó el movimiento
+    created_date = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        # Historial de /credits history (movimientos de un usuario por fecha)
+        Index('ix_credit_transactions_user_created', 'user_id', 'created_date'),
+    )
+
+async def check_demo_limit(user_id, session=None):
     """
     Verifica si un usuario ha alcanzado el límite diario de demos (3 por día)
     
     Args:
         user_id: ID del usuario en la base de datos
-        session: Sesión de base de datos (opcional, se crea una nueva si no se proporciona)
+        session: Sesión asíncrona de base de datos (opcional, se crea una nueva si no se proporciona)
     
     Returns:
         tuple: (can_create, current_count, limit) 
@@ -187,7 +289,7 @@ def check_demo_limit(user_id, session=None):
     """
     close_session = False
     if session is None:
-        session = Session()
+        session = AsyncSessionLocal()
         close_session = True
     
     try:
@@ -195,12 +297,14 @@ def check_demo_limit(user_id, session=None):
         today = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
         
         # Contar demos activos creados hoy
-        demo_count = session.query(Account).filter(
-            Account.user_id == user_id,
-            Account.plan == 'demo',
-            Account.is_active == True,
-            Account.created_date >= today
-        ).count()
+        demo_count = await session.scalar(
+            select(func.count()).select_from(Account).filter(
+                Account.user_id == user_id,
+                Account.plan == 'demo',
+                Account.is_active == True,
+                Account.created_date >= today
+            )
+        )
         
         limit = 3
         can_create = demo_count < limit
@@ -216,172 +320,40 @@ def check_demo_limit(user_id, session=None):
     
     finally:
         if close_session:
-            session.close()
-
-def update_servers_table():
-    """Actualiza la tabla servers con las columnas necesarias"""
-    from sqlalchemy import inspect
-    
-    connection = engine.connect()
-    
-    try:
-        # Verificar si la tabla existe
-        inspector = inspect(engine)
-        if 'servers' not in inspector.get_table_names():
-            print("La tabla servers no existe aún, se creará con todas las columnas.")
-            return
-        
-        # Lista de columnas a verificar y añadir si no existen
-        columns_to_add = {
-            'admin_username': 'VARCHAR',
-            'admin_id': 'VARCHAR',
-            'max_devices': 'INTEGER',
-            'max_users': 'INTEGER'
-        }
-        
-        # Lista blanca de nombres de columnas y tipos permitidos
-        ALLOWED_COLUMNS = {'admin_username', 'admin_id', 'max_devices', 'max_users'}
-        ALLOWED_TYPES = {'VARCHAR', 'INTEGER'}
-
-        # Verificar cada columna individualmente
-        for column_name, column_type in columns_to_add.items():
-            try:
-                # VALIDACIÓN ESTRICTA: Solo permitir columnas de la lista blanca
-                if column_name not in ALLOWED_COLUMNS:
-                    raise ValueError(f"Nombre de columna no permitido: {column_name}")
-                if column_type not in ALLOWED_TYPES:
-                    raise ValueError(f"Tipo de columna no permitido: {column_type}")
-
-                # Verificar si la columna existe usando parámetros preparados
-                result = connection.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name='servers' AND column_name=:col_name"
-                ), {"col_name": column_name})
-                rows = result.fetchall()
-
-                if len(rows) == 0:
-                    # Añadir la columna si no existe
-                    # Seguro porque column_name y column_type están validados contra lista blanca
-                    connection.execute(text(
-                        f"ALTER TABLE servers ADD COLUMN {column_name} {column_type}"
-                    ))
-                    connection.commit()
-                    print(f"Columna {column_name} añadida correctamente.")
-                else:
-                    print(f"La columna {column_name} ya existe.")
-            except Exception as e:
-                print(f"Error al verificar o añadir la columna {column_name}: {e}")
-        
-        print("Verificación y actualización de columnas completada.")
-        
-    except Exception as e:
-        print(f"Error al actualizar la tabla servers: {e}")
-    finally:
-        connection.close()
+            await session.close()
 
-def update_account_table():
-    """Actualiza la tabla accounts con las columnas necesarias"""
-    connection = engine.connect()
+async def get_server_device_totals(session, server_ids, device_weights):
+    """
+    Dispositivos teóricos de las cuentas activas de cada servidor, en una sola consulta agrupada
     
-    try:
-        # Verificar si la tabla existe
-        inspector = inspect(engine)
-        if 'accounts' not in inspector.get_table_names():
-            print("La tabla accounts no existe aún, se creará con todas las columnas.")
-            return
-        
-        # Verificar si la columna service_user_id existe
-        result = connection.execute(text(
-            "SELECT column_name FROM information_schema.columns "
-            "WHERE table_name='accounts' AND column_name=:col_name"
-        ), {"col_name": "service_user_id"})
-        rows = result.fetchall()
-
-        if len(rows) == 0:
-            # Añadir la columna si no existe
-            connection.execute(text(
-                "ALTER TABLE accounts ADD COLUMN service_user_id VARCHAR"
-            ))
-            connection.commit()
-            print("Columna service_user_id añadida correctamente a la tabla accounts.")
-        else:
-            print("La columna service_user_id ya existe en la tabla accounts.")
-        
-    except Exception as e:
-        print(f"Error al actualizar la tabla accounts: {e}")
-    finally:
-        connection.close()
-
-def update_roles_table():
-    """Crea y actualiza la tabla roles si es necesario"""
-    connection = engine.connect()
+    Args:
+        session: Sesión asíncrona de base de datos
+        server_ids: IDs de los servidores a consultar
+        device_weights: Diccionario plan -> dispositivos (los planes no incluidos cuentan 0)
     
-    try:
-        # Verificar si la tabla existe
-        inspector = inspect(engine)
-        if 'roles' not in inspector.get_table_names():
-            print("La tabla roles no existe aún, se creará con todas las columnas.")
-            return
-        
-        # Lista de columnas a verificar y añadir si no existen
-        columns_to_add = {
-            'description': 'VARCHAR',
-            'is_admin': 'BOOLEAN DEFAULT FALSE',
-            'created_date': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
-        }
-        
-        # Lista blanca de nombres de columnas y tipos permitidos para roles
-        ALLOWED_ROLE_COLUMNS = {'description', 'is_admin', 'created_date'}
-        ALLOWED_ROLE_TYPES = {
-            'VARCHAR',
-            'BOOLEAN DEFAULT FALSE',
-            'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
-        }
-
-        # Verificar cada columna individualmente
-        for column_name, column_type in columns_to_add.items():
-            try:
-                # VALIDACIÓN ESTRICTA: Solo permitir columnas de la lista blanca
-                if column_name not in ALLOWED_ROLE_COLUMNS:
-                    raise ValueError(f"Nombre de columna no permitido para roles: {column_name}")
-                if column_type not in ALLOWED_ROLE_TYPES:
-                    raise ValueError(f"Tipo de columna no permitido para roles: {column_type}")
-
-                # Verificar si la columna existe usando parámetros preparados
-                result = connection.execute(text(
-                    "SELECT column_name FROM information_schema.columns "
-                    "WHERE table_name='roles' AND column_name=:col_name"
-                ), {"col_name": column_name})
-                rows = result.fetchall()
-
-                if len(rows) == 0:
-                    # Añadir la columna si no existe
-                    # Seguro porque column_name y column_type están validados contra lista blanca
-                    connection.execute(text(
-                        f"ALTER TABLE roles ADD COLUMN {column_name} {column_type}"
-                    ))
-                    connection.commit()
-                    print(f"Columna {column_name} añadida correctamente a la tabla roles.")
-                else:
-                    print(f"La columna {column_name} ya existe en la tabla roles.")
-            except Exception as e:
-                print(f"Error al verificar o añadir la columna {column_name} a roles: {e}")
-        
-        print("Verificación y actualización de columnas de roles completada.")
-        
-    except Exception as e:
-        print(f"Error al actualizar la tabla roles: {e}")
-    finally:
-        connection.close()
+    Returns:
+        dict: server_id -> dispositivos (los servidores sin cuentas activas no aparecen)
+    """
+    device_count = func.sum(case(device_weights, value=Account.plan, else_=0))
+    rows = await session.execute(
+        select(Account.server_id, device_count)
+        .filter(Account.server_id.in_(server_ids), Account.is_active == True)
+        .group_by(Account.server_id)
+    )
+    return {server_id: int(devices or 0) for server_id, devices in rows}
 
 def init_db():
     """Inicializa la base de datos"""
-    Base.metadata.create_all(engine)
+    from migrations import HEAD_VERSION, get_current_version, run_migrations
     
-    # Actualizar las tablas si es necesario
-    update_servers_table()
-    update_account_table()
-    update_roles_table()
+    # Una sola consulta decide si el esquema ya está en la última versión
+    current_version = get_current_version(engine)
+    if current_version != HEAD_VERSION:
+        # Sin schema_version ni tablas previas se trata de una instalación nueva:
+        # create_all crea el esquema completo y solo hay que registrar la versión
+        fresh_install = current_version is None and 'accounts' not in inspect(engine).get_table_names()
+        Base.metadata.create_all(engine)
+        run_migrations(engine, current_version, fresh_install)
     
     session = Session()
     
@@ -5,46 +5,169 @@ import threading
 import logging
 from contextlib import contextmanager
 
+from sqlalchemy import case, func, select, update
+
+from config import BULK_SPREAD_ACROSS_SERVERS
+from database import PooledUser, Server, get_async_db_session
+from placement import rank_servers
+from warm_pool import is_pooled_plan
+
 logger = logging.getLogger(__name__)
 
-# Locks globales para operaciones críticas
-_server_update_locks = {}
-_lock_creation_lock = threading.Lock()
+
+def _pool_held_slots(plan=None, wanted=1):
+    """
+    Plazas del servidor (correlacionado con Server.id) ocupadas por usuarios del pool.
+
+    Los usuarios precreados existen en el servidor pero no cuentan en current_users,
+    así que una reserva debe dejarles sitio. Si el plan se entrega desde el pool,
+    hasta wanted de sus usuarios se descuentan: la compra los reclamará en lugar
+    de crear usuarios nuevos.
+    """
+    pooled = select(func.count(PooledUser.id)).where(PooledUser.server_id == Server.id)
+    held = pooled.scalar_subquery()
+    if plan is None or not is_pooled_plan(plan):
+        return held
+
+    claimable = pooled.where(PooledUser.plan == plan).scalar_subquery()
+    return held - case((claimable > wanted, wanted), else_=claimable)
 
 
-def get_server_lock(server_id):
+async def reserve_server_slot(service, server_id=None, plan=None):
     """
-    Obtiene un lock para un servidor específico.
-    Esto previene race conditions al actualizar contadores de usuarios y dispositivos.
+    Reserva una plaza de usuario en un servidor antes de crear la cuenta.
+
+    La reserva es un único UPDATE condicional (current_users < max_users) con
+    RETURNING, confirmado en su propia transacción: la base de datos garantiza
+    que varias creaciones simultáneas, en cualquier número de procesos del bot,
+    nunca superan max_users, sin locks en memoria que bloqueen el event loop.
+    Si la creación falla después, la plaza se devuelve con release_server_slot.
+    Las plazas de los usuarios del pool precreado (warm_pool) no se venden.
 
     Args:
-        server_id: ID del servidor
+        service: "EMBY" o "JELLYFIN"
+        server_id: Servidor concreto, o None para el menos cargado según placement.rank_servers
+        plan: Plan de la cuenta (si se entrega desde el pool puede ocupar la plaza de un usuario precreado)
 
     Returns:
-        threading.Lock: Lock para el servidor
+        Server: El servidor reservado (con current_users ya incrementado) o None si no hay plazas
     """
-    with _lock_creation_lock:
-        if server_id not in _server_update_locks:
-            _server_update_locks[server_id] = threading.Lock()
-        return _server_update_locks[server_id]
+    async with get_async_db_session() as session:
+        if server_id is not None:
+            candidate_ids = [server_id]
+        else:
+            candidate_ids = await rank_servers(session, service)
 
+        # Si otro proceso llena el candidato entre la consulta y el UPDATE, se prueba el siguiente
+        for candidate_id in candidate_ids:
+            server = await session.scalar(
+                update(Server)
+                .where(
+                    Server.id == candidate_id,
+                    Server.service == service,
+                    Server.is_active == True,
+                    Server.current_users + _pool_held_slots(plan) < Server.max_users
+                )
+                .values(current_users=Server.current_users + 1)
+                .returning(Server)
+            )
+            if server is not None:
+                return server
 
-@contextmanager
-def atomic_server_update(server_id):
+    return None
+
+
+async def _reserve_up_to(session, service, server_id, wanted, plan=None):
+    """Reserva hasta wanted plazas en un servidor con un UPDATE condicional; devuelve (Server, plazas)"""
+    while wanted > 0:
+        free = await session.scalar(
+            select(Server.max_users - Server.current_users - _pool_held_slots(plan, wanted)).where(
+                Server.id == server_id,
+                Server.service == service,
+                Server.is_active == True
+            )
+        )
+        take = min(wanted, free or 0)
+        if take <= 0:
+            break
+
+        server = await session.scalar(
+            update(Server)
+            .where(
+                Server.id == server_id,
+                Server.service == service,
+                Server.is_active == True,
+                Server.current_users + _pool_held_slots(plan, take) + take <= Server.max_users
+            )
+            .values(current_users=Server.current_users + take)
+            .returning(Server)
+        )
+        if server is not None:
+            return server, take
+        # Otro proceso tomó plazas entre la lectura y el UPDATE, o se descontaban más
+        # usuarios del pool de los que caben en take: volver a leer sin pedir más de take
+        wanted = take
+
+    return None, 0
+
+
+async def reserve_server_slots(service, count, spread=BULK_SPREAD_ACROSS_SERVERS, plan=None):
     """
-    Context manager para garantizar actualizaciones atómicas de servidores.
+    Reserva de una vez count plazas para una compra masiva (todas o ninguna).
+
+    Los servidores se recorren en el orden de placement.rank_servers. Con
+    spread, la primera pasada toma como máximo count / servidores plazas de
+    cada uno para repartir las cuentas, y la segunda completa con los que
+    aún tengan sitio. Todas las reservas se confirman en una sola transacción.
+    Como en reserve_server_slot, las plazas del pool solo las ocupa su plan.
 
-    Usage:
-        with atomic_server_update(server.id):
-            server.current_users += 1
-            session.commit()
+    Returns:
+        list: [(Server, plazas reservadas)] o None si no hay plazas suficientes
     """
-    lock = get_server_lock(server_id)
-    lock.acquire()
+    async with get_async_db_session() as session:
+        candidate_ids = await rank_servers(session, service)
+        if not candidate_ids:
+            return None
+
+        caps = [count]
+        if spread:
+            caps.insert(0, -(-count // len(candidate_ids)))
+
+        servers = {}
+        reserved = {}
+        remaining = count
+        for cap in caps:
+            for candidate_id in candidate_ids:
+                wanted = min(remaining, cap - reserved.get(candidate_id, 0))
+                if wanted <= 0:
+                    continue
+                server, taken = await _reserve_up_to(session, service, candidate_id, wanted, plan)
+                if taken:
+                    servers[candidate_id] = server
+                    reserved[candidate_id] = reserved.get(candidate_id, 0) + taken
+                    remaining -= taken
+
+        if remaining > 0:
+            await session.rollback()
+            return None
+
+    return [(servers[server_id], taken) for server_id, taken in reserved.items()]
+
+
+async def release_server_slot(server_id, count=1):
+    """Devuelve plazas reservadas con reserve_server_slot(s) si la creación de las cuentas falló"""
     try:
-        yield
-    finally:
-        lock.release()
+        async with get_async_db_session() as session:
+            await session.execute(
+                update(Server)
+                .where(Server.id == server_id, Server.current_users > 0)
+                .values(current_users=case(
+                    (Server.current_users > count, Server.current_users - count),
+                    else_=0
+                ))
+            )
+    except Exception as e:
+        logger.error(f"Error al liberar {count} plazas reservadas en el servidor {server_id}: {e}")
 
 
 # Lock global para operaciones de dispositivos
@@ -0,0 +1,85 @@
+"""
+Cola de eliminación de dispositivos con concurrencia limitada y reintentos.
+
+Un número fijo de workers (DEVICE_DELETE_CONCURRENCY) consume los IDs de una
+asyncio.Queue y llama a MediaServerClient.delete_device. Los errores de
+conexión y las respuestas 5xx se reintentan hasta DEVICE_DELETE_MAX_RETRIES
+veces con espera exponencial (DEVICE_DELETE_BACKOFF * 2^intento, más un
+desfase aleatorio). Si el circuito del servidor se abre, los dispositivos
+pendientes se descartan sin contactar al servidor.
+
+Usage:
+    async with media_server_client(server) as media:
+        results = await delete_devices(media, device_ids)
+"""
+import asyncio
+import logging
+import random
+
+import httpx
+
+from config import DEVICE_DELETE_CONCURRENCY, DEVICE_DELETE_MAX_RETRIES, DEVICE_DELETE_BACKOFF
+from media_client import MediaServerError, ServerUnavailableError
+
+logger = logging.getLogger(__name__)
+
+
+def _is_retryable(error):
+    if isinstance(error, ServerUnavailableError):
+        return False
+    if isinstance(error, httpx.RequestError):
+        return True
+    return isinstance(error, MediaServerError) and error.status_code is not None and error.status_code >= 500
+
+
+async def _delete_with_retry(media, device_id, max_retries, backoff):
+    attempt = 0
+    while True:
+        try:
+            return await media.delete_device(device_id)
+        except Exception as e:
+            if attempt >= max_retries or not _is_retryable(e):
+                raise
+            delay = backoff * (2 ** attempt) * (1 + random.random() / 2)
+            attempt += 1
+            logger.warning(
+                f"Error al eliminar el dispositivo {device_id} de {media.name}, "
+                f"reintento {attempt}/{max_retries} en {delay:.1f}s: {e}"
+            )
+            await asyncio.sleep(delay)
+
+
+async def delete_devices(media, device_ids, concurrency=DEVICE_DELETE_CONCURRENCY,
+                         max_retries=DEVICE_DELETE_MAX_RETRIES, backoff=DEVICE_DELETE_BACKOFF):
+    """
+    Elimina varios dispositivos de un servidor con concurrencia limitada.
+
+    Args:
+        media: MediaServerClient del servidor
+        device_ids: IDs de los dispositivos a eliminar
+        concurrency: Eliminaciones simultáneas como máximo
+        max_retries: Reintentos por dispositivo ante errores transitorios
+        backoff: Espera base en segundos entre reintentos
+
+    Returns:
+        dict: device_id -> True (eliminado), False (ya no existía) o la excepción del último intento
+    """
+    queue = asyncio.Queue()
+    for device_id in device_ids:
+        queue.put_nowait(device_id)
+
+    results = {}
+
+    async def worker():
+        while True:
+            try:
+                device_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                results[device_id] = await _delete_with_retry(media, device_id, max_retries, backoff)
+            except Exception as e:
+                results[device_id] = e
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, queue.qsize()))))
+    return results
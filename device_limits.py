@@ -0,0 +1,161 @@
+"""
+Evaluación de los límites de dispositivos por plan.
+
+Funciones puras (sin acceso a red ni a la base de datos) que usan
+process_emby_server_device_limits y process_jellyfin_server_device_limits:
+los dispositivos se agrupan por LastUserId y las cuentas por service_user_id
+en una sola pasada, y para cada usuario que excede su límite se eligen los
+dispositivos sobrantes sin recorrer la lista completa de dispositivos.
+"""
+from datetime import datetime
+
+# Configuración de límites de dispositivos por plan (centralizada)
+DEVICE_LIMITS = {
+    'EMBY': {
+        '1_screen': 1,
+        'live_tv': 1,
+        'demo': 1,
+        '2_screens': 2,
+        '2_screens_tv': 2,
+        'bulk': 3,
+        '3_screens': 3,
+        '3_screens_tv': 3
+    },
+    'JELLYFIN': {
+        '1_screen': 1,
+        'live_tv': 1,
+        'demo': 1,
+        '3_screens': 3,
+        '3_screens_tv': 3,
+        'bulk': 5,
+        '2_screens': 2,
+        '2_screens_tv': 2
+    }
+}
+
+
+def group_devices_by_user(devices):
+    """Agrupa los dispositivos por LastUserId en una sola pasada"""
+    devices_by_user = {}
+    for device in devices:
+        user_id = device.get('LastUserId')
+        if user_id:
+            devices_by_user.setdefault(user_id, []).append(device)
+    return devices_by_user
+
+
+def _activity_date(device):
+    """Fecha de última actividad (ISO 8601) o None si falta o no es válida"""
+    last_activity = device.get('DateLastActivity')
+    if not last_activity:
+        return None
+    try:
+        return datetime.fromisoformat(last_activity.replace('Z', '+00:00'))
+    except (ValueError, TypeError):
+        return None
+
+
+def select_excess_devices(user_devices, device_limit, active_device_ids=frozenset()):
+    """
+    Elige los dispositivos a eliminar para que un usuario quede dentro de su límite.
+
+    Orden de eliminación:
+    1. Dispositivos sin fecha de actividad
+    2. Dispositivos con fecha, de más antiguos a más recientes
+    3. Dispositivos con sesión activa que excedan el límite (se conservan
+       hasta device_limit dispositivos activos)
+
+    Args:
+        user_devices: Dispositivos del usuario
+        device_limit: Dispositivos permitidos por su plan
+        active_device_ids: IDs de los dispositivos del usuario con sesión activa
+
+    Returns:
+        list: Dispositivos a eliminar
+    """
+    excess = len(user_devices) - device_limit
+    if excess <= 0:
+        return []
+
+    active_devices = []
+    devices_with_date = []
+    devices_without_date = []
+
+    for device in user_devices:
+        if device.get('Id') in active_device_ids:
+            # Priorizar mantener dispositivos activos
+            active_devices.append(device)
+            continue
+
+        activity_date = _activity_date(device)
+        if activity_date is None:
+            devices_without_date.append(device)
+        else:
+            devices_with_date.append((activity_date, device))
+
+    # Ordenar dispositivos con fecha por más antiguos primero (orden estable ante empates)
+    devices_with_date.sort(key=lambda item: item[0])
+
+    keep_count = min(device_limit, len(active_devices))
+    candidates = devices_without_date + [device for _, device in devices_with_date] + active_devices[keep_count:]
+    return candidates[:excess]
+
+
+def evaluate_device_limits(server_users, accounts, devices_by_user, plan_to_limit,
+                           active_devices_by_user=None, changed_user_ids=None, settled_plans=None):
+    """
+    Determina qué dispositivos sobran en un servidor.
+
+    Args:
+        server_users: Usuarios del servidor
+        accounts: Cuentas activas del servidor en la base de datos
+        devices_by_user: Dispositivos agrupados por LastUserId
+        plan_to_limit: Diccionario plan -> dispositivos permitidos
+        active_devices_by_user: user_id -> IDs de dispositivos con sesión activa
+                                (None si no se priorizan los dispositivos activos)
+        changed_user_ids: Si se indica, los usuarios fuera de este conjunto cuyo plan
+                          coincide con settled_plans se dan por verificados
+        settled_plans: user_id -> plan de los usuarios que ya estaban dentro de su límite
+
+    Returns:
+        Tuple (evaluations, settled):
+            - evaluations: Lista de usuarios verificados, cada uno con user_id, username,
+              plan, device_limit, total_devices y to_remove (dispositivos a eliminar)
+            - settled: user_id -> plan de los usuarios que no necesitan eliminaciones
+    """
+    accounts_by_user_id = {account.service_user_id: account for account in accounts if account.service_user_id}
+    active_devices_by_user = active_devices_by_user or {}
+    settled_plans = settled_plans or {}
+
+    evaluations = []
+    settled = {}
+
+    for user in server_users:
+        user_id = user.get('Id')
+        account = accounts_by_user_id.get(user_id)
+
+        # Saltar usuarios admin o sin cuenta en nuestra base de datos
+        if not account or user.get('Policy', {}).get('IsAdministrator', False):
+            continue
+
+        if changed_user_ids is not None and user_id not in changed_user_ids and settled_plans.get(user_id) == account.plan:
+            settled[user_id] = account.plan
+            continue
+
+        device_limit = plan_to_limit.get(account.plan, 1)
+        user_devices = devices_by_user.get(user_id, [])
+        to_remove = select_excess_devices(user_devices, device_limit, active_devices_by_user.get(user_id, frozenset()))
+
+        if not to_remove:
+            settled[user_id] = account.plan
+
+        evaluations.append({
+            'user_id': user_id,
+            'username': user.get('Name'),
+            'plan': account.plan,
+            'device_limit': device_limit,
+            'total_devices': len(user_devices),
+            'to_remove': to_remove
+        })
+
+    return evaluations, settled
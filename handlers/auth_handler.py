@@ -1,6 +1,9 @@
 from telegram import Update
 from telegram.ext import CallbackContext
-from database import Session, User
+from sqlalchemy import select
+from database import User
+from auth_cache import auth_cache
+from message_queue import broadcast, PRIORITY_INTERACTIVE
 from config import SUPER_ADMIN_IDS, ADMIN_IDS
 from datetime import datetime
 import logging
@@ -9,15 +12,27 @@ from database import Role
 logger = logging.getLogger(__name__)
 
 async def check_authorization(update: Update, context: CallbackContext):
-    """Verifica si un usuario está autorizado para usar el bot"""
+    """
+    Verifica si un usuario está autorizado para usar el bot
+
+    Consulta primero la caché de autorización; solo si no hay entrada válida
+    usa la sesión de la actualización (context.db_session). En ambos casos deja
+    en context.db_user una instantánea de solo lectura (CachedUser) con id, rol,
+    estado de autorización y créditos del usuario.
+    """
     user = update.effective_user
     telegram_id = user.id
     
-    session = Session()
+    cached_user = auth_cache.get(telegram_id)
+    if cached_user is not None:
+        context.db_user = cached_user
+        return telegram_id in ADMIN_IDS or cached_user.is_authorized
+    
+    session = context.db_session
+    db_user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
     
     # Si es SUPER_ADMIN o ADMIN, está autorizado
     if telegram_id in ADMIN_IDS:
-        db_user = session.query(User).filter_by(telegram_id=telegram_id).first()
         if not db_user:
             # Crear usuario si no existe
             db_user = User(
@@ -29,24 +44,22 @@ async def check_authorization(update: Update, context: CallbackContext):
                 is_authorized=True
             )
             session.add(db_user)
-            session.commit()
+            await session.commit()
         
-        session.close()
+        context.db_user = auth_cache.set(db_user)
         return True
     
-    # Para usuarios no-admin, verificar si están en la base de datos y autorizados
-    db_user = session.query(User).filter_by(telegram_id=telegram_id).first()
-    
     # Si el usuario no existe o no está autorizado
     if not db_user or not db_user.is_authorized:
         # Notificar a los admins (si no existe en DB)
         if not db_user:
+            # Sin conexión retenida mientras se avisa a los administradores
+            await session.commit()
             await notify_admins_about_new_user(context, user)
         
-        session.close()
         return False
     
-    session.close()
+    context.db_user = auth_cache.set(db_user)
     return True
 
 async def notify_admins_about_new_user(context: CallbackContext, user):
@@ -59,11 +72,11 @@ async def notify_admins_about_new_user(context: CallbackContext, user):
         f"📅 Fecha: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
     )
     
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=message)
-        except Exception as e:
-            logger.error(f"Error al notificar admin {admin_id}: {e}")
+    # Aviso interactivo: sale por delante de los informes periódicos en la cola de salida
+    results = await broadcast(context.bot.send_message, ADMIN_IDS, PRIORITY_INTERACTIVE, text=message)
+    for admin_id, result in results.items():
+        if isinstance(result, Exception):
+            logger.error(f"Error al notificar admin {admin_id}: {result}")
 
 async def unauthorized_message(update: Update, context: CallbackContext):
     """Mensaje para usuarios no autorizados"""
@@ -1,21 +1,27 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import CallbackContext
-from database import Session, User, Price, Account, Server, check_demo_limit
+from sqlalchemy import select, func, delete, tuple_
+from sqlalchemy.orm import joinedload
+from database import User, Price, Account, Server, check_demo_limit
 from utils.keyboards import main_menu_keyboard
 from utils.helpers import format_credits, get_role_emoji
-from config import ADMIN_IDS, SUPER_ADMIN_IDS
+from config import ADMIN_IDS, SUPER_ADMIN_IDS, USER_LIST_PAGE_SIZE
 from handlers.auth_handler import notify_admins_about_new_user
+from auth_cache import auth_cache
 from audit_logger import (
     log_user_created, log_user_deleted, log_credits_modified,
     log_role_changed, log_price_changed, log_unauthorized_access
 )
 import logging
 from scheduled_tasks import check_expired_accounts
+from account_export import export_accounts_zip
+from credits import credit_credits, debit_credits, set_credits, get_credit_history
 from database import Role
 import psutil
 import io
 import csv
+import html
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
@@ -23,13 +29,13 @@ logger = logging.getLogger(__name__)
 async def start_command(update: Update, context: CallbackContext):
     """Maneja el comando /start"""
     user = update.effective_user
-    session = Session()
+    session = context.db_session
     
     try:
         # Verificar si el usuario es un admin
         if user.id in ADMIN_IDS:
             # Verificar si el admin ya existe en la base de datos
-            db_user = session.query(User).filter_by(telegram_id=user.id).first()
+            db_user = await session.scalar(select(User).filter_by(telegram_id=user.id))
             
             if not db_user:
                 # Crear usuario admin si no existe
@@ -42,7 +48,7 @@ async def start_command(update: Update, context: CallbackContext):
                     is_authorized=True
                 )
                 session.add(db_user)
-                session.commit()
+                await session.commit()
             
             # Mostrar menú principal para admin
             welcome_message = (
@@ -59,7 +65,7 @@ async def start_command(update: Update, context: CallbackContext):
             )
         else:
             # Verificar si el usuario no-admin ya está autorizado
-            db_user = session.query(User).filter_by(telegram_id=user.id).first()
+            db_user = await session.scalar(select(User).filter_by(telegram_id=user.id))
             
             if db_user and db_user.is_authorized:
                 # Usuario existente y autorizado
@@ -89,32 +95,29 @@ async def start_command(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"Error en start_command: {e}")
         await update.message.reply_text("❌ Ocurrió un error al iniciar.")
-    finally:
-        session.close()
 
 async def price_command(update: Update, context: CallbackContext):
     """Maneja el comando /price para gestionar precios"""
     user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN y ADMIN pueden gestionar precios
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para gestionar precios.")
-        session.close()
         return
     
     # Verificar si hay argumentos
     args = context.args
     if not args or len(args) < 3:
         # Obtener todos los roles desde la base de datos
-        roles = session.query(Role).all()
+        roles = (await session.scalars(select(Role))).all()
         role_names = [role.name for role in roles]
         
         # Mostrar precios actuales
-        emby_prices = session.query(Price).filter_by(service="EMBY").all()
-        jellyfin_prices = session.query(Price).filter_by(service="JELLYFIN").all()
+        emby_prices = (await session.scalars(select(Price).filter_by(service="EMBY"))).all()
+        jellyfin_prices = (await session.scalars(select(Price).filter_by(service="JELLYFIN"))).all()
         
         prices_message = "📊 *PRECIOS ACTUALES*\n\n"
         
@@ -145,7 +148,6 @@ async def price_command(update: Update, context: CallbackContext):
         prices_message += "Ejemplo: /price delete EMBY SUPERRESELLER 2\\_screens"
         
         await update.message.reply_text(prices_message, parse_mode=ParseMode.MARKDOWN)
-        session.close()
         return
     
     # Verificar si es comando de eliminar
@@ -158,7 +160,6 @@ async def price_command(update: Update, context: CallbackContext):
                 "Ejemplo: /price delete EMBY SUPERRESELLER 2\\_screens",
                 parse_mode=ParseMode.MARKDOWN
             )
-            session.close()
             return
             
         try:
@@ -168,15 +169,14 @@ async def price_command(update: Update, context: CallbackContext):
             
             if service not in ["EMBY", "JELLYFIN"]:
                 await update.message.reply_text("⚠️ Servicio no válido. Use EMBY o JELLYFIN.")
-                session.close()
                 return
                 
             # Buscar el precio a eliminar
-            price = session.query(Price).filter_by(
+            price = await session.scalar(select(Price).filter_by(
                 service=service,
                 role=role,
                 plan=plan
-            ).first()
+            ))
             
             if not price:
                 await update.message.reply_text(
@@ -185,15 +185,14 @@ async def price_command(update: Update, context: CallbackContext):
                     f"Rol: {role}\n"
                     f"Plan: {plan.replace('_', ' ')}"
                 )
-                session.close()
                 return
                 
             # Guardar información para el mensaje
             amount = price.amount
             
             # Eliminar el precio
-            session.delete(price)
-            session.commit()
+            await session.delete(price)
+            await session.commit()
             
             await update.message.reply_text(
                 f"✅ Precio eliminado correctamente:\n"
@@ -207,7 +206,6 @@ async def price_command(update: Update, context: CallbackContext):
             logger.error(f"Error al eliminar precio: {e}")
             await update.message.reply_text(f"❌ Error: {str(e)}")
             
-        session.close()
         return
     
     # Actualizar precio (código existente)
@@ -219,11 +217,10 @@ async def price_command(update: Update, context: CallbackContext):
         
         if service not in ["EMBY", "JELLYFIN"]:
             await update.message.reply_text("⚠️ Servicio no válido. Use EMBY o JELLYFIN.")
-            session.close()
             return
         
         # Verificar si el rol existe, si no, crearlo automáticamente
-        existing_role = session.query(Role).filter_by(name=role).first()
+        existing_role = await session.scalar(select(Role).filter_by(name=role))
         if not existing_role:
             # Crear el rol automáticamente
             new_role = Role(
@@ -232,24 +229,24 @@ async def price_command(update: Update, context: CallbackContext):
                 is_admin=False
             )
             session.add(new_role)
-            session.commit()
+            await session.commit()
             
             await update.message.reply_text(
                 f"✅ Rol '{role}' creado automáticamente."
             )
         
         # Buscar precio existente
-        price = session.query(Price).filter_by(
+        price = await session.scalar(select(Price).filter_by(
             service=service,
             role=role,
             plan=plan
-        ).first()
+        ))
         
         if price:
             # Actualizar precio existente
             old_amount = price.amount
             price.amount = amount
-            session.commit()
+            await session.commit()
 
             # Registrar en auditoría
             log_price_changed(user.id, service, role, plan, old_amount, amount)
@@ -271,7 +268,7 @@ async def price_command(update: Update, context: CallbackContext):
                 amount=amount
             )
             session.add(new_price)
-            session.commit()
+            await session.commit()
             await update.message.reply_text(
                 f"✅ Nuevo precio añadido:\n"
                 f"Servicio: {service}\n"
@@ -285,19 +282,16 @@ async def price_command(update: Update, context: CallbackContext):
         logger.error(f"Error al actualizar precio: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
     
-    session.close()
 
 async def role_command(update: Update, context: CallbackContext):
     """Maneja el comando /role para gestionar roles"""
-    user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN puede gestionar roles
     if db_user.role != "SUPER_ADMIN":
         await update.message.reply_text("⚠️ No tienes permiso para gestionar roles.")
-        session.close()
         return
     
     # Verificar si hay argumentos
@@ -305,7 +299,6 @@ async def role_command(update: Update, context: CallbackContext):
     if not args:
         # Mostrar ayuda
         await show_role_help(update, session)
-        session.close()
         return
     
     action = args[0].lower()
@@ -313,7 +306,6 @@ async def role_command(update: Update, context: CallbackContext):
     # Listar roles
     if action == "list" or action == "help":
         await list_roles(update, session)
-        session.close()
         return
     
     # Acciones que requieren más argumentos
@@ -322,7 +314,6 @@ async def role_command(update: Update, context: CallbackContext):
             "⚠️ Argumentos insuficientes. Usa `/role help` para ver la ayuda.",
             parse_mode=ParseMode.MARKDOWN
         )
-        session.close()
         return
     
     role_name = args[1].upper()
@@ -342,7 +333,6 @@ async def role_command(update: Update, context: CallbackContext):
             parse_mode=ParseMode.MARKDOWN
         )
     
-    session.close()
 
 async def show_role_help(update, session):
     """Muestra la ayuda del comando role"""
@@ -363,7 +353,7 @@ async def show_role_help(update, session):
 
 async def list_roles(update, session):
     """Lista todos los roles disponibles"""
-    roles = session.query(Role).all()
+    roles = (await session.scalars(select(Role))).all()
     
     if not roles:
         await update.message.reply_text("⚠️ No hay roles definidos en el sistema.")
@@ -373,7 +363,7 @@ async def list_roles(update, session):
     
     for role in roles:
         admin_status = "✅" if role.is_admin else "❌"
-        user_count = session.query(User).filter_by(role=role.name).count()
+        user_count = await session.scalar(select(func.count()).select_from(User).filter_by(role=role.name))
         message += (
             f"• *{role.name}*\n"
             f"  Descripción: {role.description}\n"
@@ -386,7 +376,7 @@ async def list_roles(update, session):
 async def add_role(update, context, session, role_name, args):
     """Añade un nuevo rol"""
     # Verificar si el rol ya existe
-    existing_role = session.query(Role).filter_by(name=role_name).first()
+    existing_role = await session.scalar(select(Role).filter_by(name=role_name))
     if existing_role:
         await update.message.reply_text(
             f"⚠️ El rol '{role_name}' ya existe.\n"
@@ -423,7 +413,8 @@ async def add_role(update, context, session, role_name, args):
     
     try:
         session.add(new_role)
-        session.commit()
+        await session.commit()
+        auth_cache.clear()
         
         await update.message.reply_text(
             f"✅ Rol '{role_name}' creado correctamente.\n"
@@ -431,20 +422,20 @@ async def add_role(update, context, session, role_name, args):
             f"Admin: {'✅' if is_admin else '❌'}"
         )
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         logger.error(f"Error al crear rol: {e}")
         await update.message.reply_text(f"❌ Error al crear rol: {str(e)}")
 
 async def delete_role(update, session, role_name):
     """Elimina un rol existente"""
     # Verificar si el rol existe
-    role = session.query(Role).filter_by(name=role_name).first()
+    role = await session.scalar(select(Role).filter_by(name=role_name))
     if not role:
         await update.message.reply_text(f"⚠️ El rol '{role_name}' no existe.")
         return
     
     # Verificar si hay usuarios con este rol
-    user_count = session.query(User).filter_by(role=role_name).count()
+    user_count = await session.scalar(select(func.count()).select_from(User).filter_by(role=role_name))
     if user_count > 0:
         await update.message.reply_text(
             f"⚠️ No se puede eliminar el rol '{role_name}' porque tiene {user_count} usuarios asignados.\n"
@@ -462,15 +453,16 @@ async def delete_role(update, session, role_name):
     # Eliminar el rol
     try:
         # También eliminar los precios asociados a este rol
-        session.query(Price).filter_by(role=role_name).delete()
+        await session.execute(delete(Price).filter_by(role=role_name))
         
         # Eliminar el rol
-        session.delete(role)
-        session.commit()
+        await session.delete(role)
+        await session.commit()
+        auth_cache.clear()
         
         await update.message.reply_text(f"✅ Rol '{role_name}' eliminado correctamente.")
     except Exception as e:
-        session.rollback()
+        await session.rollback()
         logger.error(f"Error al eliminar rol: {e}")
         await update.message.reply_text(f"❌ Error al eliminar rol: {str(e)}")
 
@@ -478,24 +470,23 @@ async def adduser_command(update: Update, context: CallbackContext):
     """Maneja el comando /adduser para agregar usuarios"""
     user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Verificar si es administrador
-    admin_roles = session.query(Role).filter_by(is_admin=True).all()
+    admin_roles = (await session.scalars(select(Role).filter_by(is_admin=True))).all()
     admin_role_names = [role.name for role in admin_roles]
     
     # Solo usuarios con roles de administrador pueden agregar usuarios
     if db_user.role not in admin_role_names:
         await update.message.reply_text("⚠️ No tienes permiso para agregar usuarios.")
-        session.close()
         return
     
     # Verificar argumentos
     args = context.args
     if not args or len(args) < 3:
         # Obtener roles disponibles para mostrar
-        available_roles = session.query(Role).filter(Role.name != "SUPER_ADMIN").all()
+        available_roles = (await session.scalars(select(Role).filter(Role.name != "SUPER_ADMIN"))).all()
         roles_list = "\n".join([f"• {role.name} - {role.description}" for role in available_roles])
         
         await update.message.reply_text(
@@ -505,7 +496,6 @@ async def adduser_command(update: Update, context: CallbackContext):
             f"{roles_list}",
             parse_mode=ParseMode.HTML
         )
-        session.close()
         return
     
     try:
@@ -514,7 +504,6 @@ async def adduser_command(update: Update, context: CallbackContext):
         # Validar que el telegram_id sea positivo
         if telegram_id <= 0:
             await update.message.reply_text("⚠️ El ID de Telegram debe ser un número positivo.")
-            session.close()
             return
 
         role = args[1].upper()
@@ -523,32 +512,29 @@ async def adduser_command(update: Update, context: CallbackContext):
         # Validar que los créditos no sean negativos
         if credits < 0:
             await update.message.reply_text("⚠️ Los créditos no pueden ser negativos.")
-            session.close()
             return
         
         # Verificar si el rol existe
-        role_exists = session.query(Role).filter_by(name=role).first()
+        role_exists = await session.scalar(select(Role).filter_by(name=role))
         
         if not role_exists:
             # Obtener roles disponibles para mostrar
-            available_roles = session.query(Role).filter(Role.name != "SUPER_ADMIN").all()
+            available_roles = (await session.scalars(select(Role).filter(Role.name != "SUPER_ADMIN"))).all()
             roles_list = ", ".join([role.name for role in available_roles])
             
             await update.message.reply_text(
                 f"⚠️ Rol '{role}' no válido. Roles disponibles: {roles_list}\n\n"
                 "Para añadir un nuevo rol, usa el comando `/role add ROLE DESCRIPCION`"
             )
-            session.close()
             return
         
         # No permitir asignar el rol SUPER_ADMIN a través de este comando
         if role == "SUPER_ADMIN" and db_user.role != "SUPER_ADMIN":
             await update.message.reply_text("⚠️ Solo el Super Admin puede asignar el rol SUPER_ADMIN.")
-            session.close()
             return
         
         # Verificar si el usuario ya existe
-        existing_user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        existing_user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
         
         if existing_user:
             # Actualizar usuario existente
@@ -556,10 +542,12 @@ async def adduser_command(update: Update, context: CallbackContext):
             old_credits = existing_user.credits
             
             existing_user.role = role
-            existing_user.credits = credits
             existing_user.is_authorized = True
+            # La diferencia de saldo queda registrada en el libro de créditos
+            await set_credits(session, existing_user.id, credits, "admin_set", reference=f"admin:{user.id}")
             
-            session.commit()
+            await session.commit()
+            auth_cache.invalidate(telegram_id)
             
             await update.message.reply_text(
                 f"✅ Usuario actualizado:\n"
@@ -574,12 +562,16 @@ async def adduser_command(update: Update, context: CallbackContext):
             new_user = User(
                 telegram_id=telegram_id,
                 role=role,
-                credits=credits,
+                credits=0,
                 is_authorized=True,
                 full_name="Usuario Pendiente"
             )
             session.add(new_user)
-            session.commit()
+            await session.flush()
+            # Saldo inicial como primer movimiento del libro de créditos
+            await set_credits(session, new_user.id, credits, "admin_set", reference=f"admin:{user.id}")
+            await session.commit()
+            auth_cache.invalidate(telegram_id)
 
             # Registrar en auditoría
             log_user_created(telegram_id, user.id, role, credits)
@@ -597,19 +589,17 @@ async def adduser_command(update: Update, context: CallbackContext):
         logger.error(f"Error al agregar usuario: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
     
-    session.close()
 
 async def deluser_command(update: Update, context: CallbackContext):
     """Maneja el comando /deluser para eliminar usuarios"""
     user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN y ADMIN pueden eliminar usuarios
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para eliminar usuarios.")
-        session.close()
         return
     
     # Verificar argumentos
@@ -620,7 +610,6 @@ async def deluser_command(update: Update, context: CallbackContext):
             "Ejemplo: <code>/deluser 123456789</code>",
             parse_mode=ParseMode.HTML
         )
-        session.close()
         return
     
     try:
@@ -629,15 +618,13 @@ async def deluser_command(update: Update, context: CallbackContext):
         # No se puede eliminar al SUPER_ADMIN
         if telegram_id in SUPER_ADMIN_IDS:
             await update.message.reply_text("⚠️ No puedes eliminar a un Super Admin.")
-            session.close()
             return
         
         # Buscar usuario
-        user_to_delete = session.query(User).filter_by(telegram_id=telegram_id).first()
+        user_to_delete = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
         
         if not user_to_delete:
             await update.message.reply_text(f"⚠️ Usuario con ID {telegram_id} no encontrado.")
-            session.close()
             return
         
         # Guardar info para el mensaje
@@ -649,8 +636,9 @@ async def deluser_command(update: Update, context: CallbackContext):
         }
         
         # Eliminar usuario
-        session.delete(user_to_delete)
-        session.commit()
+        await session.delete(user_to_delete)
+        await session.commit()
+        auth_cache.invalidate(telegram_id)
 
         # Registrar en auditoría
         log_user_deleted(telegram_id, user.id, user_info)
@@ -668,32 +656,35 @@ async def deluser_command(update: Update, context: CallbackContext):
         logger.error(f"Error al eliminar usuario: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
     
-    session.close()
 
 async def credits_command(update: Update, context: CallbackContext):
     """Maneja el comando /credits para gestionar créditos"""
     user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN y ADMIN pueden gestionar créditos
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para gestionar créditos.")
-        session.close()
         return
     
     # Verificar argumentos
     args = context.args
+    if args and len(args) == 2 and args[0].lower() == "history":
+        await _show_credit_history(update, session, args[1])
+        return
+
     if not args or len(args) < 3:
         await update.message.reply_text(
             "📝 <b>Uso:</b> /credits [add|remove] TELEGRAM_ID AMOUNT\n"
+            "/credits history TELEGRAM_ID\n"
             "Ejemplos:\n"
             "• <code>/credits add 123456789 10000</code> - Agrega créditos\n"
-            "• <code>/credits remove 123456789 5000</code> - Quita créditos",
+            "• <code>/credits remove 123456789 5000</code> - Quita créditos\n"
+            "• <code>/credits history 123456789</code> - Últimos movimientos",
             parse_mode=ParseMode.HTML
         )
-        session.close()
         return
     
     try:
@@ -704,59 +695,54 @@ async def credits_command(update: Update, context: CallbackContext):
         # Validar telegram_id
         if telegram_id <= 0:
             await update.message.reply_text("⚠️ El ID de Telegram debe ser un número positivo.")
-            session.close()
             return
 
         # Validar amount
         if amount < 0:
             await update.message.reply_text("⚠️ El monto debe ser un número positivo.")
-            session.close()
             return
 
         if action not in ["add", "remove"]:
             await update.message.reply_text("⚠️ Acción no válida. Use 'add' o 'remove'.")
-            session.close()
             return
         
         # Buscar usuario
-        target_user = session.query(User).filter_by(telegram_id=telegram_id).first()
+        target_user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
         
         if not target_user:
             await update.message.reply_text(f"⚠️ Usuario con ID {telegram_id} no encontrado.")
-            session.close()
             return
         
         old_credits = target_user.credits
+        reference = f"admin:{user.id}"
         
-        # Aplicar cambios
+        # Aplicar cambios (UPDATE condicional y movimiento en el libro de créditos)
         if action == "add":
             if target_user.credits == float('inf'):
                 await update.message.reply_text(f"⚠️ El usuario ya tiene créditos infinitos.")
-                session.close()
                 return
             
-            target_user.credits += amount
+            new_credits = await credit_credits(session, target_user.id, amount, "admin_add", reference)
             action_text = "agregados"
         else:  # remove
             if target_user.credits == float('inf'):
                 await update.message.reply_text(f"⚠️ No se pueden quitar créditos de un usuario con créditos infinitos.")
-                session.close()
                 return
             
-            if target_user.credits < amount:
+            new_credits = await debit_credits(session, target_user.id, amount, "admin_remove", reference)
+            if new_credits is None:
                 await update.message.reply_text(f"⚠️ El usuario solo tiene {format_credits(target_user.credits)}.")
-                session.close()
                 return
             
-            target_user.credits -= amount
             action_text = "quitados"
 
-        session.commit()
+        await session.commit()
+        auth_cache.invalidate(telegram_id)
 
         # Registrar en auditoría
         log_credits_modified(
             telegram_id, user.id, action, amount,
-            old_credits, target_user.credits
+            old_credits, new_credits
         )
 
         await update.message.reply_text(
@@ -764,41 +750,85 @@ async def credits_command(update: Update, context: CallbackContext):
             f"Usuario: {target_user.full_name} (ID: {target_user.telegram_id})\n"
             f"Monto: {format_credits(amount)}\n"
             f"Créditos anteriores: {format_credits(old_credits)}\n"
-            f"Créditos actuales: {format_credits(target_user.credits)}"
+            f"Créditos actuales: {format_credits(new_credits)}"
         )
     except ValueError:
         await update.message.reply_text("⚠️ ID y monto deben ser números.")
     except Exception as e:
         logger.error(f"Error al gestionar créditos: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
+
+
+CREDIT_REASON_LABELS = {
+    "purchase": "Compra",
+    "renewal": "Renovación",
+    "refund": "Devolución",
+    "admin_add": "Agregados por admin",
+    "admin_remove": "Quitados por admin",
+    "admin_set": "Saldo fijado por admin",
+    "opening_balance": "Saldo de apertura",
+}
+
+
+async def _show_credit_history(update: Update, session, telegram_id_arg):
+    """Muestra los últimos movimientos de créditos de un usuario (/credits history)"""
+    try:
+        telegram_id = int(telegram_id_arg)
+    except ValueError:
+        await update.message.reply_text("⚠️ El ID debe ser un número.")
+        return
+
+    target_user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+    if not target_user:
+        await update.message.reply_text(f"⚠️ Usuario con ID {telegram_id} no encontrado.")
+        return
+
+    transactions = await get_credit_history(session, target_user.id)
+
+    message = (
+        f"📒 <b>Movimientos de créditos</b>\n"
+        f"Usuario: {html.escape(target_user.full_name or '')} (ID: {target_user.telegram_id})\n"
+        f"Créditos actuales: {format_credits(target_user.credits)}\n\n"
+    )
+    if not transactions:
+        message += "No hay movimientos registrados."
+    for transaction in transactions:
+        sign = "+" if transaction.amount >= 0 else "-"
+        label = CREDIT_REASON_LABELS.get(transaction.reason, transaction.reason)
+        message += (
+            f"{transaction.created_date.strftime('%Y-%m-%d %H:%M')} | "
+            f"{sign}{format_credits(abs(transaction.amount))} | {html.escape(label)}"
+        )
+        if transaction.reference:
+            message += f" ({html.escape(transaction.reference)})"
+        message += f"\n   Saldo: {format_credits(transaction.balance_after)}\n"
+
+    await update.message.reply_text(message, parse_mode=ParseMode.HTML)
     
-    session.close()
 
 # NUEVO COMANDO PARA VERIFICAR DEMOS
 async def demos_command(update: Update, context: CallbackContext):
     """Maneja el comando /demos para verificar el estado de demos"""
-    user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     if not db_user or not db_user.is_authorized:
         await update.message.reply_text("⚠️ No tienes acceso a este comando.")
-        session.close()
         return
     
     try:
         # Verificar límite de demos
-        can_create, current_count, limit = check_demo_limit(db_user.id, session)
+        can_create, current_count, limit = await check_demo_limit(db_user.id, session)
         
         # Obtener demos activas del usuario
         today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        active_demos = session.query(Account).filter(
+        active_demos = (await session.scalars(select(Account).options(joinedload(Account.server)).filter(
             Account.user_id == db_user.id,
             Account.plan == 'demo',
             Account.is_active == True,
             Account.created_date >= today
-        ).all()
+        ))).all()
         
         # Construir mensaje
         status_emoji = "✅" if can_create else "❌"
@@ -809,8 +839,7 @@ async def demos_command(update: Update, context: CallbackContext):
         if active_demos:
             message += "*Demos activas hoy:*\n"
             for demo in active_demos:
-                server = session.query(Server).filter_by(id=demo.server_id).first()
-                server_name = server.name if server else "Desconocido"
+                server_name = demo.server.name if demo.server else "Desconocido"
                 time_remaining = demo.expiry_date - datetime.utcnow()
                 
                 if time_remaining.total_seconds() > 0:
@@ -829,30 +858,26 @@ async def demos_command(update: Update, context: CallbackContext):
         logger.error(f"Error al verificar demos: {e}")
         await update.message.reply_text(f"❌ Error al obtener información de demos: {str(e)}")
     
-    finally:
-        session.close()
 
 # NUEVOS COMANDOS
 
 async def monitor_command(update: Update, context: CallbackContext):
     """Muestra información de monitoreo del sistema"""
-    user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN y ADMIN pueden ver estadísticas del sistema
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para ver la información del sistema.")
-        session.close()
         return
     
     try:
         # Obtener estadísticas de la base de datos
-        user_count = session.query(User).count()
-        account_count = session.query(Account).count()
-        active_account_count = session.query(Account).filter_by(is_active=True).count()
-        server_count = session.query(Server).count()
+        user_count = await session.scalar(select(func.count()).select_from(User))
+        account_count = await session.scalar(select(func.count()).select_from(Account))
+        active_account_count = await session.scalar(select(func.count()).select_from(Account).filter_by(is_active=True))
+        server_count = await session.scalar(select(func.count()).select_from(Server))
         
         # Obtener tiempo de actividad del sistema
         boot_time = datetime.fromtimestamp(psutil.boot_time())
@@ -893,20 +918,16 @@ async def monitor_command(update: Update, context: CallbackContext):
         logger.error(f"Error al obtener información del sistema: {e}")
         await update.message.reply_text(f"❌ Error al obtener información del sistema: {str(e)}")
     
-    finally:
-        session.close()
 
 async def reset_command(update: Update, context: CallbackContext):
     """Restablece componentes del sistema"""
-    user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN puede restablecer componentes
     if db_user.role != "SUPER_ADMIN":
         await update.message.reply_text("⚠️ Solo el Super Admin puede ejecutar este comando.")
-        session.close()
         return
     
     # Verificar argumentos
@@ -919,10 +940,11 @@ async def reset_command(update: Update, context: CallbackContext):
             "• `/reset all` - Ejecuta todas las acciones anteriores",
             parse_mode=ParseMode.MARKDOWN
         )
-        session.close()
         return
     
     action = context.args[0].lower()
+    # Las tareas de mantenimiento abren sus propias sesiones y tardan: no retener la conexión
+    await session.commit()
     
     if action == "expired":
         # Procesar cuentas vencidas
@@ -942,27 +964,25 @@ async def reset_command(update: Update, context: CallbackContext):
         # Restablecer contadores de servidor
         if len(context.args) < 2:
             await update.message.reply_text("⚠️ Debes especificar el ID del servidor.")
-            session.close()
             return
         
         try:
             server_id = int(context.args[1])
-            server = session.query(Server).filter_by(id=server_id).first()
+            server = await session.scalar(select(Server).filter_by(id=server_id))
             
             if not server:
                 await update.message.reply_text(f"❌ Servidor con ID {server_id} no encontrado.")
-                session.close()
                 return
             
             # Obtener recuento real de usuarios de las cuentas
-            active_accounts = session.query(Account).filter_by(
+            active_accounts = await session.scalar(select(func.count()).select_from(Account).filter_by(
                 server_id=server_id,
                 is_active=True
-            ).count()
+            ))
             
             # Actualizar contador del servidor
             server.current_users = active_accounts
-            session.commit()
+            await session.commit()
             
             await update.message.reply_text(
                 f"✅ Contadores del servidor '{server.name}' restablecidos.\n"
@@ -972,7 +992,7 @@ async def reset_command(update: Update, context: CallbackContext):
         except ValueError:
             await update.message.reply_text("⚠️ El ID del servidor debe ser un número.")
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             logger.error(f"Error al restablecer contadores: {e}")
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
@@ -990,53 +1010,70 @@ async def reset_command(update: Update, context: CallbackContext):
         
         # Restablecer contadores de todos los servidores
         try:
-            servers = session.query(Server).all()
+            servers = (await session.scalars(select(Server))).all()
             for server in servers:
-                active_accounts = session.query(Account).filter_by(
+                active_accounts = await session.scalar(select(func.count()).select_from(Account).filter_by(
                     server_id=server.id,
                     is_active=True
-                ).count()
+                ))
                 server.current_users = active_accounts
             
-            session.commit()
+            await session.commit()
             
             await update.message.reply_text("✅ Reset completo ejecutado correctamente.")
         
         except Exception as e:
-            session.rollback()
+            await session.rollback()
             logger.error(f"Error al ejecutar reset completo: {e}")
             await update.message.reply_text(f"❌ Error: {str(e)}")
     
     else:
         await update.message.reply_text("⚠️ Acción no reconocida. Usa `/reset` para ver opciones disponibles.")
     
-    session.close()
 
-async def list_command(update: Update, context: CallbackContext):
-    """Muestra la lista de usuarios con sus créditos y roles"""
-    user = update.effective_user
-    
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
-    
-    # Solo SUPER_ADMIN y ADMIN pueden ver la lista de usuarios
-    if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
-        await update.message.reply_text("⚠️ No tienes permiso para ver la lista de usuarios.")
-        session.close()
-        return
-    
-    # Obtener todos los usuarios
-    users = session.query(User).order_by(User.role, User.id).all()
-    
-    if not users:
-        await update.message.reply_text("📝 No hay usuarios registrados.")
-        session.close()
-        return
-    
-    # Primero enviamos un título
-    await update.message.reply_text("👥 <b>LISTA DE USUARIOS</b>", parse_mode=ParseMode.HTML)
-    
-    # Luego procesamos cada usuario individualmente
+async def _fetch_user_page(session, role_filter, cursor, direction):
+    """
+    Obtiene una página de usuarios ordenada por (role, id) con paginación por clave.
+
+    Args:
+        session: Sesión asíncrona de base de datos
+        role_filter: Rol a mostrar o None para todos
+        cursor: (role, id) del último usuario mostrado (direction="next") o del
+                primero (direction="prev"); None para la primera página
+        direction: "next" o "prev"
+
+    Returns:
+        Tuple (users, has_prev, has_next)
+    """
+    query = select(User)
+    if role_filter:
+        query = query.filter(User.role == role_filter)
+
+    if direction == "prev":
+        query = query.filter(tuple_(User.role, User.id) < tuple_(*cursor)).order_by(User.role.desc(), User.id.desc())
+    else:
+        if cursor:
+            query = query.filter(tuple_(User.role, User.id) > tuple_(*cursor))
+        query = query.order_by(User.role, User.id)
+
+    # Un usuario de más para saber si hay otra página en la misma dirección
+    users = (await session.scalars(query.limit(USER_LIST_PAGE_SIZE + 1))).all()
+    has_more = len(users) > USER_LIST_PAGE_SIZE
+    users = users[:USER_LIST_PAGE_SIZE]
+
+    if direction == "prev":
+        return list(reversed(users)), has_more, True
+    return users, cursor is not None, has_more
+
+def _render_user_list_page(users, role_filter, has_prev, has_next):
+    """Construye el mensaje (HTML) y el teclado de una página de /list"""
+    scope = "role" if role_filter else "all"
+    title = "👥 <b>LISTA DE USUARIOS</b>"
+    if role_filter:
+        title += f" ({get_role_emoji(role_filter)} {html.escape(role_filter)})"
+    
+    lines = [title, ""]
+    keyboard = []
     for user_item in users:
         # Formatear créditos
         if user_item.credits == float('inf'):
@@ -1044,42 +1081,104 @@ async def list_command(update: Update, context: CallbackContext):
         else:
             credits_display = f"${user_item.credits:,.0f}"
         
-        # Crear mensaje para este usuario
         role_emoji = get_role_emoji(user_item.role)
         username_display = f"@{user_item.username}" if user_item.username else "Sin username"
         
-        user_message = (
-            f"🆔 {user_item.telegram_id} | {role_emoji} {user_item.role} | 💰 {credits_display}\n"
-            f"👤 {user_item.full_name} ({username_display})"
+        lines.append(
+            f"🆔 {user_item.telegram_id} | {role_emoji} {html.escape(user_item.role or '')} | 💰 {credits_display}\n"
+            f"👤 {html.escape(user_item.full_name or '')} ({html.escape(username_display)})\n"
         )
-        
-        # Crear teclado específico para este usuario
-        keyboard = [[
+        keyboard.append([
             InlineKeyboardButton(
-                f"📥 Descargar cuentas de {user_item.full_name}", 
+                f"📥 Descargar cuentas de {user_item.full_name}",
                 callback_data=f"download_accounts_{user_item.telegram_id}"
             )
-        ]]
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        # Enviar mensaje para este usuario con su botón
-        await update.message.reply_text(
-            user_message,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
+        ])
     
-    # Finalmente, enviamos un botón para volver al menú principal
-    back_keyboard = [[InlineKeyboardButton("🔙 Volver al menú principal", callback_data="main_menu")]]
-    back_markup = InlineKeyboardMarkup(back_keyboard)
+    # Navegación: callback_data (máx. 64 bytes) solo lleva el id del primer/último
+    # usuario de la página; su rol (y el filtro, si lo hay) se consultan al pulsar
+    navigation = []
+    if has_prev and users:
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Anterior", callback_data=f"list_page:prev:{scope}:{users[0].id}"
+        ))
+    if has_next and users:
+        navigation.append(InlineKeyboardButton(
+            "Siguiente ➡️", callback_data=f"list_page:next:{scope}:{users[-1].id}"
+        ))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔙 Volver al menú principal", callback_data="main_menu")])
+    
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def list_command(update: Update, context: CallbackContext):
+    """
+    Muestra la lista de usuarios con sus créditos y roles, por páginas.
+    
+    Uso: /list [ROL] (p. ej. /list RESELLER para ver solo revendedores)
+    """
+    session = context.db_session
+    db_user = context.db_user
+    
+    # Solo SUPER_ADMIN y ADMIN pueden ver la lista de usuarios
+    if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
+        await update.message.reply_text("⚠️ No tienes permiso para ver la lista de usuarios.")
+        return
+    
+    role_filter = context.args[0].upper() if context.args else None
+    
+    users, has_prev, has_next = await _fetch_user_page(session, role_filter, None, "next")
+    
+    if not users:
+        if role_filter:
+            await update.message.reply_text(f"📝 No hay usuarios con el rol {role_filter}.")
+        else:
+            await update.message.reply_text("📝 No hay usuarios registrados.")
+        return
+    
+    message, reply_markup = _render_user_list_page(users, role_filter, has_prev, has_next)
+    await update.message.reply_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+async def handle_user_list_page(update: Update, context: CallbackContext):
+    """
+    Maneja los botones Anterior/Siguiente de /list (list_page:<dirección>:<all|role>:<id>)
+
+    El cursor es el rol e id del usuario indicado. Con "role" la lista está
+    filtrada por ese mismo rol, así que el filtro no viaja en callback_data.
+    """
+    query = update.callback_query
+    
+    db_user = context.db_user
+    if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
+        await query.answer("⚠️ No tienes permiso para ver la lista de usuarios.")
+        return
+    
+    parts = query.data.split(":")
+    cursor_role = None
+    if len(parts) == 4 and parts[1] in ("prev", "next") and parts[3].isdigit():
+        _, direction, scope, cursor_id = parts
+        cursor_id = int(cursor_id)
+        cursor_role = await context.db_session.scalar(select(User.role).where(User.id == cursor_id))
     
-    await update.message.reply_text(
-        "Selecciona un usuario para descargar sus cuentas o vuelve al menú principal:",
-        reply_markup=back_markup
+    # Botón de un formato anterior o usuario eliminado desde que se mostró la página
+    if cursor_role is None:
+        await query.answer("La lista cambió. Usa /list de nuevo.")
+        return
+    
+    role_filter = cursor_role if scope == "role" else None
+    users, has_prev, has_next = await _fetch_user_page(
+        context.db_session, role_filter, (cursor_role, cursor_id), direction
     )
     
-    session.close()
+    if not users:
+        await query.answer("No hay más usuarios")
+        return
+    
+    await query.answer()
+    message, reply_markup = _render_user_list_page(users, role_filter, has_prev, has_next)
+    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    
 
 async def handle_download_accounts(update: Update, context: CallbackContext):
     """Maneja el botón de descarga de cuentas"""
@@ -1088,25 +1187,25 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
     
     user_telegram_id = int(query.data.split('_')[2])
     
-    session = Session()
+    session = context.db_session
     
     try:
         # Obtener usuario
-        target_user = session.query(User).filter_by(telegram_id=user_telegram_id).first()
+        target_user = await session.scalar(select(User).filter_by(telegram_id=user_telegram_id))
         
         if not target_user:
             await query.edit_message_text("❌ Usuario no encontrado.")
-            session.close()
             return
         
         # Obtener todas las cuentas para este usuario
-        accounts = session.query(Account).filter_by(user_id=target_user.id).all()
+        accounts = (await session.scalars(
+            select(Account).options(joinedload(Account.server)).filter_by(user_id=target_user.id)
+        )).all()
         
         if not accounts:
             await query.message.reply_text(
                 f"📝 El usuario {target_user.full_name} no tiene cuentas creadas."
             )
-            session.close()
             return
         
         # Crear archivo CSV en memoria
@@ -1121,7 +1220,7 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
         
         # Escribir datos de cuentas
         for account in accounts:
-            server = session.query(Server).filter_by(id=account.server_id).first()
+            server = account.server
             server_name = server.name if server else "Desconocido"
             server_url = server.url if server else "Desconocido"
             
@@ -1137,7 +1236,8 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
                 'Activo' if account.is_active else 'Inactivo'
             ])
         
-        # Preparar archivo para envío
+        # Preparar archivo para envío (sin retener la conexión durante la subida)
+        await session.commit()
         output.seek(0)
         filename = f"cuentas_{target_user.full_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv"
         
@@ -1152,20 +1252,15 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
         logger.error(f"Error al generar archivo de cuentas: {e}")
         await query.message.reply_text(f"❌ Error al generar archivo: {str(e)}")
     
-    finally:
-        session.close()
 
 async def checkdevices_command(update: Update, context: CallbackContext):
     """Verifica y elimina dispositivos excedentes"""
-    user = update.effective_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    db_user = context.db_user
     
     # Solo SUPER_ADMIN y ADMIN pueden usar este comando
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para ejecutar este comando.")
-        session.close()
         return
     
     # Verificar si se proporcionó un nombre de usuario específico
@@ -1197,20 +1292,16 @@ async def checkdevices_command(update: Update, context: CallbackContext):
             f"❌ Error al verificar límites de dispositivos: {str(e)}"
         )
     
-    session.close()
 
 async def check_expired_command(update: Update, context: CallbackContext):
     """
     Comando manual para verificar y eliminar cuentas vencidas.
     Solo accesible para administradores.
     """
-    user = update.effective_user
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    db_user = context.db_user
     
     if db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
         await update.message.reply_text("⚠️ No tienes permiso para ejecutar este comando.")
-        session.close()
         return
 
     await update.message.reply_text("⏳ Iniciando verificación de cuentas vencidas...")
@@ -1223,13 +1314,11 @@ async def check_expired_command(update: Update, context: CallbackContext):
     except Exception as e:
         logger.error(f"Error al ejecutar check_expired manual: {e}")
         await update.message.reply_text(f"❌ Error al ejecutar verificación: {str(e)}")
-    finally:
-        session.close()
 
 async def list_accounts_command(update: Update, context: CallbackContext):
     """
     Comando para listar todas las cuentas agrupadas por servidor.
-    Genera un archivo CSV por cada servidor con:
+    Genera un único archivo ZIP con un CSV por cada servidor con:
     - Usuario
     - Fecha de vencimiento (Año-Mes-Dia)
     - Creado por
@@ -1237,11 +1326,10 @@ async def list_accounts_command(update: Update, context: CallbackContext):
     
     Solo accesible para administradores.
     """
-    user = update.effective_user
-    session = Session()
+    session = context.db_session
     
     try:
-        db_user = session.query(User).filter_by(telegram_id=user.id).first()
+        db_user = context.db_user
         
         if not db_user or db_user.role not in ["SUPER_ADMIN", "ADMIN"]:
             await update.message.reply_text("⚠️ No tienes permiso para ejecutar este comando.")
@@ -1249,84 +1337,30 @@ async def list_accounts_command(update: Update, context: CallbackContext):
 
         await update.message.reply_text("⏳ Generando reportes por servidor...")
 
-        # Obtener todos los servidores
-        servers = session.query(Server).all()
+        # Una sola consulta en streaming, escrita directamente en el ZIP
+        export = await export_accounts_zip(session)
+        # El ZIP ya está en memoria: liberar la conexión antes de enviarlo
+        await session.commit()
         
-        if not servers:
-            await update.message.reply_text("📂 No hay servidores registrados.")
-            return
-
-        files_sent = 0
-
-        # Iterar por cada servidor
-        for server in servers:
-            # Obtener cuentas de este servidor
-            # Hacemos JOIN con User para obtener el nombre del creador y su Telegram ID
-            accounts = session.query(Account, User.username, User.full_name, User.telegram_id)\
-                .outerjoin(User, Account.user_id == User.id)\
-                .filter(Account.server_id == server.id)\
-                .order_by(Account.expiry_date.asc())\
-                .all()
-            
-            if not accounts:
-                continue
-
-            # Generar CSV para este servidor
-            output = io.StringIO()
-            writer = csv.writer(output)
-            # Headers solicitados
-            writer.writerow(["Usuario Cuenta", "Vencimiento", "Creado Por", "ID Telegram", "Estado"])
-            
-            for acc, creator_username, creator_fullname, creator_telegram_id in accounts:
-                # Formatear fecha: Año-Mes-Día
-                expiry_str = acc.expiry_date.strftime("%Y-%m-%d")
-                
-                # Nombre del creador
-                if creator_username:
-                    creator_name = f"@{creator_username}"
-                elif creator_fullname:
-                    creator_name = creator_fullname
-                else:
-                    creator_name = "Desconocido"
-                
-                # ID Telegram
-                telegram_id = str(creator_telegram_id) if creator_telegram_id else "N/A"
-                
-                # Estado
-                status = "Activo" if acc.is_active else "Inactivo/Pendiente"
-                
-                writer.writerow([
-                    acc.username,
-                    expiry_str,
-                    creator_name,
-                    telegram_id,
-                    status
-                ])
-            
-            output.seek(0)
-            
-            # Nombre del archivo: ServerName_Service_Date.csv
-            # Limpiar nombre del servidor de caracteres inválidos para archivo
-            safe_server_name = "".join(c for c in server.name if c.isalnum() or c in (' ', '_', '-')).strip()
-            filename = f"{safe_server_name}_{server.service}_{datetime.now().strftime('%Y%m%d')}.csv"
+        try:
+            if not export.server_counts:
+                await update.message.reply_text("⚠️ No se encontraron cuentas en ninguno de los servidores.")
+                return
             
             await update.message.reply_document(
-                document=io.BytesIO(output.getvalue().encode('utf-8')),
-                filename=filename,
-                caption=f"📂 Reporte: {server.name} ({len(accounts)} cuentas)"
+                document=export.file,
+                filename=export.filename,
+                caption=f"📂 Reporte de cuentas: {export.total_accounts} cuentas en {len(export.server_counts)} servidores"
             )
-            files_sent += 1
+        finally:
+            export.file.close()
         
-        if files_sent == 0:
-            await update.message.reply_text("⚠️ No se encontraron cuentas en ninguno de los servidores.")
-        else:
-            await update.message.reply_text(f"✅ Se enviaron {files_sent} reportes.")
+        summary = "\n".join(f"• {server_name}: {count} cuentas" for server_name, count in export.server_counts)
+        await update.message.reply_text(f"✅ Se generaron {len(export.server_counts)} reportes.\n\n{summary}"[:4000])
 
     except Exception as e:
         logger.error(f"Error en list_accounts_command: {e}")
         await update.message.reply_text("❌ Ocurrió un error al generar los reportes.")
-    finally:
-        session.close()
 
 async def cleanup_orphaned_command(update: Update, context: CallbackContext):
     """
@@ -1,18 +1,28 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ParseMode
 from telegram.ext import CallbackContext, MessageHandler, filters
-from database import Session, User, Price, Account, Server, check_demo_limit
+from telegram.helpers import escape_markdown
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
+from database import User, Price, Account, Server, check_demo_limit
 from utils.keyboards import main_menu_keyboard, service_menu_keyboard, back_to_main_menu_keyboard, create_account_keyboard, accounts_menu_keyboard
 from utils.helpers import format_credits, get_role_emoji, create_account
+from handlers.command_handler import handle_user_list_page
 from handlers.server_handler import validate_server_connection, add_server_to_db, update_server_in_db, delete_server_from_db
+from bulk_purchase import bulk_create_accounts
+from config import BULK_MAX_ACCOUNTS
 from datetime import datetime
 import logging
 from database import Role
 import io
 import csv
+import secrets
 
 logger = logging.getLogger(__name__)
 
+# Cantidades ofrecidas en la compra masiva (se omiten las que superan BULK_MAX_ACCOUNTS)
+BULK_QUANTITY_OPTIONS = (5, 10, 25, 50)
+
 async def handle_callback_query(update: Update, context: CallbackContext):
     """Maneja todas las consultas de callback de los menús"""
     query = update.callback_query
@@ -54,6 +64,12 @@ async def handle_callback_query(update: Update, context: CallbackContext):
     elif callback_data == "jellyfin_delete_user":
         await handle_delete_user(update, context, "jellyfin")
     
+    # Compra masiva
+    elif callback_data in ("emby_create_bulk", "jellyfin_create_bulk"):
+        await show_bulk_purchase_plans(update, context, callback_data.split("_")[0])
+    elif callback_data.startswith("bulk:"):
+        await handle_bulk_purchase(update, context)
+    
     # Crear cuenta específica con selección de servidor
     elif callback_data.startswith(("emby_create_", "jellyfin_create_")):
         parts = callback_data.split("_")
@@ -74,6 +90,10 @@ async def handle_callback_query(update: Update, context: CallbackContext):
     elif callback_data.startswith("download_accounts_"):
         await handle_download_accounts(update, context)
     
+    # Paginación de /list
+    elif callback_data.startswith("list_page:"):
+        await handle_user_list_page(update, context)
+    
     # Gestión de servidores
     elif callback_data.endswith("_manage_servers"):
         service = callback_data.split("_")[0]
@@ -118,8 +138,7 @@ async def show_main_menu(update: Update, context: CallbackContext):
     query = update.callback_query
     user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    db_user = context.db_user
     
     welcome_message = (
         f"🎉 ¡Bienvenido al Bot!\n\n"
@@ -129,7 +148,6 @@ async def show_main_menu(update: Update, context: CallbackContext):
         f"💫 Selecciona una opción del menú:"
     )
     
-    session.close()
     await query.edit_message_text(
         welcome_message,
         reply_markup=main_menu_keyboard()
@@ -138,12 +156,9 @@ async def show_main_menu(update: Update, context: CallbackContext):
 async def show_service_menu(update: Update, context: CallbackContext, service):
     """Muestra el menú de un servicio específico"""
     query = update.callback_query
-    user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    db_user = context.db_user
     user_role = db_user.role
-    session.close()
     
     service_name = "Emby" if service == "emby" else "Jellyfin"
     service_emoji = "🎬" if service == "emby" else "🍿"
@@ -175,18 +190,17 @@ async def show_my_accounts(update: Update, context: CallbackContext):
 async def show_service_accounts(update: Update, context: CallbackContext, service):
     """Muestra las cuentas de un servicio específico"""
     query = update.callback_query
-    user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     service_upper = service.upper()
     # CORRECCIÓN: Consulta simplificada y filtrar solo cuentas activas
-    accounts = session.query(Account).filter(
+    accounts = (await session.scalars(select(Account).options(joinedload(Account.server)).filter(
         Account.user_id == db_user.id,
         Account.service == service_upper,
         Account.is_active == True  # Solo mostrar cuentas activas
-    ).all()
+    ))).all()
     
     service_name = "Emby" if service == "emby" else "Jellyfin"
     service_emoji = "🎬" if service == "emby" else "🍿"
@@ -199,14 +213,12 @@ async def show_service_accounts(update: Update, context: CallbackContext, servic
                 reply_markup=accounts_menu_keyboard(),
                 parse_mode=ParseMode.MARKDOWN
             )
-            session.close()
             return
         
         message = f"{service_emoji} *Mis Cuentas de {service_name}*\n\n"
         
         for acc in accounts:
-            server = session.query(Server).filter_by(id=acc.server_id).first()
-            server_name = server.name if server else "Desconocido"
+            server_name = acc.server.name if acc.server else "Desconocido"
             
             message += (
                 f"• *Usuario:* `{acc.username}`\n"
@@ -226,19 +238,16 @@ async def show_service_accounts(update: Update, context: CallbackContext, servic
         if "message is not modified" not in str(e).lower():
             logger.error(f"Error al mostrar cuentas de {service}: {e}")
             await query.answer("No se pudo actualizar el mensaje")
-    finally:
-        session.close()
 
 async def show_prices(update: Update, context: CallbackContext):
     """Muestra los precios disponibles"""
     query = update.callback_query
-    user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
-    emby_prices = session.query(Price).filter_by(service="EMBY", role=db_user.role).all()
-    jellyfin_prices = session.query(Price).filter_by(service="JELLYFIN", role=db_user.role).all()
+    emby_prices = (await session.scalars(select(Price).filter_by(service="EMBY", role=db_user.role))).all()
+    jellyfin_prices = (await session.scalars(select(Price).filter_by(service="JELLYFIN", role=db_user.role))).all()
     
     message = "💰 *Precios para tu rol*\n\n"
     
@@ -251,7 +260,6 @@ async def show_prices(update: Update, context: CallbackContext):
     for price in jellyfin_prices:
         message += f"• {price.plan.replace('_', ' ').title()}: {format_credits(price.amount)}\n"
     
-    session.close()
     await query.edit_message_text(
         message,
         reply_markup=back_to_main_menu_keyboard(),
@@ -261,16 +269,15 @@ async def show_prices(update: Update, context: CallbackContext):
 async def show_create_user_options(update: Update, context: CallbackContext, service):
     """Muestra las opciones para crear usuario"""
     query = update.callback_query
-    user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    session = context.db_session
+    db_user = context.db_user
     
     service_upper = service.upper()
-    prices = session.query(Price).filter_by(service=service_upper, role=db_user.role).all()
+    prices = (await session.scalars(select(Price).filter_by(service=service_upper, role=db_user.role))).all()
     
     # Verificar límite de demos para mostrar información al usuario
-    can_create_demo, current_demo_count, demo_limit = check_demo_limit(db_user.id, session)
+    can_create_demo, current_demo_count, demo_limit = await check_demo_limit(db_user.id, session)
     
     # Construir mensaje con precios
     message = f"🆕 *Crear Nueva Cuenta*\n\n"
@@ -299,7 +306,6 @@ async def show_create_user_options(update: Update, context: CallbackContext, ser
     
     message += f"📝 Selecciona el tipo de cuenta:"
     
-    session.close()
     
     # Crear teclado personalizado para la selección de cuenta, pasando el rol del usuario
     reply_markup = create_account_keyboard(service, db_user.role)
@@ -314,14 +320,13 @@ async def show_create_user_options(update: Update, context: CallbackContext, ser
 async def select_server_for_account(update: Update, context: CallbackContext, service, plan):
     """Muestra servidores disponibles para creación de cuenta"""
     query = update.callback_query
-    user = query.from_user
+    
+    session = context.db_session
+    db_user = context.db_user
     
     # Verificar límite de demos antes de mostrar servidores
     if plan == 'demo':
-        session = Session()
-        db_user = session.query(User).filter_by(telegram_id=user.id).first()
-        
-        can_create, current_count, limit = check_demo_limit(db_user.id, session)
+        can_create, current_count, limit = await check_demo_limit(db_user.id, session)
         if not can_create:
             await query.edit_message_text(
                 f"❌ *Límite de demos alcanzado*\n\n"
@@ -331,27 +336,22 @@ async def select_server_for_account(update: Update, context: CallbackContext, se
                 reply_markup=create_account_keyboard(service, db_user.role),
                 parse_mode=ParseMode.MARKDOWN
             )
-            session.close()
             return
-        session.close()
     
     # Almacenar el plan seleccionado
     context.user_data['selected_plan'] = plan
     
-    session = Session()
-    
     # Obtener servidores disponibles
-    available_servers = session.query(Server).filter_by(
+    available_servers = (await session.scalars(select(Server).filter_by(
         service=service.upper(),
         is_active=True
-    ).filter(Server.current_users < Server.max_users).all()
+    ).filter(Server.current_users < Server.max_users))).all()
     
     if not available_servers:
         await query.edit_message_text(
             f"❌ No hay servidores disponibles para crear cuentas de {service.upper()}.",
             reply_markup=create_account_keyboard(service, "DISTRIBUTOR")  # Volver a selección de plan
         )
-        session.close()
         return
     
     # Crear mensaje
@@ -360,8 +360,7 @@ async def select_server_for_account(update: Update, context: CallbackContext, se
     
     # Añadir información de demo si aplica
     if plan == 'demo':
-        user_db = session.query(User).filter_by(telegram_id=user.id).first()
-        can_create, current_count, limit = check_demo_limit(user_db.id, session)
+        # Se reutiliza el conteo calculado al inicio de la actualización
         message += f"Demo: {current_count + 1}/{limit} del día\n"
     
     message += "\n"
@@ -401,7 +400,6 @@ async def select_server_for_account(update: Update, context: CallbackContext, se
         parse_mode=ParseMode.MARKDOWN
     )
     
-    session.close()
 
 async def create_user_on_server(update: Update, context: CallbackContext, service, server_id, plan):
     """Crea una cuenta de usuario en un servidor específico"""
@@ -458,6 +456,171 @@ async def create_user_account(update: Update, context: CallbackContext, service,
     """Inicia el proceso de selección de servidor para crear cuenta"""
     await select_server_for_account(update, context, service, plan)
 
+# COMPRA MASIVA
+async def _bulk_plan_prices(session, db_user, service):
+    """Planes que el usuario puede comprar en masa con su precio unitario (plan -> precio)"""
+    prices = (await session.scalars(select(Price).filter_by(service=service.upper(), role=db_user.role))).all()
+    plan_prices = {price.plan: price.amount for price in prices}
+    
+    # Los administradores no pagan: pueden comprar cualquier plan con precio definido
+    if db_user.role in ["SUPER_ADMIN", "ADMIN"]:
+        plans = (await session.scalars(select(Price.plan).filter_by(service=service.upper()).distinct())).all()
+        plan_prices = {plan: 0 for plan in plans}
+    
+    return {plan: amount for plan, amount in sorted(plan_prices.items()) if plan not in ("demo", "bulk")}
+
+async def show_bulk_purchase_plans(update: Update, context: CallbackContext, service):
+    """Muestra los planes disponibles para una compra masiva"""
+    query = update.callback_query
+    
+    session = context.db_session
+    db_user = context.db_user
+    
+    plan_prices = await _bulk_plan_prices(session, db_user, service)
+    if not plan_prices:
+        await query.edit_message_text(
+            "❌ No hay planes disponibles para compra masiva con tu rol.",
+            reply_markup=back_to_main_menu_keyboard()
+        )
+        return
+    
+    message = (
+        f"🛒 *Compra masiva {service.upper()}*\n\n"
+        f"Crea hasta {BULK_MAX_ACCOUNTS} cuentas del mismo plan de una vez y recibe "
+        f"todas las credenciales en un archivo CSV.\n\n"
+        f"💰 Tus créditos: {format_credits(db_user.credits)}\n\n"
+        f"📝 Selecciona el plan:"
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{plan.replace('_', ' ').title()} ({format_credits(amount)} c/u)",
+            callback_data=f"bulk:{service}:{plan}"
+        )]
+        for plan, amount in plan_prices.items()
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data=f"{service}_create_user")])
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def show_bulk_purchase_quantities(update: Update, context: CallbackContext, service, plan):
+    """Muestra las cantidades disponibles para una compra masiva con su coste total"""
+    query = update.callback_query
+    
+    session = context.db_session
+    db_user = context.db_user
+    
+    plan_prices = await _bulk_plan_prices(session, db_user, service)
+    if plan not in plan_prices:
+        await query.edit_message_text(
+            "❌ Plan no disponible para tu rol.",
+            reply_markup=back_to_main_menu_keyboard()
+        )
+        return
+    
+    price = plan_prices[plan]
+    quantities = [quantity for quantity in BULK_QUANTITY_OPTIONS if quantity <= BULK_MAX_ACCOUNTS]
+    
+    # Token de un solo uso: un doble clic o un botón antiguo no repite el pedido
+    order_token = secrets.token_hex(4)
+    context.user_data['bulk_order_token'] = order_token
+    
+    message = (
+        f"🛒 *Compra masiva {service.upper()}*\n\n"
+        f"Plan: {plan.replace('_', ' ').title()}\n"
+        f"Precio por cuenta: {format_credits(price)}\n"
+        f"💰 Tus créditos: {format_credits(db_user.credits)}\n\n"
+        f"📝 Selecciona la cantidad de cuentas:"
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton(
+            f"{quantity} cuentas ({format_credits(price * quantity)})",
+            callback_data=f"bulk:{service}:{plan}:{quantity}:{order_token}"
+        )]
+        for quantity in quantities
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data=f"{service}_create_bulk")])
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def run_bulk_purchase(update: Update, context: CallbackContext, service, plan, quantity, order_token):
+    """Crea las cuentas de una compra masiva y envía las credenciales como CSV"""
+    query = update.callback_query
+    user = query.from_user
+    
+    # El token se consume antes de cualquier await: un segundo clic en el mismo
+    # botón (o en uno de un menú anterior) ya no lo encuentra
+    if not order_token or context.user_data.get('bulk_order_token') != order_token:
+        await query.edit_message_text(
+            "⚠️ Este pedido ya se procesó o caducó. Vuelve a elegir la cantidad para hacer uno nuevo.",
+            reply_markup=back_to_main_menu_keyboard()
+        )
+        return
+    context.user_data.pop('bulk_order_token', None)
+    
+    await query.edit_message_text(
+        f"⏳ *Creando {quantity} cuentas {service.upper()}*\n\n"
+        f"Plan: {plan.replace('_', ' ').title()}\n\n"
+        f"Por favor, espera un momento...",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+    success, result = await bulk_create_accounts(user.id, service, plan, quantity)
+    
+    if not success:
+        await query.edit_message_text(
+            f"❌ *Error en la compra masiva*\n\n"
+            f"Motivo: {escape_markdown(str(result))}",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode=ParseMode.MARKDOWN
+        )
+        return
+    
+    document = result["document"]
+    await query.message.reply_document(
+        document=document.getvalue(),
+        filename=document.filename,
+        caption=f"🔐 Credenciales de {result['created']} cuentas {service.upper()} ({plan.replace('_', ' ').title()})"
+    )
+    
+    message = (
+        f"✅ *Compra masiva completada*\n\n"
+        f"Servicio: {service.upper()}\n"
+        f"Plan: {plan.replace('_', ' ').title()}\n"
+        f"Cuentas creadas: {result['created']}/{quantity}\n"
+        f"Total cobrado: {format_credits(result['charged'])}\n"
+    )
+    if result["failed"]:
+        message += f"\n⚠️ {result['failed']} cuentas no se pudieron crear y su importe fue devuelto:\n"
+        for reason, count in result["errors"].most_common(3):
+            message += f"• {escape_markdown(reason)} ({count})\n"
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+async def handle_bulk_purchase(update: Update, context: CallbackContext):
+    """Maneja los botones de compra masiva (bulk:{service}:{plan}[:{cantidad}:{token}])"""
+    parts = update.callback_query.data.split(":")
+    service, plan = parts[1], parts[2]
+    
+    if len(parts) == 3:
+        await show_bulk_purchase_quantities(update, context, service, plan)
+    else:
+        order_token = parts[4] if len(parts) > 4 else None
+        await run_bulk_purchase(update, context, service, plan, int(parts[3]), order_token)
+
 # FUNCIÓN PARA MANEJAR DESCARGA DE CUENTAS
 async def handle_download_accounts(update: Update, context: CallbackContext):
     """Maneja el botón de descarga de cuentas"""
@@ -466,25 +629,25 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
     
     user_telegram_id = int(query.data.split('_')[2])
     
-    session = Session()
+    session = context.db_session
     
     try:
         # Obtener usuario
-        target_user = session.query(User).filter_by(telegram_id=user_telegram_id).first()
+        target_user = await session.scalar(select(User).filter_by(telegram_id=user_telegram_id))
         
         if not target_user:
             await query.edit_message_text("❌ Usuario no encontrado.")
-            session.close()
             return
         
         # Obtener todas las cuentas para este usuario
-        accounts = session.query(Account).filter_by(user_id=target_user.id).all()
+        accounts = (await session.scalars(
+            select(Account).options(joinedload(Account.server)).filter_by(user_id=target_user.id)
+        )).all()
         
         if not accounts:
             await query.message.reply_text(
                 f"📝 El usuario {target_user.full_name} no tiene cuentas creadas."
             )
-            session.close()
             return
         
         # Crear archivo CSV en memoria
@@ -499,7 +662,7 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
         
         # Escribir datos de cuentas
         for account in accounts:
-            server = session.query(Server).filter_by(id=account.server_id).first()
+            server = account.server
             server_name = server.name if server else "Desconocido"
             server_url = server.url if server else "Desconocido"
             
@@ -515,7 +678,8 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
                 'Activo' if account.is_active else 'Inactivo'
             ])
         
-        # Preparar archivo para envío
+        # Preparar archivo para envío (sin retener la conexión durante la subida)
+        await session.commit()
         output.seek(0)
         filename = f"cuentas_{target_user.full_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv"
         
@@ -530,8 +694,6 @@ async def handle_download_accounts(update: Update, context: CallbackContext):
         logger.error(f"Error al generar archivo de cuentas: {e}")
         await query.message.reply_text(f"❌ Error al generar archivo: {str(e)}")
     
-    finally:
-        session.close()
 
 async def handle_delete_user(update: Update, context: CallbackContext, service):
     """Inicia el proceso de eliminación de usuario"""
@@ -556,12 +718,9 @@ async def handle_delete_user(update: Update, context: CallbackContext, service):
 async def handle_service_action(update: Update, context: CallbackContext, service, action):
     """Maneja acciones específicas de los servicios"""
     query = update.callback_query
-    user = query.from_user
     
-    session = Session()
-    db_user = session.query(User).filter_by(telegram_id=user.id).first()
+    db_user = context.db_user
     user_role = db_user.role
-    session.close()
     
     service_name = "Emby" if service == "emby" else "Jellyfin"
     
@@ -908,9 +1067,8 @@ async def show_server_list(update: Update, context: CallbackContext, service, ac
     """Muestra la lista de servidores para editar o eliminar"""
     query = update.callback_query
     
-    session = Session()
-    servers = session.query(Server).filter_by(service=service.upper()).all()
-    session.close()
+    session = context.db_session
+    servers = (await session.scalars(select(Server).filter_by(service=service.upper()))).all()
     
     service_name = "Emby" if service == "emby" else "Jellyfin"
     action_name = "Editar" if action == "edit" else "Eliminar"
@@ -934,9 +1092,8 @@ async def start_edit_server(update: Update, context: CallbackContext, service, s
     """Inicia el proceso de edición de un servidor"""
     query = update.callback_query
     
-    session = Session()
-    server = session.query(Server).filter_by(id=server_id).first()
-    session.close()
+    session = context.db_session
+    server = await session.scalar(select(Server).filter_by(id=server_id))
     
     if not server:
         await query.edit_message_text(
@@ -1122,21 +1279,19 @@ async def confirm_delete_server(update: Update, context: CallbackContext, servic
     """Pide confirmación para eliminar un servidor"""
     query = update.callback_query
     
-    session = Session()
-    server = session.query(Server).filter_by(id=server_id).first()
+    session = context.db_session
+    server = await session.scalar(select(Server).filter_by(id=server_id))
     
     if not server:
         await query.edit_message_text(
             "❌ Servidor no encontrado.",
             reply_markup=server_management_keyboard(service)
         )
-        session.close()
         return
     
     # Verificar si hay cuentas asociadas
     from database import Account
-    accounts_count = session.query(Account).filter_by(server_id=server_id).count()
-    session.close()
+    accounts_count = await session.scalar(select(func.count()).select_from(Account).filter_by(server_id=server_id))
     
     # Crear teclado de confirmación
     keyboard = [
@@ -1251,23 +1406,17 @@ async def show_server_status(update: Update, context: CallbackContext, service):
     """Muestra el estado de los servidores"""
     query = update.callback_query
     
-    # Mostrar mensaje de carga
-    await query.edit_message_text(
-        f"🔄 Obteniendo información de los servidores {service.upper()}... Por favor, espera."
-    )
-    
-    # Obtener estado de servidores
-    if service == "emby":
-        from handlers.emby_handler import get_emby_servers_status
-        success, result = await get_emby_servers_status()
-    else:  # jellyfin
-        from handlers.jellyfin_handler import get_jellyfin_servers_status
-        success, result = await get_jellyfin_servers_status()
+    # Obtener estado de servidores (desde la caché que refresca el sondeo en segundo plano)
+    from status_poller import get_status_snapshot, format_snapshot_age
+    success, result, updated_at = await get_status_snapshot(service)
     
     # Construir mensaje basado en el resultado
     if success:
         service_name = "EMBY" if service == "emby" else "JELLYFIN"
-        message = f"📊 ESTADO DE SERVIDORES {service_name}\n\n"
+        message = (
+            f"📊 ESTADO DE SERVIDORES {service_name}\n"
+            f"🕒 Datos actualizados {format_snapshot_age(updated_at)}\n\n"
+        )
         
         for server_status in result:
             # Determinar emoji de estado
@@ -1298,7 +1447,8 @@ async def show_server_status(update: Update, context: CallbackContext, service):
                     f"   {device_color} Dispositivos registrados: {total_devices}/{server_status['max_devices']} "
                     f"({devices_percentage:.1f}%)\n"
                     f"   👥 Usuarios conectados: {server_status['active_users']}\n"
-                    f"   📱 Dispositivos activos: {server_status['active_devices']}\n\n"
+                    f"   📱 Dispositivos activos: {server_status['active_devices']}\n"
+                    f"   🔌 Circuito: {server_status['circuit']}\n\n"
                 )
             else:
                 # Para Emby o si no hay datos de dispositivos registrados
@@ -1312,7 +1462,8 @@ async def show_server_status(update: Update, context: CallbackContext, service):
                     f"   {device_color} Dispositivos: {server_status['db_devices']}/{server_status['max_devices']} "
                     f"({server_status['devices_percentage']:.1f}%)\n"
                     f"   👥 Usuarios conectados: {server_status['active_users']}\n"
-                    f"   📱 Dispositivos conectados: {server_status['active_devices']}\n\n"
+                    f"   📱 Dispositivos conectados: {server_status['active_devices']}\n"
+                    f"   🔌 Circuito: {server_status['circuit']}\n\n"
                 )
         
         # Agregar botón de regreso
@@ -0,0 +1,171 @@
+"""
+Registro de clientes HTTP persistentes para los servidores Emby/Jellyfin.
+
+Cada servidor (Server.id) tiene un único httpx.AsyncClient con keep-alive,
+límite de conexiones propio y HTTP/2 cuando el paquete h2 está disponible, de
+modo que las peticiones reutilizan conexiones TCP/TLS en lugar de abrir un
+cliente nuevo en cada llamada.
+
+Los clientes se crean al arrancar (warm_http_clients), se reconstruyen cuando
+cambian la URL o la API key del servidor y se cierran al eliminarlo o al
+detener el bot.
+"""
+import asyncio
+import importlib.util
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+
+from config import HTTP2_ENABLED, HTTP_MAX_CONNECTIONS_PER_SERVER, HTTP_MAX_KEEPALIVE_PER_SERVER, HTTP_KEEPALIVE_EXPIRY
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 requiere el paquete opcional h2 (httpx[http2])
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Timeout por defecto si la llamada no indica uno
+DEFAULT_TIMEOUT = 30.0
+
+# server_id -> (huella (url, api_key), httpx.AsyncClient)
+_clients = {}
+
+
+def server_value(server, name):
+    """Lee un atributo tanto de un objeto Server como de un diccionario con sus datos"""
+    if isinstance(server, dict):
+        return server.get(name)
+    return getattr(server, name)
+
+
+def _fingerprint(server):
+    return (server_value(server, "url"), server_value(server, "api_key"))
+
+
+def _build_client():
+    """Crea un cliente con la configuración de pool común a todos los servidores"""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS_PER_SERVER,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_SERVER,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        timeout=DEFAULT_TIMEOUT,
+        limits=limits,
+        http2=HTTP2_ENABLED and _HTTP2_AVAILABLE
+    )
+
+
+def get_http_client(server):
+    """
+    Obtiene el cliente compartido de un servidor, creándolo si no existe.
+
+    Si la URL o la API key del servidor cambiaron desde que se creó el
+    cliente, se reemplaza por uno nuevo.
+
+    Args:
+        server: Objeto Server o diccionario con id, url y api_key
+
+    Returns:
+        httpx.AsyncClient
+    """
+    server_id = server_value(server, "id")
+    fingerprint = _fingerprint(server)
+
+    entry = _clients.get(server_id)
+    if entry is not None:
+        cached_fingerprint, client = entry
+        if cached_fingerprint == fingerprint and not client.is_closed:
+            return client
+
+        # Configuración modificada: cerrar el cliente anterior en segundo plano
+        asyncio.get_running_loop().create_task(client.aclose())
+
+    client = _build_client()
+    _clients[server_id] = (fingerprint, client)
+    return client
+
+
+class _TimeoutBoundClient:
+    """Envoltorio del cliente compartido que aplica un timeout por defecto a cada petición"""
+
+    def __init__(self, client, timeout):
+        self._client = client
+        self._timeout = timeout
+
+    async def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self._timeout)
+        return await self._client.request(method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def delete(self, url, **kwargs):
+        return await self.request("DELETE", url, **kwargs)
+
+
+@asynccontextmanager
+async def server_http_client(server=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Context manager que entrega el cliente HTTP de un servidor.
+
+    El cliente compartido no se cierra al salir del bloque. Si no se indica
+    servidor (p. ej. al validar uno que aún no está guardado) se usa un cliente
+    temporal con la misma configuración, que sí se cierra al salir.
+
+    Usage:
+        async with server_http_client(server, timeout=15.0) as client:
+            response = await client.get(url)
+    """
+    if server is not None and server_value(server, "id") is not None:
+        yield _TimeoutBoundClient(get_http_client(server), timeout)
+        return
+
+    client = _build_client()
+    try:
+        yield _TimeoutBoundClient(client, timeout)
+    finally:
+        await client.aclose()
+
+
+async def rebuild_http_client(server):
+    """Descarta el cliente de un servidor y crea uno nuevo con su configuración actual"""
+    await close_http_client(server_value(server, "id"))
+    get_http_client(server)
+
+
+async def close_http_client(server_id):
+    """Cierra y elimina del registro el cliente de un servidor"""
+    entry = _clients.pop(server_id, None)
+    if entry is not None:
+        await entry[1].aclose()
+
+
+async def close_all_http_clients():
+    """Cierra todos los clientes (al detener el bot)"""
+    for server_id in list(_clients):
+        await close_http_client(server_id)
+
+
+async def _warm_client(server):
+    """Abre una conexión con el servidor para que quede disponible en el pool"""
+    url = server_value(server, "url").rstrip('/')
+    prefix = "/emby" if server_value(server, "service") == "EMBY" else ""
+    try:
+        await get_http_client(server).get(f"{url}{prefix}/System/Info/Public", timeout=5.0)
+    except Exception as e:
+        logger.warning(f"No se pudo precalentar la conexión con {server_value(server, 'name')}: {e}")
+
+
+async def warm_http_clients(servers):
+    """
+    Crea los clientes de los servidores indicados y abre una conexión con cada uno en paralelo.
+
+    Args:
+        servers: Lista de objetos Server o diccionarios con sus datos
+    """
+    await asyncio.gather(*(_warm_client(server) for server in servers))
+    logger.info(f"Clientes HTTP precalentados para {len(servers)} servidores (HTTP/2: {HTTP2_ENABLED and _HTTP2_AVAILABLE})")
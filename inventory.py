@@ -0,0 +1,215 @@
+"""
+Inventario de usuarios, dispositivos y sesiones de cada servidor Emby/Jellyfin.
+
+La limpieza de dispositivos huérfanos y el control de límites de dispositivos
+consumen el mismo inventario: las listas /Users, /Devices y /Sessions se
+descargan una sola vez por servidor y se reutilizan mientras tengan menos de
+INVENTORY_MAX_AGE segundos. Dentro de un bloque sync_cycle() cada servidor se
+sincroniza como mucho una vez, tarde lo que tarde el ciclo: así lo usa la tarea
+programada que ejecuta la limpieza y el control de límites una tras otra.
+
+En cada sincronización se compara cada dispositivo con la versión anterior
+(por Id, LastUserId y DateLastActivity) y se registra en qué generación
+cambió por última vez, de modo que cada tarea puede preguntar qué cambió
+desde la última vez que lo procesó (changed_user_ids_since).
+
+Usage:
+    async with media_server_client(server) as media:
+        inventory = await sync_inventory(server, media)
+    devices = inventory.devices_by_user.get(user_id, [])
+"""
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import INVENTORY_MAX_AGE
+from device_limits import group_devices_by_user
+
+logger = logging.getLogger(__name__)
+
+# Ciclo de sincronización en curso (lo heredan las tareas creadas dentro del bloque)
+_current_cycle = ContextVar("inventory_sync_cycle", default=None)
+
+
+def _device_version(device):
+    return (device.get('LastUserId'), device.get('DateLastActivity'))
+
+
+class ServerInventory:
+    """Último estado conocido de un servidor, con vistas indexadas y control de cambios"""
+
+    def __init__(self, server_id):
+        self.server_id = server_id
+        self.generation = 0
+        self.synced_at = None
+        self.synced_in_cycle = None
+        self.lock = asyncio.Lock()
+
+        self.users = []
+        self.devices = []
+        self.sessions = []
+
+        # Vistas indexadas
+        self.users_by_id = {}
+        self.users_by_name = {}
+        self.devices_by_id = {}
+        self.devices_by_user = {}
+        self.sessions_by_device = {}
+
+        # device_id -> generación en la que cambió por última vez
+        self._device_changed_in = {}
+        self.last_delta = {'added': set(), 'changed': set(), 'removed': set()}
+
+        # Tarea consumidora -> (generación procesada, datos propios de la tarea)
+        self.checkpoints = {}
+
+    def is_fresh(self, max_age=INVENTORY_MAX_AGE):
+        cycle = _current_cycle.get()
+        if cycle is not None and self.synced_in_cycle is cycle:
+            return True
+        return self.synced_at is not None and time.monotonic() - self.synced_at < max_age
+
+    def apply_sync(self, users, devices, sessions):
+        """Sustituye las listas por las recién descargadas y calcula los cambios de dispositivos"""
+        self.generation += 1
+        previous = self.devices_by_id
+
+        self.users = users
+        self.devices = devices
+        self.sessions = sessions
+
+        self.users_by_id = {user['Id']: user for user in users if user.get('Id')}
+        self.users_by_name = {user['Name']: user for user in users if user.get('Name')}
+        self.devices_by_id = {device['Id']: device for device in devices if device.get('Id')}
+        self.sessions_by_device = {
+            session['DeviceId']: session for session in sessions if session.get('DeviceId')
+        }
+        self._index_devices_by_user()
+
+        added = self.devices_by_id.keys() - previous.keys()
+        removed = previous.keys() - self.devices_by_id.keys()
+        changed = {
+            device_id for device_id in self.devices_by_id.keys() & previous.keys()
+            if _device_version(self.devices_by_id[device_id]) != _device_version(previous[device_id])
+        }
+
+        for device_id in added | changed:
+            self._device_changed_in[device_id] = self.generation
+        for device_id in removed:
+            self._device_changed_in.pop(device_id, None)
+
+        self.last_delta = {'added': added, 'changed': changed, 'removed': removed}
+        self.synced_at = time.monotonic()
+        self.synced_in_cycle = _current_cycle.get()
+
+        logger.info(
+            f"Inventario del servidor {self.server_id} (generación {self.generation}): "
+            f"{len(users)} usuarios, {len(devices)} dispositivos, {len(sessions)} sesiones; "
+            f"{len(added)} dispositivos nuevos, {len(changed)} modificados, {len(removed)} eliminados"
+        )
+
+    def _index_devices_by_user(self):
+        self.devices_by_user = group_devices_by_user(self.devices)
+
+    def changed_user_ids_since(self, generation):
+        """
+        Usuarios (LastUserId) con algún dispositivo nuevo o modificado después de la generación indicada.
+
+        Los dispositivos eliminados no se incluyen: solo reducen el número de
+        dispositivos de su usuario.
+        """
+        return {
+            self.devices_by_id[device_id].get('LastUserId')
+            for device_id, changed_in in self._device_changed_in.items()
+            if changed_in > generation and device_id in self.devices_by_id
+        } - {None}
+
+    def get_checkpoint(self, consumer):
+        """Generación procesada por última vez por una tarea y sus datos asociados ((0, {}) si nunca)"""
+        return self.checkpoints.get(consumer, (0, {}))
+
+    def set_checkpoint(self, consumer, data):
+        """Marca la generación actual como procesada por una tarea"""
+        self.checkpoints[consumer] = (self.generation, data)
+
+    def remove_device(self, device_id):
+        """Quita del inventario un dispositivo eliminado del servidor, sin esperar a la siguiente sincronización"""
+        self.remove_devices([device_id])
+
+    def remove_devices(self, device_ids):
+        """Quita del inventario varios dispositivos eliminados del servidor"""
+        removed = {device_id for device_id in device_ids if self.devices_by_id.pop(device_id, None) is not None}
+        if not removed:
+            return
+        for device_id in removed:
+            self._device_changed_in.pop(device_id, None)
+        self.devices = [device for device in self.devices if device.get('Id') not in removed]
+        self._index_devices_by_user()
+
+
+# server_id -> ServerInventory
+_inventories = {}
+
+
+def get_inventory(server_id):
+    """Obtiene el inventario de un servidor, creándolo vacío si no existe"""
+    inventory = _inventories.get(server_id)
+    if inventory is None:
+        inventory = ServerInventory(server_id)
+        _inventories[server_id] = inventory
+    return inventory
+
+
+async def sync_inventory(server, media, max_age=INVENTORY_MAX_AGE):
+    """
+    Sincroniza el inventario de un servidor si tiene más de max_age segundos
+    (y no se sincronizó ya en el sync_cycle() en curso).
+
+    Las tres listas se descargan en paralelo. Si otra tarea está sincronizando
+    el mismo servidor, se espera a que termine y se reutiliza su resultado.
+
+    Args:
+        server: Objeto Server de la base de datos
+        media: MediaServerClient del servidor
+        max_age: Antigüedad máxima en segundos (0 fuerza la sincronización)
+
+    Returns:
+        ServerInventory
+
+    Raises:
+        MediaServerError: Si el servidor no devuelve alguna de las listas
+    """
+    inventory = get_inventory(server.id)
+    async with inventory.lock:
+        if not inventory.is_fresh(max_age):
+            users, devices, sessions = await asyncio.gather(
+                media.get_users(),
+                media.get_devices(),
+                media.get_sessions()
+            )
+            inventory.apply_sync(users, devices, sessions)
+    return inventory
+
+
+@contextmanager
+def sync_cycle():
+    """
+    Agrupa varias tareas para que compartan una única sincronización por servidor.
+
+    Usage:
+        with sync_cycle():
+            await cleanup_orphaned_devices(context)
+            await check_and_enforce_device_limits(context)
+    """
+    token = _current_cycle.set(object())
+    try:
+        yield
+    finally:
+        _current_cycle.reset(token)
+
+
+def reset_inventory(server_id):
+    """Olvida el inventario de un servidor (al cambiar su configuración o eliminarlo)"""
+    _inventories.pop(server_id, None)
@@ -0,0 +1,430 @@
+"""
+Cliente unificado para la API de los servidores Emby y Jellyfin.
+
+Centraliza la construcción de URLs, cabeceras de autenticación, timeouts y la
+normalización de respuestas (lista, {'Items': [...]} o un único objeto), de
+modo que los handlers y las tareas programadas trabajen siempre con listas de
+diccionarios. Las peticiones usan el cliente HTTP compartido del servidor
+(http_pool) y consultan el circuit breaker del servidor (circuit_breaker).
+
+Usage:
+    async with media_server_client(server, timeout=15.0) as media:
+        users = await media.get_users()
+"""
+import json
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+import httpx
+
+from circuit_breaker import get_breaker
+from http_pool import server_http_client, server_value, DEFAULT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36'
+
+
+class MediaServerError(Exception):
+    """Respuesta inesperada de un servidor Emby/Jellyfin"""
+
+    def __init__(self, operation, status_code, message):
+        self.operation = operation
+        self.status_code = status_code
+        self.message = message
+        super().__init__(message)
+
+
+class ServerUnavailableError(MediaServerError):
+    """El circuito del servidor está abierto: la petición se rechaza sin contactar al servidor"""
+
+    def __init__(self, operation, breaker):
+        super().__init__(
+            operation, None,
+            f"Servidor no disponible (circuito abierto, reintento en {breaker.retry_in()}s): {breaker.last_error}"
+        )
+
+
+def _as_list(data, keys=("Items",)):
+    """
+    Normaliza una respuesta de la API a una lista de diccionarios.
+
+    Acepta una lista, un diccionario con la lista bajo alguna de las claves
+    indicadas o un único objeto.
+    """
+    if isinstance(data, list):
+        items = data
+    elif isinstance(data, dict):
+        items = next((data[key] for key in keys if key in data), [data] if data else [])
+    else:
+        items = []
+    return [item for item in items if isinstance(item, dict)]
+
+
+class MediaServerClient:
+    """Operaciones comunes sobre un servidor multimedia; las subclases definen los detalles de cada API"""
+
+    SERVICE = None
+    API_PREFIX = ""
+
+    def __init__(self, server, http):
+        self.server = server
+        self.http = http
+        self.api_key = server_value(server, "api_key")
+        self.base_url = server_value(server, "url").rstrip('/')
+        # Un identificador de dispositivo por cliente para las cabeceras de autenticación
+        self.device_id = str(uuid.uuid4())
+        # Los servidores aún no guardados (validación) no tienen circuito
+        server_id = server_value(server, "id")
+        self.breaker = get_breaker(server_id, server_value(server, "name")) if server_id is not None else None
+
+    @property
+    def name(self):
+        return server_value(self.server, "name")
+
+    def _url(self, path):
+        return f"{self.base_url}{self.API_PREFIX}{path}"
+
+    def _headers(self):
+        raise NotImplementedError
+
+    async def _request(self, method, path, operation, expected=(200, 204), params=None, headers=None, **kwargs):
+        """
+        Realiza una petición autenticada y valida el código de respuesta.
+
+        Los errores de conexión, timeouts y respuestas 5xx cuentan como fallos
+        del circuito del servidor; cualquier otra respuesta indica que está vivo.
+
+        Raises:
+            ServerUnavailableError: Si el circuito del servidor está abierto
+            MediaServerError: Si el código de respuesta no está en expected
+            httpx.RequestError: Si hay un error de conexión
+        """
+        breaker = self.breaker
+        if breaker is not None and not breaker.allow_request():
+            raise ServerUnavailableError(operation, breaker)
+
+        try:
+            request_params = {'api_key': self.api_key}
+            if params:
+                request_params.update(params)
+
+            response = await self.http.request(
+                method,
+                self._url(path),
+                params=request_params,
+                headers={**self._headers(), **(headers or {})},
+                **kwargs
+            )
+        except httpx.RequestError as e:
+            if breaker is not None:
+                breaker.record_failure(e)
+            raise
+        except BaseException:
+            # Cancelación o error ajeno al servidor (URL inválida, cabeceras...):
+            # no cuenta como fallo, pero la petición de prueba debe liberarse
+            if breaker is not None:
+                breaker.release_probe()
+            raise
+
+        if breaker is not None:
+            if response.status_code >= 500:
+                breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                breaker.record_success()
+
+        if response.status_code not in expected:
+            raise MediaServerError(operation, response.status_code, response.text)
+        return response
+
+    # --- Sistema ---
+
+    async def get_system_info(self):
+        """Información del servidor (requiere API key válida)"""
+        response = await self._request("GET", "/System/Info", "obtener información del sistema", expected=(200,))
+        return response.json()
+
+    # --- Usuarios ---
+
+    async def get_users(self):
+        response = await self._request("GET", "/Users", "obtener usuarios", expected=(200,))
+        return _as_list(response.json())
+
+    async def get_user(self, user_id):
+        """Devuelve el usuario o None si no existe (404)"""
+        response = await self._request("GET", f"/Users/{user_id}", "obtener usuario", expected=(200, 404))
+        if response.status_code == 404:
+            return None
+        return response.json()
+
+    async def create_user(self, username, password, copy_from_user_id=None):
+        """Crea un usuario con la contraseña indicada y devuelve su ID"""
+        raise NotImplementedError
+
+    async def set_policy(self, user_id, policy):
+        raise NotImplementedError
+
+    async def set_password(self, user_id, new_password):
+        raise NotImplementedError
+
+    async def delete_user(self, user_id):
+        """
+        Elimina un usuario.
+
+        Returns:
+            bool: True si se eliminó, False si ya no existía (404)
+        """
+        response = await self._request("DELETE", f"/Users/{user_id}", "eliminar usuario", expected=(200, 204, 404))
+        return response.status_code != 404
+
+    def build_policy(self, plan):
+        """Política de usuario correspondiente a un plan"""
+        raise NotImplementedError
+
+    # --- Dispositivos y sesiones ---
+
+    async def get_devices(self):
+        response = await self._request("GET", "/Devices", "obtener dispositivos", expected=(200,))
+        return _as_list(response.json())
+
+    async def delete_device(self, device_id):
+        """
+        Elimina un dispositivo (el ID se envía como parámetro de consulta).
+
+        Returns:
+            bool: True si el servidor confirmó la eliminación
+        """
+        response = await self._request(
+            "DELETE", "/Devices", "eliminar dispositivo",
+            expected=(200, 204, 404), params={'Id': device_id}
+        )
+        return response.status_code in (200, 204)
+
+    async def get_sessions(self):
+        response = await self._request("GET", "/Sessions", "obtener sesiones", expected=(200,))
+        return _as_list(response.json(), keys=("Sessions", "Items"))
+
+
+class EmbyClient(MediaServerClient):
+    SERVICE = "EMBY"
+    API_PREFIX = "/emby"
+
+    def _headers(self):
+        return {
+            'User-Agent': USER_AGENT,
+            'Accept': 'application/json',
+            'X-Emby-Client': 'Emby Web',
+            'X-Emby-Device-Name': 'Chrome Windows',
+            'X-Emby-Device-Id': self.device_id,
+            'X-Emby-Client-Version': '4.8.9.0',
+            'X-Emby-Token': self.api_key,
+            'X-Emby-Language': 'es-419'
+        }
+
+    async def create_user(self, username, password, copy_from_user_id=None):
+        data = {'Name': username}
+        if copy_from_user_id:
+            data['CopyFromUserId'] = copy_from_user_id
+            data['UserCopyOptions'] = 'UserPolicy,UserConfiguration'
+
+        response = await self._request(
+            "POST", "/Users/New", "crear usuario", expected=(200,),
+            headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
+            data=data
+        )
+        user_id = response.json().get('Id')
+
+        # Emby no acepta la contraseña al crear el usuario
+        if user_id:
+            await self.set_password(user_id, password)
+        return user_id
+
+    async def set_policy(self, user_id, policy):
+        await self._request(
+            "POST", f"/Users/{user_id}/Policy", "actualizar políticas", expected=(204,),
+            params={'reqformat': 'json'},
+            headers={'Content-Type': 'text/plain'},
+            content=json.dumps(policy)
+        )
+
+    async def set_password(self, user_id, new_password):
+        await self._request(
+            "POST", f"/Users/{user_id}/Password", "establecer contraseña", expected=(204,),
+            headers={'Content-Type': 'application/x-www-form-urlencoded; charset=UTF-8'},
+            data={'NewPw': new_password}
+        )
+
+    def build_policy(self, plan):
+        is_demo = plan == 'demo'
+        is_live_tv = plan in ('live_tv', '2_screens_tv')
+
+        # Límite de streams según el plan
+        if plan in ('2_screens', '2_screens_tv'):
+            stream_limit = "2"
+        elif plan == 'bulk':
+            stream_limit = "3"
+        else:
+            stream_limit = "1"
+
+        return {
+            "IsAdministrator": False,
+            "IsHidden": False,
+            "IsHiddenRemotely": True,
+            "IsHiddenFromUnusedDevices": True,
+            "IsDisabled": False,
+            "LockedOutDate": 0,
+            "AllowTagOrRating": False,
+            "BlockedTags": [],
+            "IsTagBlockingModeInclusive": False,
+            "IncludeTags": [],
+            "EnableUserPreferenceAccess": True,
+            "AccessSchedules": [],
+            "BlockUnratedItems": [],
+            "EnableRemoteControlOfOtherUsers": False,
+            "EnableSharedDeviceControl": False,
+            "EnableRemoteAccess": True,
+            "EnableLiveTvManagement": is_live_tv or is_demo,
+            "EnableLiveTvAccess": is_live_tv or is_demo,
+            "EnableMediaPlayback": True,
+            "EnableAudioPlaybackTranscoding": True,
+            "EnableVideoPlaybackTranscoding": True,
+            "AutoRemoteQuality": 0,
+            "EnablePlaybackRemuxing": True,
+            "EnableContentDeletion": False,
+            "RestrictedFeatures": ["notifications"],
+            "EnableContentDeletionFromFolders": [],
+            "EnableContentDownloading": False,
+            "EnableSubtitleDownloading": False,
+            "EnableSubtitleManagement": False,
+            "EnableSyncTranscoding": False,
+            "EnableMediaConversion": False,
+            "EnabledChannels": [],
+            "EnableAllChannels": True,
+            "EnabledFolders": [],
+            "EnableAllFolders": True,
+            "InvalidLoginAttemptCount": 0,
+            "EnablePublicSharing": False,
+            "RemoteClientBitrateLimit": 0,
+            "AuthenticationProviderId": "Emby.Server.Implementations.Library.DefaultAuthenticationProvider",
+            "ExcludedSubFolders": [],
+            "SimultaneousStreamLimit": stream_limit,
+            "EnabledDevices": [],
+            "EnableAllDevices": True,
+            "AllowCameraUpload": False,
+            "AllowSharingPersonalItems": False,
+            "EnableTranscodingQuality": False
+        }
+
+
+class JellyfinClient(MediaServerClient):
+    SERVICE = "JELLYFIN"
+    API_PREFIX = ""
+
+    def _headers(self):
+        return {
+            'User-Agent': USER_AGENT,
+            'Accept': 'application/json',
+            'Accept-Language': 'es-ES,es;q=0.9',
+            'X-Emby-Authorization': f'MediaBrowser Client="Jellyfin Web", Device="Chrome Windows", DeviceId="{self.device_id}", Version="10.10.6", Token="{self.api_key}"'
+        }
+
+    async def create_user(self, username, password, copy_from_user_id=None):
+        response = await self._request(
+            "POST", "/Users/New", "crear usuario", expected=(200,),
+            headers={'Content-Type': 'application/json'},
+            content=json.dumps({"Name": username, "Password": password})
+        )
+        return response.json().get('Id')
+
+    async def set_policy(self, user_id, policy):
+        await self._request(
+            "POST", f"/Users/{user_id}/Policy", "actualizar políticas", expected=(204,),
+            headers={'Content-Type': 'application/json'},
+            content=json.dumps(policy)
+        )
+
+    async def set_password(self, user_id, new_password):
+        await self._request(
+            "POST", f"/Users/{user_id}/Password", "establecer contraseña", expected=(204,),
+            headers={'Content-Type': 'application/json'},
+            content=json.dumps({"CurrentPw": "", "NewPw": new_password})
+        )
+
+    def build_policy(self, plan):
+        is_demo = plan == 'demo'
+        is_live_tv = plan in ('live_tv', '3_screens_tv')
+
+        # Límite de sesiones según el plan
+        if plan in ('3_screens', '3_screens_tv'):
+            max_sessions = 3
+        elif plan == 'bulk':
+            max_sessions = 5
+        else:
+            max_sessions = 1
+
+        return {
+            "IsAdministrator": False,
+            "IsHidden": True,
+            "EnableCollectionManagement": False,
+            "EnableSubtitleManagement": False,
+            "EnableLyricManagement": False,
+            "IsDisabled": False,
+            "BlockedTags": [],
+            "AllowedTags": [],
+            "EnableUserPreferenceAccess": True,
+            "AccessSchedules": [],
+            "BlockUnratedItems": [],
+            "EnableRemoteControlOfOtherUsers": False,
+            "EnableSharedDeviceControl": False,
+            "EnableRemoteAccess": True,
+            "EnableLiveTvManagement": is_live_tv or is_demo,
+            "EnableLiveTvAccess": is_live_tv or is_demo,
+            "EnableMediaPlayback": True,
+            "EnableAudioPlaybackTranscoding": True,
+            "EnableVideoPlaybackTranscoding": True,
+            "EnablePlaybackRemuxing": True,
+            "ForceRemoteSourceTranscoding": False,
+            "EnableContentDeletion": False,
+            "EnableContentDeletionFromFolders": [],
+            "EnableContentDownloading": False,
+            "EnableSyncTranscoding": True,
+            "EnableMediaConversion": True,
+            "EnabledDevices": [],
+            "EnableAllDevices": True,
+            "EnabledChannels": [],
+            "EnableAllChannels": False,
+            "EnabledFolders": [],
+            "EnableAllFolders": True,
+            "InvalidLoginAttemptCount": 0,
+            "LoginAttemptsBeforeLockout": -1,
+            "MaxActiveSessions": max_sessions,
+            "EnablePublicSharing": True,
+            "BlockedMediaFolders": [],
+            "BlockedChannels": [],
+            "RemoteClientBitrateLimit": 0,
+            "AuthenticationProviderId": "Jellyfin.Server.Implementations.Users.DefaultAuthenticationProvider",
+            "PasswordResetProviderId": "Jellyfin.Server.Implementations.Users.DefaultPasswordResetProvider",
+            "SyncPlayAccess": "None"
+        }
+
+
+CLIENT_CLASSES = {
+    "EMBY": EmbyClient,
+    "JELLYFIN": JellyfinClient,
+}
+
+
+@asynccontextmanager
+async def media_server_client(server, timeout=DEFAULT_TIMEOUT):
+    """
+    Context manager que entrega el cliente de API adecuado para el servidor.
+
+    Args:
+        server: Objeto Server o diccionario con url, api_key, service (e id si
+                el servidor ya está guardado, para usar su cliente HTTP compartido)
+        timeout: Timeout por petición en segundos
+    """
+    client_class = CLIENT_CLASSES[server_value(server, "service").upper()]
+    async with server_http_client(server, timeout=timeout) as http:
+        yield client_class(server, http)
@@ -0,0 +1,270 @@
+"""
+Cola de salida de mensajes de Telegram con límites de envío y prioridades.
+
+Los informes a administradores y las notificaciones se encolan aquí en lugar
+de llamar directamente a bot.send_message. Un número fijo de workers
+(TELEGRAM_SEND_WORKERS) entrega los mensajes respetando:
+
+- Un token bucket global (TELEGRAM_GLOBAL_RATE mensajes/s), por debajo del
+  límite de Telegram para dejar margen a las respuestas directas de los handlers
+- Un token bucket por chat (TELEGRAM_CHAT_RATE mensajes/s en chats privados y
+  TELEGRAM_GROUP_RATE en grupos)
+- Prioridades: los mensajes PRIORITY_INTERACTIVE salen antes que los
+  PRIORITY_BROADCAST aunque se hayan encolado después
+- El orden de encolado dentro de un mismo chat y prioridad (un chat solo lo
+  atiende un worker a la vez)
+
+Ante RetryAfter se pausa toda la cola el tiempo indicado por Telegram y se
+reintenta; los errores de red (salvo BadRequest) se reintentan con espera
+exponencial, hasta TELEGRAM_SEND_MAX_RETRIES veces.
+
+Usage:
+    results = await broadcast(context.bot.send_message, admin_ids, text=report, parse_mode="MARKDOWN")
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE,
+    TELEGRAM_SEND_WORKERS, TELEGRAM_SEND_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BROADCAST = 1
+
+# Espera base (segundos) entre reintentos por errores de red
+NETWORK_RETRY_BACKOFF = 1.0
+
+# Buckets de chat que se conservan en memoria antes de descartar los inactivos
+MAX_CHAT_BUCKETS = 1024
+
+
+class TokenBucket:
+    """Token bucket que reserva turnos: devuelve cuánto esperar en lugar de bloquear"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self):
+        """Consume un token y devuelve los segundos que hay que esperar para usarlo"""
+        self._refill()
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def is_idle(self):
+        """True si el bucket está lleno (se puede descartar sin perder información)"""
+        self._refill()
+        return self._tokens >= self.capacity
+
+
+class _OutboundMessage:
+    __slots__ = ("priority", "sequence", "send", "chat_id", "kwargs", "future")
+
+    def __init__(self, priority, sequence, send, chat_id, kwargs, future):
+        self.priority = priority
+        self.sequence = sequence
+        self.send = send
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.future = future
+
+
+def _retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+def _consume_exception(future):
+    # Evita el aviso "exception was never retrieved" si nadie espera el resultado
+    if not future.cancelled():
+        future.exception()
+
+
+class OutboundMessageQueue:
+    """Cola de salida con workers, límites global y por chat, y prioridades"""
+
+    def __init__(self, workers=TELEGRAM_SEND_WORKERS, global_rate=TELEGRAM_GLOBAL_RATE,
+                 chat_rate=TELEGRAM_CHAT_RATE, group_rate=TELEGRAM_GROUP_RATE,
+                 max_retries=TELEGRAM_SEND_MAX_RETRIES):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self._queue = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._global_bucket = TokenBucket(global_rate, capacity=max(1, int(global_rate)))
+        self._chat_buckets = {}
+        self._paused_until = 0.0
+
+        # chat_id -> mensajes del chat en espera mientras un worker lo atiende (heap por prioridad)
+        self._busy_chats = {}
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def enqueue(self, send, chat_id, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Encola un envío.
+
+        Args:
+            send: Método del bot que realiza el envío (p. ej. bot.send_message)
+            chat_id: Chat de destino
+            priority: PRIORITY_INTERACTIVE o PRIORITY_BROADCAST
+            **kwargs: Argumentos del envío (text, parse_mode, ...)
+
+        Returns:
+            asyncio.Future con el resultado del envío o la excepción final
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        message = _OutboundMessage(priority, next(self._sequence), send, chat_id, kwargs, future)
+        self._queue.put_nowait((message.priority, message.sequence, message))
+        return future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_idle()
+                }
+            # Los IDs negativos son grupos y canales, con un límite más estricto
+            bucket = TokenBucket(self.group_rate if chat_id < 0 else self.chat_rate)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, chat_id):
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause <= 0:
+                break
+            await asyncio.sleep(pause)
+
+        delay = max(self._global_bucket.reserve(), self._chat_bucket(chat_id).reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _deliver(self, message):
+        attempt = 0
+        while not message.future.done():
+            await self._wait_for_slot(message.chat_id)
+            try:
+                result = await message.send(chat_id=message.chat_id, **message.kwargs)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                if attempt >= self.max_retries:
+                    message.future.set_exception(e)
+                    return
+                attempt += 1
+                logger.warning(
+                    f"Límite de Telegram alcanzado al enviar a {message.chat_id}, "
+                    f"reintento {attempt}/{self.max_retries} en {delay:.0f}s"
+                )
+            except NetworkError as e:
+                if isinstance(e, BadRequest) or attempt >= self.max_retries:
+                    message.future.set_exception(e)
+                    return
+                delay = NETWORK_RETRY_BACKOFF * (2 ** attempt)
+                attempt += 1
+                logger.warning(
+                    f"Error de red al enviar a {message.chat_id}, "
+                    f"reintento {attempt}/{self.max_retries} en {delay:.0f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+            except Exception as e:
+                message.future.set_exception(e)
+                return
+            else:
+                message.future.set_result(result)
+
+    async def _worker(self):
+        while True:
+            _, _, message = await self._queue.get()
+            chat_id = message.chat_id
+
+            pending = self._busy_chats.get(chat_id)
+            if pending is not None:
+                # Otro worker atiende este chat: se entregará en orden después de los anteriores
+                heapq.heappush(pending, (message.priority, message.sequence, message))
+                continue
+
+            pending = self._busy_chats[chat_id] = []
+            try:
+                while True:
+                    await self._deliver(message)
+                    if not pending:
+                        break
+                    _, _, message = heapq.heappop(pending)
+            except asyncio.CancelledError:
+                for _, _, waiting in pending:
+                    waiting.future.cancel()
+                message.future.cancel()
+                raise
+            finally:
+                del self._busy_chats[chat_id]
+
+
+_queue = None
+
+
+def get_message_queue():
+    """Obtiene la cola de salida compartida, creándola si no existe"""
+    global _queue
+    if _queue is None:
+        _queue = OutboundMessageQueue()
+    return _queue
+
+
+def start_message_queue():
+    """Arranca los workers de la cola (al iniciar el bot)"""
+    get_message_queue().start()
+
+
+async def stop_message_queue():
+    """Detiene los workers de la cola (al detener el bot)"""
+    if _queue is not None:
+        await _queue.stop()
+
+
+def enqueue_message(send, chat_id, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """Encola un envío sin esperar a que se entregue (ver OutboundMessageQueue.enqueue)"""
+    return get_message_queue().enqueue(send, chat_id, priority, **kwargs)
+
+
+async def broadcast(send, chat_ids, priority=PRIORITY_BROADCAST, **kwargs):
+    """
+    Envía el mismo mensaje a varios chats a través de la cola.
+
+    Returns:
+        dict: chat_id -> resultado del envío o la excepción final
+    """
+    chat_ids = list(dict.fromkeys(chat_ids))
+    futures = [enqueue_message(send, chat_id, priority, **kwargs) for chat_id in chat_ids]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    return dict(zip(chat_ids, results))
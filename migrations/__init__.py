@@ -0,0 +1,86 @@
+"""
+Migraciones versionadas del esquema de la base de datos.
+
+La versión aplicada se guarda en la tabla schema_version (una sola fila). Al
+arrancar basta una consulta para saber si el esquema ya está en la última
+versión; solo si no lo está se ejecutan, en orden, las migraciones pendientes.
+
+Cada migración es un módulo de este paquete con:
+    VERSION: entero consecutivo
+    DESCRIPTION: descripción corta
+    upgrade(connection): aplica el cambio dentro de la transacción recibida
+
+Para añadir un cambio de esquema se crea un nuevo módulo mNNNN_<nombre>.py y se
+agrega al final de MIGRATIONS.
+"""
+import logging
+from sqlalchemy import text
+
+from migrations import m0001_legacy_columns, m0002_indexes, m0003_account_server_fk, m0004_users_role_index, m0005_credit_transactions, m0006_pooled_users
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    m0001_legacy_columns,
+    m0002_indexes,
+    m0003_account_server_fk,
+    m0004_users_role_index,
+    m0005_credit_transactions,
+    m0006_pooled_users,
+]
+
+HEAD_VERSION = MIGRATIONS[-1].VERSION
+
+
+def get_current_version(engine):
+    """
+    Obtiene la versión del esquema con una única consulta.
+
+    Returns:
+        int o None: Versión aplicada, o None si la tabla schema_version no existe
+    """
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        return None
+
+
+def _set_version(connection, version):
+    """Registra la versión aplicada en schema_version"""
+    connection.execute(text("DELETE FROM schema_version"))
+    connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+
+def run_migrations(engine, current_version, fresh_install=False):
+    """
+    Aplica las migraciones pendientes hasta HEAD_VERSION.
+
+    Args:
+        engine: Engine síncrono de SQLAlchemy
+        current_version: Versión devuelta por get_current_version
+        fresh_install: True si create_all acaba de crear el esquema completo;
+                       en ese caso solo se marca la versión sin ejecutar migraciones
+    """
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+
+    if fresh_install:
+        with engine.begin() as connection:
+            _set_version(connection, HEAD_VERSION)
+        logger.info(f"Esquema nuevo creado en la versión {HEAD_VERSION}")
+        return
+
+    current_version = current_version or 0
+
+    for migration in MIGRATIONS:
+        if migration.VERSION <= current_version:
+            continue
+
+        logger.info(f"Aplicando migración {migration.VERSION}: {migration.DESCRIPTION}")
+        # Cada migración y su registro de versión van en la misma transacción
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            _set_version(connection, migration.VERSION)
+
+    logger.info(f"Esquema actualizado a la versión {HEAD_VERSION}")
@@ -0,0 +1,45 @@
+"""
+Columnas añadidas a servers, accounts y roles en versiones anteriores del bot.
+
+Reemplaza a update_servers_table, update_account_table y update_roles_table,
+que comprobaban cada columna en information_schema en cada arranque.
+"""
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+DESCRIPTION = "Columnas heredadas de servers, accounts y roles"
+
+# Nombres y tipos fijos: se interpolan en el DDL, por lo que nunca deben venir de entrada externa
+COLUMNS_TO_ADD = {
+    'servers': {
+        'admin_username': 'VARCHAR',
+        'admin_id': 'VARCHAR',
+        'max_devices': 'INTEGER',
+        'max_users': 'INTEGER'
+    },
+    'accounts': {
+        'service_user_id': 'VARCHAR'
+    },
+    'roles': {
+        'description': 'VARCHAR',
+        'is_admin': 'BOOLEAN DEFAULT FALSE',
+        'created_date': 'TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
+    }
+}
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+
+    for table_name, columns in COLUMNS_TO_ADD.items():
+        existing_columns = {column["name"] for column in inspector.get_columns(table_name)}
+
+        for column_name, column_type in columns.items():
+            if column_name in existing_columns:
+                continue
+
+            connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+            logger.info(f"Columna {column_name} añadida a la tabla {table_name}")
@@ -0,0 +1,47 @@
+"""
+Índices compuestos, parciales y únicos de accounts y prices.
+
+create_all no añade índices a tablas que ya existen, así que en instalaciones
+previas se crean aquí. Antes del índice único de precios se eliminan los
+duplicados (service, role, plan), conservando el registro más antiguo.
+"""
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+DESCRIPTION = "Índices de accounts y precio único por servicio, rol y plan"
+
+# Índices introducidos por esta migración (declarados en los modelos de database.py)
+INDEX_NAMES = {
+    'ix_accounts_server_active',
+    'ix_accounts_service_username',
+    'ix_accounts_active_expiry',
+    'ix_accounts_user_plan_active_created',
+    'uq_prices_service_role_plan',
+}
+
+
+def upgrade(connection):
+    from database import Account, Price
+
+    inspector = inspect(connection)
+
+    for table in (Account.__table__, Price.__table__):
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+
+        for index in table.indexes:
+            if index.name not in INDEX_NAMES or index.name in existing_indexes:
+                continue
+
+            if index.name == 'uq_prices_service_role_plan':
+                result = connection.execute(text(
+                    "DELETE FROM prices WHERE id NOT IN ("
+                    "SELECT MIN(id) FROM prices GROUP BY service, role, plan)"
+                ))
+                if result.rowcount:
+                    logger.info(f"Eliminados {result.rowcount} precios duplicados")
+
+            index.create(bind=connection)
+            logger.info(f"Índice {index.name} creado")
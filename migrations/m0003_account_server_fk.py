@@ -0,0 +1,44 @@
+"""
+Clave foránea accounts.server_id -> servers.id (ON DELETE SET NULL).
+
+Las cuentas de servidores ya eliminados (forzando la eliminación) conservaban
+un server_id que no existe; antes de crear la restricción se deja en NULL,
+igual que hará la base de datos al eliminar un servidor a partir de ahora.
+
+SQLite no permite añadir restricciones a una tabla existente: allí solo las
+instalaciones nuevas (create_all) tienen la clave foránea, y la relación
+Account.server funciona igual porque se declara en el modelo.
+"""
+import logging
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+VERSION = 3
+DESCRIPTION = "Clave foránea de accounts.server_id a servers"
+
+CONSTRAINT_NAME = 'fk_accounts_server_id'
+
+
+def upgrade(connection):
+    if connection.dialect.name == 'sqlite':
+        logger.info("SQLite no admite añadir claves foráneas a tablas existentes; se omite")
+        return
+
+    inspector = inspect(connection)
+    existing = {foreign_key["name"] for foreign_key in inspector.get_foreign_keys('accounts')}
+    if CONSTRAINT_NAME in existing:
+        return
+
+    result = connection.execute(text(
+        "UPDATE accounts SET server_id = NULL "
+        "WHERE server_id IS NOT NULL AND server_id NOT IN (SELECT id FROM servers)"
+    ))
+    if result.rowcount:
+        logger.info(f"{result.rowcount} cuentas de servidores eliminados quedaron sin servidor asociado")
+
+    connection.execute(text(
+        f"ALTER TABLE accounts ADD CONSTRAINT {CONSTRAINT_NAME} "
+        "FOREIGN KEY (server_id) REFERENCES servers (id) ON DELETE SET NULL"
+    ))
+    logger.info(f"Clave foránea {CONSTRAINT_NAME} creada")
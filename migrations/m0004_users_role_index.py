@@ -0,0 +1,28 @@
+"""
+Índice (role, id) de users para la paginación por clave de /list.
+
+create_all no añade índices a tablas que ya existen, así que en instalaciones
+previas se crea aquí.
+"""
+import logging
+from sqlalchemy import inspect
+
+logger = logging.getLogger(__name__)
+
+VERSION = 4
+DESCRIPTION = "Índice de users por rol e id"
+
+INDEX_NAME = 'ix_users_role_id'
+
+
+def upgrade(connection):
+    from database import User
+
+    existing_indexes = {index["name"] for index in inspect(connection).get_indexes(User.__tablename__)}
+    if INDEX_NAME in existing_indexes:
+        return
+
+    for index in User.__table__.indexes:
+        if index.name == INDEX_NAME:
+            index.create(bind=connection)
+            logger.info(f"Índice {index.name} creado")
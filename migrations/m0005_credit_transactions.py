@@ -0,0 +1,34 @@
+"""
+Libro de movimientos de créditos (credit_transactions).
+
+create_all ya crea la tabla y su índice antes de las migraciones; aquí se
+registra el saldo actual de cada usuario como movimiento de apertura, para que
+la suma de sus movimientos coincida con users.credits desde el principio. Los
+saldos infinitos de los administradores no se registran.
+
+Los movimientos no se borran con el usuario: al eliminarlo (/deluser) su
+user_id queda en NULL y el libro sigue completo.
+"""
+import datetime
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+VERSION = 5
+DESCRIPTION = "Movimientos de créditos y saldo de apertura"
+
+
+def upgrade(connection):
+    from database import CreditTransaction
+
+    CreditTransaction.__table__.create(bind=connection, checkfirst=True)
+
+    result = connection.execute(text(
+        "INSERT INTO credit_transactions (user_id, amount, balance_after, reason, created_date) "
+        "SELECT id, credits, credits, 'opening_balance', :now FROM users "
+        "WHERE credits IS NOT NULL AND credits <> 0 AND credits <> :inf "
+        "AND NOT EXISTS (SELECT 1 FROM credit_transactions WHERE credit_transactions.user_id = users.id)"
+    ), {"now": datetime.datetime.utcnow(), "inf": float('inf')})
+    if result.rowcount:
+        logger.info(f"Saldo de apertura registrado para {result.rowcount} usuarios")
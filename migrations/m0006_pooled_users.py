@@ -0,0 +1,14 @@
+"""
+Tabla pooled_users: usuarios deshabilitados precreados en cada servidor.
+
+create_all ya la crea al arrancar; se crea también aquí (checkfirst) para que
+la migración sea completa por sí misma.
+"""
+VERSION = 6
+DESCRIPTION = "Pool de usuarios precreados"
+
+
+def upgrade(connection):
+    from database import PooledUser
+
+    PooledUser.__table__.create(bind=connection, checkfirst=True)
@@ -0,0 +1,136 @@
+"""
+Elección del servidor para las cuentas nuevas creadas sin servidor concreto.
+
+En lugar de llenar siempre el servidor activo de menor ID, cada servidor con
+plazas libres recibe una puntuación de carga (menor es mejor):
+
+    PLACEMENT_WEIGHT_USERS   × plazas ocupadas / max_users
+  + PLACEMENT_WEIGHT_DEVICES × dispositivos de las cuentas / max_devices
+  + PLACEMENT_WEIGHT_STREAMS × reproducciones en curso / max_devices
+  + PLACEMENT_UNHEALTHY_PENALTY si está offline o su circuito tiene fallos
+
+Las reproducciones salen del último estado de status_poller (sesiones de
+/Sessions), sin peticiones adicionales a los servidores; cada transcodificación
+cuenta como PLACEMENT_TRANSCODE_COST reproducciones directas. Los servidores
+con el circuito abierto quedan al final. A igual puntuación se prefiere el que
+tiene más plazas libres y después el de menor ID.
+
+reserve_server_slot recorre los servidores en el orden de rank_servers y
+reserva el primero que sigue teniendo plaza.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import select
+
+from circuit_breaker import is_available, is_healthy
+from config import (
+    PLACEMENT_WEIGHT_USERS, PLACEMENT_WEIGHT_DEVICES, PLACEMENT_WEIGHT_STREAMS,
+    PLACEMENT_TRANSCODE_COST, PLACEMENT_UNHEALTHY_PENALTY, PLACEMENT_STATUS_MAX_AGE
+)
+from database import Server, get_server_device_totals
+from status_poller import peek_status_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def summarize_sessions(sessions):
+    """
+    Reproducciones en curso de una lista de sesiones de /Sessions.
+
+    Returns:
+        Tuple (playing, transcoding): sesiones reproduciendo y cuántas de ellas transcodifican
+    """
+    playing = 0
+    transcoding = 0
+    for user_session in sessions:
+        if not user_session.get('NowPlayingItem'):
+            continue
+        playing += 1
+        if user_session.get('TranscodingInfo'):
+            transcoding += 1
+    return playing, transcoding
+
+
+def _device_weights(service):
+    # Importación diferida: los handlers importan db_locks, que depende de este módulo
+    if service == "EMBY":
+        from handlers.emby_handler import STATUS_DEVICE_WEIGHTS
+    else:
+        from handlers.jellyfin_handler import STATUS_DEVICE_WEIGHTS
+    return STATUS_DEVICE_WEIGHTS
+
+
+def _live_status(service):
+    """server_id -> estado del último sondeo, si es reciente"""
+    snapshot = peek_status_snapshot(service)
+    if snapshot is None:
+        return {}
+
+    success, result, updated_at = snapshot
+    if not success or (datetime.utcnow() - updated_at).total_seconds() > PLACEMENT_STATUS_MAX_AGE:
+        return {}
+    return {status['server_id']: status for status in result if 'server_id' in status}
+
+
+def score_server(server, db_devices, status=None):
+    """
+    Puntuación de carga de un servidor (menor es mejor).
+
+    Args:
+        server: Objeto Server de la base de datos
+        db_devices: Dispositivos teóricos de sus cuentas activas
+        status: Estado del último sondeo (o None si no hay)
+    """
+    score = PLACEMENT_WEIGHT_USERS * (server.current_users or 0) / server.max_users
+    if server.max_devices:
+        score += PLACEMENT_WEIGHT_DEVICES * db_devices / server.max_devices
+
+    if status is not None:
+        if status.get('online'):
+            transcoding = status.get('transcoding_sessions', 0)
+            streams = status.get('playing_sessions', 0) + (PLACEMENT_TRANSCODE_COST - 1) * transcoding
+            score += PLACEMENT_WEIGHT_STREAMS * streams / (server.max_devices or server.max_users)
+        else:
+            score += PLACEMENT_UNHEALTHY_PENALTY
+
+    if not is_healthy(server.id):
+        score += PLACEMENT_UNHEALTHY_PENALTY
+    return score
+
+
+async def rank_servers(session, service):
+    """
+    Servidores activos con plazas libres de un servicio, del más al menos adecuado.
+
+    Returns:
+        list: IDs de servidor
+    """
+    servers = (await session.scalars(
+        select(Server).filter(
+            Server.service == service,
+            Server.is_active == True,
+            Server.current_users < Server.max_users
+        )
+    )).all()
+    if not servers:
+        return []
+
+    device_totals = await get_server_device_totals(
+        session, [server.id for server in servers], _device_weights(service)
+    )
+    live_status = _live_status(service)
+
+    ranked = sorted(
+        (
+            (
+                not is_available(server.id),
+                round(score_server(server, device_totals.get(server.id, 0), live_status.get(server.id)), 4),
+                server.current_users - server.max_users,
+                server.id
+            )
+            for server in servers
+        )
+    )
+    logger.debug(f"Orden de ubicación {service}: {[(server_id, score) for _, score, _, server_id in ranked]}")
+    return [server_id for _, _, _, server_id in ranked]
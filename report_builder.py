@@ -0,0 +1,61 @@
+"""
+Documentos adjuntos para los informes a administradores.
+
+Los informes de límites de dispositivos y de dispositivos huérfanos escriben
+cada fila de detalle en un ReportDocument a medida que la generan. Si el
+número de filas supera REPORT_ATTACHMENT_THRESHOLD, el detalle se envía como
+un único archivo (CSV o NDJSON según REPORT_ATTACHMENT_FORMAT) en lugar de
+repartirlo en muchos mensajes.
+
+Usage:
+    document = ReportDocument("limites_dispositivos", ["servidor", "usuario", "dispositivo"])
+    document.add_row("Servidor 1", "usuario1", "Android TV")
+    if document.exceeds_threshold():
+        data = document.getvalue()
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from config import REPORT_ATTACHMENT_FORMAT, REPORT_ATTACHMENT_THRESHOLD
+
+
+class ReportDocument:
+    """Filas de detalle de un informe escritas una sola vez en formato CSV o NDJSON"""
+
+    def __init__(self, name, columns, fmt=REPORT_ATTACHMENT_FORMAT):
+        if fmt not in ("csv", "ndjson"):
+            raise ValueError(f"Formato de informe no soportado: {fmt}")
+
+        self.name = name
+        self.columns = list(columns)
+        self.format = fmt
+        self.row_count = 0
+        self.created_at = datetime.now()
+
+        self._output = io.StringIO()
+        if fmt == "csv":
+            self._writer = csv.writer(self._output)
+            self._writer.writerow(self.columns)
+
+    def add_row(self, *values):
+        """Añade una fila (un valor por columna, en el mismo orden)"""
+        if self.format == "csv":
+            self._writer.writerow(values)
+        else:
+            self._output.write(json.dumps(dict(zip(self.columns, values)), ensure_ascii=False, default=str))
+            self._output.write("\n")
+        self.row_count += 1
+
+    def exceeds_threshold(self, threshold=REPORT_ATTACHMENT_THRESHOLD):
+        """True si el detalle es demasiado largo para enviarlo como mensajes"""
+        return self.row_count > threshold
+
+    @property
+    def filename(self):
+        return f"{self.name}_{self.created_at.strftime('%Y%m%d_%H%M%S')}.{self.format}"
+
+    def getvalue(self):
+        """Contenido del documento codificado en UTF-8"""
+        return self._output.getvalue().encode("utf-8")
@@ -2,11 +2,21 @@ import logging
 from datetime import datetime
 import asyncio
 import concurrent.futures
-import httpx
-from sqlalchemy import and_
-from database import Session, Account, Server, User as DbUser, get_db_session
+from sqlalchemy import and_, case, delete, select, update
+from database import Account, Server, User as DbUser, get_async_db_session
 from handlers.emby_handler import delete_emby_user
 from handlers.jellyfin_handler import delete_jellyfin_user
+from media_client import media_server_client, MediaServerError
+from circuit_breaker import is_available
+from inventory import sync_inventory, sync_cycle
+from device_deletion import delete_devices
+from device_limits import DEVICE_LIMITS, evaluate_device_limits
+from message_queue import enqueue_message, PRIORITY_BROADCAST
+from report_builder import ReportDocument
+from config import (
+    ADMIN_IDS, EXPIRED_ACCOUNTS_CONCURRENCY_PER_SERVER, EXPIRED_ACCOUNTS_BATCH_SIZE,
+    DEVICE_LIMITS_INTERVAL, ORPHAN_CLEANUP_INTERVAL
+)
 from audit_logger import (
     log_expired_accounts_cleanup,
     log_device_cleanup,
@@ -19,29 +29,11 @@ logger = logging.getLogger(__name__)
 # Executor para operaciones bloqueantes
 executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
 
-# Configuración de límites de dispositivos por plan (centralizada)
-DEVICE_LIMITS = {
-    'EMBY': {
-        '1_screen': 1,
-        'live_tv': 1,
-        'demo': 1,
-        '2_screens': 2,
-        '2_screens_tv': 2,
-        'bulk': 3,
-        '3_screens': 3,
-        '3_screens_tv': 3
-    },
-    'JELLYFIN': {
-        '1_screen': 1,
-        'live_tv': 1,
-        'demo': 1,
-        '3_screens': 3,
-        '3_screens_tv': 3,
-        'bulk': 5,
-        '2_screens': 2,
-        '2_screens_tv': 2
-    }
-}
+# Nombre con el que el control de límites registra en el inventario lo ya procesado
+DEVICE_LIMITS_CHECKPOINT = "device_limits"
+
+# Ciclos de mantenimiento de dispositivos ejecutados (la limpieza de huérfanos va en uno de cada N)
+_device_maintenance_cycles = 0
 
 
 def get_color_indicator(percentage):
@@ -61,177 +53,250 @@ def get_color_indicator(percentage):
     else:
         return "🔴"  # Rojo
 
-# Funciones auxiliares para ejecutar tareas en segundo plano
-# NOTA: Esta función se mantiene por compatibilidad pero no se recomienda su uso
-# debido a problemas con event loops anidados. Usar directamente await en funciones async.
+async def _get_admin_chat_ids():
+    """IDs de Telegram de los usuarios ADMIN/SUPER_ADMIN más los administradores configurados"""
+    async with get_async_db_session() as session:
+        admin_ids = (await session.scalars(
+            select(DbUser.telegram_id).filter(DbUser.role.in_(["SUPER_ADMIN", "ADMIN"]))
+        )).all()
+    return list(dict.fromkeys([*admin_ids, *ADMIN_IDS]))
 
-async def check_account_exists(server, user_id, service):
+async def _send_to_admins(context, admin_ids, messages, description):
     """
-    Verifica si una cuenta existe en el servidor
+    Envía los mensajes de un informe a todos los administradores a través de la cola de salida.
 
-    Args:
-        server: Objeto Server de la base de datos
-        user_id: ID del usuario en el servicio
-        service: "EMBY" o "JELLYFIN"
+    Todos los envíos se encolan de una vez con prioridad de difusión; cada administrador
+    los recibe en orden y la cola reparte el ritmo de envío entre todos los chats.
 
     Returns:
-        bool: True si la cuenta existe, False en caso contrario
+        int: Número de envíos fallidos
     """
-    try:
-        # Eliminar la barra final si existe
-        url = server.url
-        if url.endswith('/'):
-            url = url[:-1]
-
-        if service == "EMBY":
-            # Verificar si el usuario existe en Emby
-            check_url = f"{url}/emby/Users/{user_id}?api_key={server.api_key}"
+    pending = [
+        (admin_id, enqueue_message(
+            context.bot.send_message, admin_id, PRIORITY_BROADCAST, text=text, parse_mode="MARKDOWN"
+        ))
+        for text in messages
+        for admin_id in admin_ids
+    ]
+    results = await asyncio.gather(*(future for _, future in pending), return_exceptions=True)
+
+    failed = 0
+    for (admin_id, _), result in zip(pending, results):
+        if isinstance(result, BaseException):
+            failed += 1
+            logger.error(f"Error al enviar {description} a admin {admin_id}: {result}")
+    return failed
+
+async def _send_document_to_admins(context, admin_ids, document, caption, description):
+    """
+    Envía un ReportDocument a todos los administradores subiéndolo una sola vez.
+
+    El archivo se sube al primer administrador que lo acepte; al resto se le envía
+    el file_id devuelto por Telegram en lugar de volver a subir el contenido.
+
+    Returns:
+        int: Número de envíos fallidos
+    """
+    remaining = list(admin_ids)
+    data = document.getvalue()
+    file_id = None
+    failed = 0
+
+    while remaining and file_id is None:
+        admin_id = remaining.pop(0)
+        try:
+            message = await enqueue_message(
+                context.bot.send_document, admin_id, PRIORITY_BROADCAST,
+                document=data, filename=document.filename, caption=caption
+            )
+            file_id = message.document.file_id
+        except Exception as e:
+            failed += 1
+            logger.error(f"Error al enviar {description} (archivo) a admin {admin_id}: {e}")
+
+    if remaining:
+        pending = [
+            (admin_id, enqueue_message(
+                context.bot.send_document, admin_id, PRIORITY_BROADCAST, document=file_id, caption=caption
+            ))
+            for admin_id in remaining
+        ]
+        results = await asyncio.gather(*(future for _, future in pending), return_exceptions=True)
+        for (admin_id, _), result in zip(pending, results):
+            if isinstance(result, BaseException):
+                failed += 1
+                logger.error(f"Error al enviar {description} (archivo) a admin {admin_id}: {result}")
+    return failed
+
+def _chunks(items, size):
+    """Divide una lista en bloques de tamaño size"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+async def _delete_expired_from_server(server, account, semaphore):
+    """
+    Elimina del servidor el usuario de una cuenta vencida.
+
+    No se consulta antes si el usuario existe: la eliminación ya trata el 404
+    como éxito.
+
+    Returns:
+        bool: True si la cuenta puede borrarse de la base de datos
+    """
+    async with semaphore:
+        if account.service == "EMBY":
+            success, message = await delete_emby_user(server, account.service_user_id)
         else:  # JELLYFIN
-            # Verificar si el usuario existe en Jellyfin
-            check_url = f"{url}/Users/{user_id}?api_key={server.api_key}"
+            success, message = await delete_jellyfin_user(server, account.service_user_id)
 
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(check_url)
-            # Si la respuesta es 200, el usuario existe
-            if response.status_code == 200:
-                return True
+    if success:
+        logger.info(f"Cuenta {account.username} eliminada correctamente del servidor (o ya no existía).")
+    else:
+        # SI FALLA, NO HACEMOS NADA EN LA BD
+        # La cuenta sigue activa y vencida, por lo que en el próximo ciclo
+        # (15 min después) se volverá a intentar eliminar.
+        # Esto asegura que no queden cuentas "zombies" en el servidor.
+        logger.error(f"Error al eliminar cuenta {account.username} del servidor: {message}")
+    return success
 
-            # Si la respuesta es 404, el usuario no existe
-            if response.status_code == 404:
-                return False
+async def _process_expired_server(server, accounts):
+    """
+    Elimina las cuentas vencidas de un servidor por bloques.
 
-            # Otros códigos podrían indicar problemas de conexión
-            logger.warning(f"Código de respuesta inesperado al verificar usuario: {response.status_code}")
-            return True  # Asumimos que existe para ser conservadores
+    Cada bloque se elimina del servidor con concurrencia limitada y, a
+    continuación, se borra de la base de datos y se descuenta de
+    current_users con dos sentencias, confirmadas en su propia transacción.
 
-    except Exception as e:
-        logger.error(f"Error al verificar si la cuenta existe: {e}")
-        return True  # En caso de error, asumimos que existe para ser conservadores
+    Returns:
+        int: Cuentas eliminadas de la base de datos
+    """
+    semaphore = asyncio.Semaphore(EXPIRED_ACCOUNTS_CONCURRENCY_PER_SERVER)
+    removed = 0
+
+    for chunk in _chunks(accounts, EXPIRED_ACCOUNTS_BATCH_SIZE):
+        # Servidor caído (circuito abierto): el resto se reintentará en el siguiente ciclo
+        if not is_available(server.id):
+            logger.warning(f"Servidor {server.name} no disponible (circuito abierto), se omiten sus cuentas vencidas restantes")
+            break
+
+        results = await asyncio.gather(
+            *(_delete_expired_from_server(server, account, semaphore) for account in chunk)
+        )
+        deleted_ids = [account.id for account, success in zip(chunk, results) if success]
+        if not deleted_ids:
+            continue
+
+        async with get_async_db_session() as session:
+            result = await session.execute(delete(Account).where(Account.id.in_(deleted_ids)))
+            deleted_count = result.rowcount
+
+            # Actualizar contador de usuarios en el servidor (sin bajar de 0)
+            await session.execute(
+                update(Server)
+                .where(Server.id == server.id)
+                .values(current_users=case(
+                    (Server.current_users > deleted_count, Server.current_users - deleted_count),
+                    else_=0
+                ))
+            )
+
+        removed += deleted_count
+        logger.info(f"Servidor {server.name}: {deleted_count} cuentas vencidas eliminadas de la base de datos")
+
+    return removed
 
 async def check_expired_accounts(*args, **kwargs):
     """
     Verifica y procesa las cuentas vencidas.
     - Todas las cuentas vencidas se eliminan completamente del servidor y de la base de datos
+    - Las cuentas se agrupan por servidor y los servidores se procesan en paralelo
     """
     logger.info("Iniciando verificación de cuentas vencidas...")
     
-    session = Session()
     now = datetime.utcnow()
     
     try:
-        # Obtener todas las cuentas activas vencidas
-        expired_accounts = session.query(Account).filter(
-            and_(
-                Account.is_active == True,
-                Account.expiry_date < now
-            )
-        ).all()
-        
-        if not expired_accounts:
-            logger.info("No se encontraron cuentas vencidas.")
-            session.close()
-            return
-        
-        logger.info(f"Se encontraron {len(expired_accounts)} cuentas vencidas.")
-        
-        # Procesar cada cuenta vencida
-        for account in expired_accounts:
-            # Obtener el servidor asociado
-            server = session.query(Server).filter_by(id=account.server_id).first()
+        async with get_async_db_session() as session:
+            # Obtener todas las cuentas activas vencidas
+            expired_accounts = (await session.scalars(select(Account).filter(
+                and_(
+                    Account.is_active == True,
+                    Account.expiry_date < now
+                )
+            ))).all()
+            
+            if not expired_accounts:
+                logger.info("No se encontraron cuentas vencidas.")
+                return
+            
+            logger.info(f"Se encontraron {len(expired_accounts)} cuentas vencidas.")
             
-            if not server:
+            # Obtener los servidores asociados en una sola consulta
+            server_ids = {account.server_id for account in expired_accounts}
+            servers = {
+                server.id: server
+                for server in (await session.scalars(select(Server).filter(Server.id.in_(server_ids)))).all()
+            }
+        
+        # Agrupar las cuentas por servidor
+        accounts_by_server = {}
+        for account in expired_accounts:
+            if account.server_id not in servers:
                 logger.error(f"No se encontró el servidor para la cuenta {account.username}")
                 continue
                 
-            service_user_id = account.service_user_id
-            if not service_user_id:
+            if not account.service_user_id:
                 logger.error(f"No se encontró el ID de servicio para la cuenta {account.username}")
                 continue
             
-            # Verificar si la cuenta aún existe en el servidor
-            account_exists = await check_account_exists(server, service_user_id, account.service)
-            
-            if not account_exists:
-                logger.info(f"La cuenta {account.username} ya no existe en el servidor.")
-                
-                # Eliminar completamente de la base de datos
-                session.delete(account)
-                logger.info(f"Cuenta {account.username} eliminada de la base de datos.")
-                
-                # Actualizar contador de usuarios en el servidor
-                if server.current_users > 0:
-                    server.current_users -= 1
-                
-                continue
-            
-            # Intentar eliminar la cuenta del servidor
-            if account.service == "EMBY":
-                success, message = await delete_emby_user(server, service_user_id)
-            else:  # JELLYFIN
-                success, message = await delete_jellyfin_user(server, service_user_id)
-            
-            # Si la función retorna True, significa que se eliminó o ya no existe (404)
-            if success:
-                logger.info(f"Cuenta {account.username} eliminada correctamente del servidor (o ya no existía).")
-                
-                # Eliminar completamente de la base de datos
-                session.delete(account)
-                logger.info(f"Cuenta {account.username} eliminada de la base de datos.")
-                
-                # Actualizar contador de usuarios en el servidor
-                if server.current_users > 0:
-                    server.current_users -= 1
+            accounts_by_server.setdefault(account.server_id, []).append(account)
+        
+        results = await asyncio.gather(
+            *(_process_expired_server(servers[server_id], accounts) for server_id, accounts in accounts_by_server.items()),
+            return_exceptions=True
+        )
+        
+        removed = 0
+        for server_id, result in zip(accounts_by_server, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error al procesar cuentas vencidas del servidor {servers[server_id].name}: {result}")
+                log_error("check_expired_accounts", str(result))
             else:
-                # SI FALLA, NO HACEMOS NADA EN LA BD
-                # La cuenta sigue activa y vencida, por lo que en el próximo ciclo
-                # (15 min después) se volverá a intentar eliminar.
-                # Esto asegura que no queden cuentas "zombies" en el servidor.
-                logger.error(f"Error al eliminar cuenta {account.username} del servidor: {message}")
-                logger.info(f"La cuenta se mantendrá en cola para reintentar eliminación en el siguiente ciclo.")
+                removed += result
         
-        # Guardar cambios
-        session.commit()
         logger.info("Proceso de verificación de cuentas vencidas completado.")
 
         # Registrar en auditoría
         log_expired_accounts_cleanup(
-            len(expired_accounts),
-            f"Procesadas {len(expired_accounts)} cuentas vencidas"
+            removed,
+            f"Procesadas {len(expired_accounts)} cuentas vencidas en {len(accounts_by_server)} servidores"
         )
 
     except Exception as e:
-        session.rollback()
         logger.error(f"Error al procesar cuentas vencidas: {e}")
         log_error("check_expired_accounts", str(e))
-    finally:
-        session.close()
 
 async def send_servers_status_to_admins(context=None):
     """Envía el estado de todos los servidores a los administradores"""
     logger.info("Enviando estado de servidores a los administradores...")
     
-    from database import Session, User
-    from config import ADMIN_IDS
-    from handlers.emby_handler import get_emby_servers_status
-    from handlers.jellyfin_handler import get_jellyfin_servers_status
+    from status_poller import get_status_snapshot, format_snapshot_age
     
-    session = Session()
     try:
-        # Obtener todos los usuarios con roles admin
-        admin_users = session.query(User).filter(User.role.in_(["SUPER_ADMIN", "ADMIN"])).all()
-        admin_telegram_ids = [user.telegram_id for user in admin_users]
-        
-        # Añadir los IDs de admin configurados (por si acaso)
-        for admin_id in ADMIN_IDS:
-            if admin_id not in admin_telegram_ids:
-                admin_telegram_ids.append(admin_id)
+        # Administradores (usuarios con roles admin y los IDs configurados)
+        admin_telegram_ids = await _get_admin_chat_ids()
         
-        # Ejecutar estas operaciones en segundo plano para no bloquear
-        emby_success, emby_result = await get_emby_servers_status()
-        jellyfin_success, jellyfin_result = await get_jellyfin_servers_status()
+        # Estado de los servidores Emby y Jellyfin desde la caché del sondeo en segundo plano
+        (emby_success, emby_result, emby_updated_at), (jellyfin_success, jellyfin_result, jellyfin_updated_at) = await asyncio.gather(
+            get_status_snapshot("EMBY"),
+            get_status_snapshot("JELLYFIN")
+        )
         
-        # Construir mensaje de resumen
-        message = "📊 *REPORTE PERIÓDICO DE ESTADO DE SERVIDORES*\n\n"
+        # Construir mensaje de resumen (con la antigüedad del dato más viejo)
+        message = (
+            "📊 *REPORTE PERIÓDICO DE ESTADO DE SERVIDORES*\n"
+            f"🕒 Datos actualizados {format_snapshot_age(min(emby_updated_at, jellyfin_updated_at))}\n\n"
+        )
         
         # Procesar servidores Emby
         if emby_success and isinstance(emby_result, list) and len(emby_result) > 0:
@@ -250,7 +315,8 @@ async def send_servers_status_to_admins(context=None):
                     f"   {device_color} Dispositivos: {server['db_devices']}/{server['max_devices']} "
                     f"({server['devices_percentage']:.1f}%)\n"
                     f"   👥 Usuarios conectados: {server['active_users']}\n"
-                    f"   📱 Dispositivos conectados: {server['active_devices']}\n\n"
+                    f"   📱 Dispositivos conectados: {server['active_devices']}\n"
+                    f"   🔌 Circuito: {server['circuit']}\n\n"
                 )
         else:
             message += "*SERVIDORES EMBY:* No hay información disponible\n\n"
@@ -272,29 +338,19 @@ async def send_servers_status_to_admins(context=None):
                     f"   {device_color} Dispositivos: {server['db_devices']}/{server['max_devices']} "
                     f"({server['devices_percentage']:.1f}%)\n"
                     f"   👥 Usuarios conectados: {server['active_users']}\n"
-                    f"   📱 Dispositivos conectados: {server['active_devices']}\n\n"
+                    f"   📱 Dispositivos conectados: {server['active_devices']}\n"
+                    f"   🔌 Circuito: {server['circuit']}\n\n"
                 )
         else:
             message += "*SERVIDORES JELLYFIN:* No hay información disponible\n\n"
         
-        # Enviar mensaje a todos los administradores de forma no bloqueante
+        # Enviar mensaje a todos los administradores a través de la cola de salida
         if context and context.bot:
-            for admin_id in admin_telegram_ids:
-                try:
-                    # Intentar enviar el mensaje, pero no esperar por su finalización
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=message,
-                        parse_mode="MARKDOWN"
-                    )
-                    logger.info(f"Estado de servidores enviado a admin {admin_id}")
-                except Exception as e:
-                    logger.error(f"Error al enviar estado a admin {admin_id}: {e}")
+            failed = await _send_to_admins(context, admin_telegram_ids, [message], "estado")
+            logger.info(f"Estado de servidores enviado a {len(admin_telegram_ids) - failed} administradores")
         
     except Exception as e:
         logger.error(f"Error al enviar estado de servidores: {e}")
-    finally:
-        session.close()
 
 async def cleanup_orphaned_devices(context=None):
     """
@@ -303,11 +359,9 @@ async def cleanup_orphaned_devices(context=None):
     """
     logger.info("Iniciando limpieza de dispositivos huérfanos...")
     
-    from database import Session, Server
+    from database import Server
     from handlers.emby_handler import delete_orphaned_emby_devices
     from handlers.jellyfin_handler import delete_orphaned_jellyfin_devices
-    import time
-    import asyncio
     from sqlalchemy.exc import OperationalError, SQLAlchemyError
     
     # Resultados para el reporte
@@ -315,12 +369,12 @@ async def cleanup_orphaned_devices(context=None):
     server_details = []
     
     # CORRECCIÓN: Función para obtener los servidores con reintentos usando context manager
-    def get_servers_with_retry(service_type, max_retries=3, retry_delay=2):
+    async def get_servers_with_retry(service_type, max_retries=3, retry_delay=2):
         for attempt in range(max_retries):
             try:
                 # CORRECCIÓN: Usar context manager para garantizar cierre de sesión
-                with get_db_session() as session:
-                    servers = session.query(Server).filter_by(service=service_type, is_active=True).all()
+                async with get_async_db_session() as session:
+                    servers = (await session.scalars(select(Server).filter_by(service=service_type, is_active=True))).all()
                     # Hacer una copia de los objetos para no depender de la sesión
                     servers_copy = []
                     for server in servers:
@@ -334,19 +388,19 @@ async def cleanup_orphaned_devices(context=None):
                             "current_users": server.current_users
                         })
                     return servers_copy
-                # session.close() se llama automáticamente al salir del with
+                # session.close() se llama automáticamente al salir del async with
             except (OperationalError, SQLAlchemyError) as e:
                 logger.warning(f"Error al consultar servidores {service_type}. Intento {attempt+1}/{max_retries}: {e}")
                 if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                    await asyncio.sleep(retry_delay)
                 else:
                     logger.error(f"No se pudieron obtener los servidores {service_type} después de {max_retries} intentos")
                     return []
     
     try:
         # Obtener todos los servidores activos con manejo de errores
-        emby_servers_data = get_servers_with_retry("EMBY")
-        jellyfin_servers_data = get_servers_with_retry("JELLYFIN")
+        emby_servers_data = await get_servers_with_retry("EMBY")
+        jellyfin_servers_data = await get_servers_with_retry("JELLYFIN")
         
         # Procesamiento en paralelo para cada servidor Emby
         emby_tasks = []
@@ -417,48 +471,62 @@ async def cleanup_orphaned_devices(context=None):
         # Si se proporcionó un contexto y hay dispositivos eliminados, enviar un informe DETALLADO
         if context and hasattr(context, 'bot') and total_deleted > 0:
             try:
-                # Construir mensaje de reporte específico para DISPOSITIVOS HUÉRFANOS
-                report_message = f"🧹 *REPORTE DE LIMPIEZA DE HUÉRFANOS*\n\n"
-                report_message += f"Total eliminados: {total_deleted}\n\n"
-                
-                for server_detail in server_details:
-                    server_name = server_detail['name']
-                    count = server_detail['deleted_count']
-                    devices = server_detail.get('devices', [])
+                admin_ids = await _get_admin_chat_ids()
                     
-                    report_message += f"🖥️ *{server_name}*: {count} eliminados\n"
+                # Detalle de dispositivos eliminados (se envía como archivo si es largo)
+                document = ReportDocument(
+                    "dispositivos_huerfanos", ["servidor", "servicio", "dispositivo", "app", "motivo"]
+                )
+                for server_detail in server_details:
+                    for device in server_detail.get('devices', []):
+                        document.add_row(
+                            server_detail['name'],
+                            server_detail['service'],
+                            device.get('device_name', 'Desconocido'),
+                            device.get('app_name', ''),
+                            device.get('reason', '')
+                        )
                     
-                    # Listar dispositivos eliminados
-                    for device in devices:
-                        dev_name = device.get('device_name', 'Desconocido')
-                        app_name = device.get('app_name', '')
-                        reason = device.get('reason', '')
+                if document.exceeds_threshold():
+                    # Resumen por servidor y el detalle completo como un único archivo
+                    summary_message = f"🧹 *REPORTE DE LIMPIEZA DE HUÉRFANOS*\n\n"
+                    summary_message += f"Total eliminados: {total_deleted}\n\n"
+                    for server_detail in server_details:
+                        summary_message += f"🖥️ *{server_detail['name']}*: {server_detail['deleted_count']} eliminados\n"
                         
-                        device_str = f"   • {dev_name}"
-                        if app_name:
-                            device_str += f" ({app_name})"
-                        if reason:
-                            device_str += f" - {reason}"
-                        report_message += f"{device_str}\n"
+                    await _send_to_admins(context, admin_ids, [summary_message], "reporte de huérfanos")
+                    await _send_document_to_admins(
+                        context, admin_ids, document, "🧹 Detalle de dispositivos huérfanos eliminados", "reporte de huérfanos"
+                    )
+                else:
+                    # Construir mensaje de reporte específico para DISPOSITIVOS HUÉRFANOS
+                    report_message = f"🧹 *REPORTE DE LIMPIEZA DE HUÉRFANOS*\n\n"
+                    report_message += f"Total eliminados: {total_deleted}\n\n"
                     
-                    report_message += "\n"
-
-                # Enviar a admins
-                from config import ADMIN_IDS
-                from database import Session, User
-                session = Session()
-                admin_users = session.query(User).filter(User.role.in_(["SUPER_ADMIN", "ADMIN"])).all()
-                admin_ids = [user.telegram_id for user in admin_users]
-                for aid in ADMIN_IDS:
-                    if aid not in admin_ids:
-                        admin_ids.append(aid)
-                session.close()
-
-                for admin_id in admin_ids:
-                    try:
-                        await context.bot.send_message(chat_id=admin_id, text=report_message, parse_mode="MARKDOWN")
-                    except Exception as e:
-                        logger.error(f"Error al enviar reporte de huérfanos a {admin_id}: {e}")
+                    for server_detail in server_details:
+                        server_name = server_detail['name']
+                        count = server_detail['deleted_count']
+                        devices = server_detail.get('devices', [])
+                        
+                        report_message += f"🖥️ *{server_name}*: {count} eliminados\n"
+                        
+                        # Listar dispositivos eliminados
+                        for device in devices:
+                            dev_name = device.get('device_name', 'Desconocido')
+                            app_name = device.get('app_name', '')
+                            reason = device.get('reason', '')
+                            
+                            device_str = f"   • {dev_name}"
+                            if app_name:
+                                device_str += f" ({app_name})"
+                            if reason:
+                                device_str += f" - {reason}"
+                            report_message += f"{device_str}\n"
+                        
+                        report_message += "\n"
+
+                    # Enviar a admins
+                    await _send_to_admins(context, admin_ids, [report_message], "reporte de huérfanos")
 
             except Exception as e:
                 logger.error(f"Error al generar/enviar informe de limpieza: {e}")
@@ -506,19 +574,7 @@ async def send_device_limits_report(context, total_count, devices_removed, serve
         servers_report: Lista con detalles de los servidores (opcional)
     """
     try:
-        from database import Session, User
-        from config import ADMIN_IDS
-        
-        session = Session()
-        
-        # Obtener todos los usuarios con roles admin
-        admin_users = session.query(User).filter(User.role.in_(["SUPER_ADMIN", "ADMIN"])).all()
-        admin_telegram_ids = [user.telegram_id for user in admin_users]
-        
-        # Añadir los IDs de admin configurados (por si acaso)
-        for admin_id in ADMIN_IDS:
-            if admin_id not in admin_telegram_ids:
-                admin_telegram_ids.append(admin_id)
+        admin_telegram_ids = await _get_admin_chat_ids()
         
         # Determinar el tipo de reporte basado en los argumentos proporcionados
         is_orphan_report = True
@@ -600,19 +656,9 @@ async def send_device_limits_report(context, total_count, devices_removed, serve
         if devices_removed == 0:
             report += "No se encontraron dispositivos para eliminar.\n"
         
-        session.close()
-        
-        # Enviar a todos los administradores de forma no bloqueante
+        # Enviar a todos los administradores a través de la cola de salida
         if context and hasattr(context, 'bot'):
-            for admin_id in admin_telegram_ids:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=report,
-                        parse_mode="MARKDOWN"
-                    )
-                except Exception as e:
-                    logger.error(f"Error al enviar reporte a admin {admin_id}: {e}")
+            await _send_to_admins(context, admin_telegram_ids, [report], "reporte")
     
     except Exception as e:
         logger.error(f"Error al enviar informe de dispositivos: {e}")
@@ -625,19 +671,35 @@ async def check_and_enforce_device_limits(context=None):
     """
     logger.info("Iniciando verificación de límites de dispositivos...")
     
-    from database import Session, Server, Account, User
-    import asyncio
-    
     # Variables para el informe
     total_users_checked = 0
     total_devices_removed = 0
     servers_report = []
     
-    session = Session()
     try:
-        # Obtener todos los servidores activos
-        emby_servers = session.query(Server).filter_by(service="EMBY", is_active=True).all()
-        jellyfin_servers = session.query(Server).filter_by(service="JELLYFIN", is_active=True).all()
+        async with get_async_db_session() as session:
+            # Obtener todos los servidores activos
+            servers = (await session.scalars(select(Server).filter_by(is_active=True))).all()
+            
+            # Cuentas activas de todos esos servidores en una sola consulta (solo las columnas necesarias)
+            account_rows = (await session.execute(
+                select(Account.server_id, Account.service, Account.service_user_id, Account.plan).filter(
+                    Account.server_id.in_([server.id for server in servers]),
+                    Account.is_active == True
+                )
+            )).all() if servers else []
+        
+        emby_servers = [server for server in servers if server.service == "EMBY"]
+        jellyfin_servers = [server for server in servers if server.service == "JELLYFIN"]
+        
+        # Repartir las cuentas por servidor: cada tarea recibe una instantánea de solo lectura
+        # y no necesita sesión de base de datos, así los servidores se procesan realmente en paralelo
+        services_by_server = {server.id: server.service for server in servers}
+        accounts_by_server = {server.id: [] for server in servers}
+        for row in account_rows:
+            if row.service == services_by_server[row.server_id]:
+                accounts_by_server[row.server_id].append(row)
+        accounts_by_server = {server_id: tuple(rows) for server_id, rows in accounts_by_server.items()}
         
         logger.info(f"Encontrados {len(emby_servers)} servidores EMBY activos y {len(jellyfin_servers)} servidores JELLYFIN activos")
         
@@ -649,29 +711,11 @@ async def check_and_enforce_device_limits(context=None):
                 await context.user_data['status_message'].edit_text(
                     "⚠️ No hay servidores activos configurados para verificar"
                 )
-            session.close()
             return
             
         # Verificar que existen cuentas activas en estos servidores
-        emby_server_ids = [server.id for server in emby_servers]
-        jellyfin_server_ids = [server.id for server in jellyfin_servers]
-        
-        emby_accounts_count = 0
-        jellyfin_accounts_count = 0
-        
-        if emby_server_ids:
-            emby_accounts_count = session.query(Account).filter(
-                Account.server_id.in_(emby_server_ids),
-                Account.service == "EMBY",
-                Account.is_active == True
-            ).count()
-            
-        if jellyfin_server_ids:
-            jellyfin_accounts_count = session.query(Account).filter(
-                Account.server_id.in_(jellyfin_server_ids),
-                Account.service == "JELLYFIN",
-                Account.is_active == True
-            ).count()
+        emby_accounts_count = sum(len(accounts_by_server[server.id]) for server in emby_servers)
+        jellyfin_accounts_count = sum(len(accounts_by_server[server.id]) for server in jellyfin_servers)
             
         logger.info(f"Encontradas {emby_accounts_count} cuentas EMBY activas y {jellyfin_accounts_count} cuentas JELLYFIN activas")
         
@@ -682,58 +726,56 @@ async def check_and_enforce_device_limits(context=None):
                 await context.user_data['status_message'].edit_text(
                     "⚠️ No hay cuentas activas para verificar"
                 )
-            session.close()
             return
         
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # Procesamiento en paralelo para servidores Emby
-            emby_tasks = []
-            for server in emby_servers:
-                emby_tasks.append(process_emby_server_device_limits(server, session, client))
-            
-            # Procesamiento en paralelo para servidores Jellyfin
-            jellyfin_tasks = []
-            for server in jellyfin_servers:
-                jellyfin_tasks.append(process_jellyfin_server_device_limits(server, session, client))
-            
-            # Esperar y recopilar resultados de servidores Emby
-            for future in asyncio.as_completed(emby_tasks):
-                try:
-                    server_report = await future
-                    if server_report:
-                        total_users_checked += server_report.get('users_checked', 0)
-                        total_devices_removed += server_report.get('devices_removed', 0)
-                        if server_report.get('devices_removed', 0) > 0:
-                            servers_report.append({
-                                'name': server_report.get('server_name', 'Emby'),
-                                'service': 'EMBY',
-                                'devices_removed': server_report.get('devices_removed', 0),
-                                'users_details': server_report.get('users_details', [])
-                            })
-                except Exception as e:
-                    logger.error(f"Error al procesar resultados de servidor Emby: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-            
-            # Esperar y recopilar resultados de servidores Jellyfin
-            for future in asyncio.as_completed(jellyfin_tasks):
-                try:
-                    server_report = await future
-                    if server_report:
-                        total_users_checked += server_report.get('users_checked', 0)
-                        total_devices_removed += server_report.get('devices_removed', 0)
-                        if server_report.get('devices_removed', 0) > 0:
-                            servers_report.append({
-                                'name': server_report.get('server_name', 'Jellyfin'),
-                                'service': 'JELLYFIN',
-                                'devices_removed': server_report.get('devices_removed', 0),
-                                'users_details': server_report.get('users_details', [])
-                            })
-                except Exception as e:
-                    logger.error(f"Error al procesar resultados de servidor Jellyfin: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
+        # Procesamiento en paralelo para servidores Emby
+        emby_tasks = []
+        for server in emby_servers:
+            emby_tasks.append(_run_server_device_limits(process_emby_server_device_limits, server, accounts_by_server[server.id]))
+        
+        # Procesamiento en paralelo para servidores Jellyfin
+        jellyfin_tasks = []
+        for server in jellyfin_servers:
+            jellyfin_tasks.append(_run_server_device_limits(process_jellyfin_server_device_limits, server, accounts_by_server[server.id]))
+        
+        # Esperar y recopilar resultados de servidores Emby
+        for future in asyncio.as_completed(emby_tasks):
+            try:
+                server_report = await future
+                if server_report:
+                    total_users_checked += server_report.get('users_checked', 0)
+                    total_devices_removed += server_report.get('devices_removed', 0)
+                    if server_report.get('devices_removed', 0) > 0:
+                        servers_report.append({
+                            'name': server_report.get('server_name', 'Emby'),
+                            'service': 'EMBY',
+                            'devices_removed': server_report.get('devices_removed', 0),
+                            'users_details': server_report.get('users_details', [])
+                        })
+            except Exception as e:
+                logger.error(f"Error al procesar resultados de servidor Emby: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
         
+        # Esperar y recopilar resultados de servidores Jellyfin
+        for future in asyncio.as_completed(jellyfin_tasks):
+            try:
+                server_report = await future
+                if server_report:
+                    total_users_checked += server_report.get('users_checked', 0)
+                    total_devices_removed += server_report.get('devices_removed', 0)
+                    if server_report.get('devices_removed', 0) > 0:
+                        servers_report.append({
+                            'name': server_report.get('server_name', 'Jellyfin'),
+                            'service': 'JELLYFIN',
+                            'devices_removed': server_report.get('devices_removed', 0),
+                            'users_details': server_report.get('users_details', [])
+                        })
+            except Exception as e:
+                logger.error(f"Error al procesar resultados de servidor Jellyfin: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+
         # Generar informe para comando manual o proceso automático
         if context and hasattr(context, 'bot'):
             # Verificar si context.user_data existe y contiene 'status_message'
@@ -785,198 +827,146 @@ async def check_and_enforce_device_limits(context=None):
                 )
             except Exception as msg_err:
                 logger.error(f"Error adicional al actualizar mensaje de error: {msg_err}")
-    finally:
-        try:
-            session.close()
-        except Exception as ses_err:
-            logger.error(f"Error al cerrar sesión de base de datos: {ses_err}")
 
-async def process_emby_server_device_limits(server, db_session, client):
+async def run_device_maintenance(context=None):
     """
-    Procesa los límites de dispositivos para un servidor Emby específico
+    Tarea programada de dispositivos: limpieza de huérfanos (cada ORPHAN_CLEANUP_INTERVAL)
+    seguida del control de límites (cada DEVICE_LIMITS_INTERVAL).
+
+    Las dos se ejecutan dentro del mismo sync_cycle(), así que las listas de
+    usuarios, dispositivos y sesiones de cada servidor se descargan una sola vez
+    por ciclo y el control de límites ve el inventario ya sin los huérfanos.
     """
-    try:
-        from datetime import datetime
-        import urllib.parse  # Para escapar correctamente los IDs
+    global _device_maintenance_cycles
+    cleanup_every = max(1, ORPHAN_CLEANUP_INTERVAL // DEVICE_LIMITS_INTERVAL)
+    run_cleanup = _device_maintenance_cycles % cleanup_every == 0
+    _device_maintenance_cycles += 1
 
-        # Inicializar reporte
-        report = {
-            'users_checked': 0,
-            'devices_removed': 0,
-            'users_details': [],
-            'server_name': server.name
-        }
+    with sync_cycle():
+        if run_cleanup:
+            await cleanup_orphaned_devices(context)
+        await check_and_enforce_device_limits(context)
+
+async def _run_server_device_limits(process_func, server, accounts):
+    """
+    Ejecuta la verificación de límites de un servidor con el cliente de API (sobre el
+    cliente HTTP compartido) de ese servidor y la instantánea de sus cuentas activas.
+    """
+    async with media_server_client(server, timeout=15.0) as media:
+        return await process_func(server, accounts, media)
 
-        # Eliminar la barra final si existe
-        url = server.url
-        if url.endswith('/'):
-            url = url[:-1]
+async def _process_server_device_limits(server, accounts, media, service):
+    """
+    Procesa los límites de dispositivos de un servidor.
 
-        # Obtener todos los usuarios del servidor
-        users_url = f"{url}/emby/Users?api_key={server.api_key}"
-        logger.info(f"Servidor {server.name}: API URL para usuarios = {users_url}")
-        
-        users_response = await client.get(users_url)
-        if users_response.status_code != 200:
-            response_text = users_response.text
-            logger.error(f"Error al obtener usuarios del servidor {server.name}: {response_text}")
+    accounts es la instantánea de solo lectura de las cuentas activas del servidor
+    (filas con service_user_id y plan) que prepara check_and_enforce_device_limits.
+
+    1. Agrupa dispositivos por LastUserId y cuentas por service_user_id (una pasada)
+    2. Elige los dispositivos sobrantes de cada usuario que excede su límite
+    3. Elimina todos los sobrantes del servidor con concurrencia limitada
+    """
+    # Inicializar reporte
+    report = {
+        'users_checked': 0,
+        'devices_removed': 0,
+        'users_details': [],
+        'server_name': server.name
+    }
+
+    try:
+        # Usuarios, dispositivos y sesiones desde el inventario compartido del servidor
+        try:
+            inventory = await sync_inventory(server, media)
+        except MediaServerError as e:
+            logger.error(f"Error al obtener el inventario del servidor {server.name}: {e.message}")
             return report
 
-        server_users = users_response.json()
-        logger.info(f"Servidor {server.name}: Se encontraron {len(server_users)} usuarios en el servidor")
-        
-        # Obtener todas las cuentas activas para este servidor
-        accounts = db_session.query(Account).filter_by(
-            server_id=server.id,
-            service="EMBY",
-            is_active=True
-        ).all()
-        logger.info(f"Servidor {server.name}: Se encontraron {len(accounts)} cuentas activas en la base de datos")
-        
+        logger.info(
+            f"Servidor {server.name}: {len(inventory.users)} usuarios, {len(inventory.devices)} dispositivos "
+            f"y {len(accounts)} cuentas activas en la base de datos"
+        )
+
         # Verificar si hay cuentas para procesar
         if not accounts:
             logger.warning(f"Servidor {server.name}: No hay cuentas activas asociadas en la base de datos")
             return report
-        
-        # Usar configuración centralizada de límites de dispositivos
-        plan_to_limit = DEVICE_LIMITS['EMBY']
-        
-        # Obtener todos los dispositivos del servidor
-        all_devices_url = f"{url}/emby/Devices?api_key={server.api_key}"
-        logger.info(f"Obteniendo todos los dispositivos: {all_devices_url}")
-        all_devices_response = await client.get(all_devices_url)
-        
-        if all_devices_response.status_code != 200:
-            logger.error(f"Error al obtener dispositivos: {all_devices_response.text}")
-            return report
-            
-        # Procesar la respuesta para obtener la lista de dispositivos
-        all_devices = all_devices_response.json().get('Items', [])
-        logger.info(f"Servidor {server.name}: Se encontraron {len(all_devices)} dispositivos en total")
-        
-        # Procesar cada usuario en el servidor
-        for user in server_users:
-            user_id = user.get('Id')
-            user_name = user.get('Name')
-            
-            # Buscar la cuenta correspondiente en nuestra base de datos
-            account = next((acc for acc in accounts if acc.service_user_id == user_id), None)
-            
-            # Saltar usuarios admin o sin cuenta en nuestra base de datos
-            if not account or user.get('Policy', {}).get('IsAdministrator', False):
-                continue
-            
-            report['users_checked'] += 1
-            logger.info(f"Verificando límites para usuario {user_name} (ID: {user_id}, Plan: {account.plan})")
-            
-            # Determinar el límite de dispositivos según el plan
-            device_limit = plan_to_limit.get(account.plan, 1)
-            logger.info(f"Límite de dispositivos para {user_name}: {device_limit}")
-            
-            # IMPORTANTE: Filtrar por LastUserId en lugar de UserId
-            user_devices = [d for d in all_devices if d.get('LastUserId') == user_id]
-            logger.info(f"Usuario {user_name}: Se encontraron {len(user_devices)} dispositivos")
-            
-            # Si el usuario no excede su límite, continuar con el siguiente
-            if len(user_devices) <= device_limit:
-                logger.info(f"Usuario {user_name} tiene {len(user_devices)} dispositivos, dentro del límite de {device_limit}")
-                continue
-            
-            logger.warning(f"Usuario {user_name} excede límite: {len(user_devices)} dispositivos, límite {device_limit}")
-            
-            # Clasificar dispositivos (con y sin fecha de actividad)
-            devices_with_date = []
-            devices_without_date = []
-            
-            for device in user_devices:
-                device_id = device.get('Id')
+
+        # En Jellyfin se conservan primero los dispositivos con sesión activa
+        active_devices_by_user = None
+        if service == "JELLYFIN":
+            active_devices_by_user = {}
+            for device_id, session in inventory.sessions_by_device.items():
+                if session.get('UserId'):
+                    active_devices_by_user.setdefault(session['UserId'], set()).add(device_id)
+
+        # Solo se evalúan los usuarios con dispositivos nuevos o modificados desde la última
+        # verificación, o cuyo plan cambió; el resto ya estaba dentro de su límite
+        checkpoint_generation, settled_plans = inventory.get_checkpoint(DEVICE_LIMITS_CHECKPOINT)
+        evaluations, new_settled_plans = evaluate_device_limits(
+            inventory.users,
+            accounts,
+            inventory.devices_by_user,
+            DEVICE_LIMITS[service],
+            active_devices_by_user=active_devices_by_user,
+            changed_user_ids=inventory.changed_user_ids_since(checkpoint_generation),
+            settled_plans=settled_plans
+        )
+        report['users_checked'] = len(evaluations)
+
+        over_limit = [evaluation for evaluation in evaluations if evaluation['to_remove']]
+        for evaluation in over_limit:
+            logger.warning(
+                f"Usuario {evaluation['username']} excede límite: {evaluation['total_devices']} dispositivos, "
+                f"límite {evaluation['device_limit']} (plan {evaluation['plan']})"
+            )
+
+        # Eliminar los dispositivos sobrantes de todos los usuarios
+        device_ids = [device.get('Id') for evaluation in over_limit for device in evaluation['to_remove']]
+        results = await delete_devices(media, device_ids)
+
+        removed_ids = [device_id for device_id, result in results.items() if not isinstance(result, Exception)]
+        inventory.remove_devices(removed_ids)
+
+        for evaluation in over_limit:
+            user_name = evaluation['username']
+            user_removed_devices = []
+
+            for device in evaluation['to_remove']:
                 device_name = device.get('Name', 'Desconocido')
-                app_name = device.get('AppName', '')
-                last_activity = device.get('DateLastActivity')
-                
-                if last_activity:
-                    # Formato ISO 8601 para fecha de actividad
-                    try:
-                        activity_date = datetime.fromisoformat(last_activity.replace('Z', '+00:00'))
-                        devices_with_date.append({
-                            'id': device_id,
-                            'name': device_name,
-                            'app': app_name,
-                            'date': activity_date
-                        })
-                    except (ValueError, TypeError):
-                        devices_without_date.append({
-                            'id': device_id,
-                            'name': device_name,
-                            'app': app_name
-                        })
-                else:
-                    devices_without_date.append({
-                        'id': device_id,
+                result = results.get(device.get('Id'))
+
+                if isinstance(result, Exception):
+                    logger.error(f"Error al eliminar dispositivo {device_name} para usuario {user_name}: {result}")
+                elif result:
+                    report['devices_removed'] += 1
+                    user_removed_devices.append({
                         'name': device_name,
-                        'app': app_name
+                        'app': device.get('AppName', '')
                     })
-            
-            # Ordenar dispositivos con fecha por más antiguos primero
-            devices_with_date.sort(key=lambda x: x['date'])
-            
-            # Calcular cuántos dispositivos excedentes hay que eliminar
-            devices_to_remove_count = len(user_devices) - device_limit
-            
-            # Preparar lista de dispositivos a eliminar
-            devices_to_remove = []
-            
-            # Primero agregar dispositivos sin fecha de actividad
-            if len(devices_without_date) <= devices_to_remove_count:
-                devices_to_remove.extend(devices_without_date)
-                devices_to_remove_count -= len(devices_without_date)
-            else:
-                devices_to_remove.extend(devices_without_date[:devices_to_remove_count])
-                devices_to_remove_count = 0
-            
-            # Si aún necesitamos eliminar más, agregar dispositivos con fecha (los más antiguos)
-            if devices_to_remove_count > 0:
-                devices_to_remove.extend(devices_with_date[:devices_to_remove_count])
-            
-            # Eliminar los dispositivos seleccionados
-            user_removed_devices = []
-            
-            for device in devices_to_remove:
-                try:
-                    # URL de eliminación para dispositivos Emby
-                    # Añadir el ID como parámetro de consulta
-                    device_id = urllib.parse.quote(device['id'])
-                    delete_url = f"{url}/emby/Devices?Id={device_id}&api_key={server.api_key}"
-                    
-                    logger.info(f"Intentando eliminar dispositivo {device['name']}, URL: {delete_url}")
-                    delete_response = await client.delete(delete_url)
-                    
-                    if delete_response.status_code == 204 or delete_response.status_code == 200:
-                        report['devices_removed'] += 1
-                        user_removed_devices.append({
-                            'name': device['name'],
-                            'app': device['app']
-                        })
-                        logger.info(f"Dispositivo {device['name']} eliminado para usuario {user_name}")
-                    else:
-                        logger.warning(f"Error al eliminar dispositivo {device['name']} para usuario {user_name}: {delete_response.text}")
-                except Exception as e:
-                    logger.error(f"Error al eliminar dispositivo {device['name']} para usuario {user_name}: {e}")
-            
+                    logger.info(f"Dispositivo {device_name} eliminado para usuario {user_name}")
+                else:
+                    logger.warning(f"El dispositivo {device_name} del usuario {user_name} ya no existía en el servidor")
+
+            # Si ya no excede su límite, no se vuelve a evaluar hasta que cambien sus dispositivos
+            if len(inventory.devices_by_user.get(evaluation['user_id'], [])) <= evaluation['device_limit']:
+                new_settled_plans[evaluation['user_id']] = evaluation['plan']
+
             # Agregar detalles al reporte si se eliminaron dispositivos
             if user_removed_devices:
                 report['users_details'].append({
                     'username': user_name,
                     'removed_devices': user_removed_devices,
-                    'plan': account.plan,
-                    'device_limit': device_limit,
-                    'total_devices': len(user_devices)
+                    'plan': evaluation['plan'],
+                    'device_limit': evaluation['device_limit'],
+                    'total_devices': evaluation['total_devices']
                 })
-        
+
+        inventory.set_checkpoint(DEVICE_LIMITS_CHECKPOINT, new_settled_plans)
         return report
-        
+
     except Exception as e:
-        logger.error(f"Error al procesar límites de dispositivos en servidor Emby {server.name}: {e}")
+        logger.error(f"Error al procesar límites de dispositivos en servidor {service.capitalize()} {server.name}: {e}")
         import traceback
         logger.error(traceback.format_exc())
         return {
@@ -986,273 +976,25 @@ async def process_emby_server_device_limits(server, db_session, client):
             'server_name': getattr(server, 'name', 'Desconocido')
         }
 
-async def process_jellyfin_server_device_limits(server, db_session, client):
+async def process_emby_server_device_limits(server, accounts, media):
+    """
+    Procesa los límites de dispositivos para un servidor Emby específico
+    """
+    return await _process_server_device_limits(server, accounts, media, "EMBY")
+
+async def process_jellyfin_server_device_limits(server, accounts, media):
     """
     Procesa los límites de dispositivos para un servidor Jellyfin específico
+    (los dispositivos con sesión activa se conservan primero)
     """
-    try:
-        from datetime import datetime, timedelta
-        
-        # Inicializar reporte
-        report = {
-            'users_checked': 0,
-            'devices_removed': 0,
-            'users_details': [],
-            'server_name': server.name
-        }
-        
-        # Eliminar la barra final si existe
-        url = server.url
-        if url.endswith('/'):
-            url = url[:-1]
-        
-        # Obtener todos los usuarios del servidor
-        users_url = f"{url}/Users?api_key={server.api_key}"
-        logger.info(f"Servidor {server.name}: API URL para usuarios = {users_url}")
-        users_response = await client.get(users_url)
-        
-        if users_response.status_code != 200:
-            logger.error(f"Error al obtener usuarios del servidor {server.name}: {users_response.text}")
-            return report
-        
-        server_users = users_response.json()
-        if not isinstance(server_users, list):
-            server_users = [server_users]
-        
-        logger.info(f"Servidor {server.name}: Se encontraron {len(server_users)} usuarios en el servidor")
-        
-        # Obtener todas las cuentas activas para este servidor
-        accounts = db_session.query(Account).filter_by(
-            server_id=server.id,
-            service="JELLYFIN",
-            is_active=True
-        ).all()
-        
-        logger.info(f"Servidor {server.name}: Se encontraron {len(accounts)} cuentas activas en la base de datos")
-        
-        # Usar configuración centralizada de límites de dispositivos
-        plan_to_limit = DEVICE_LIMITS['JELLYFIN']
-        
-        # Obtener todos los dispositivos del servidor
-        devices_url = f"{url}/Devices?api_key={server.api_key}"
-        logger.info(f"Obteniendo todos los dispositivos: {devices_url}")
-        devices_response = await client.get(devices_url)
-        
-        if devices_response.status_code != 200:
-            logger.error(f"Error al obtener dispositivos del servidor {server.name}: {devices_response.text}")
-            return report
-        
-        # Manejar diferentes formatos de respuesta
-        devices_data = devices_response.json()
-        all_devices = []
-        
-        if isinstance(devices_data, list):
-            all_devices = devices_data
-        elif isinstance(devices_data, dict) and 'Items' in devices_data:
-            all_devices = devices_data.get('Items', [])
-        else:
-            all_devices = [devices_data]
-        
-        logger.info(f"Servidor {server.name}: Se encontraron {len(all_devices)} dispositivos en total")
-        
-        # Obtener sesiones activas
-        sessions_url = f"{url}/Sessions?api_key={server.api_key}"
-        sessions_response = await client.get(sessions_url)
-        active_sessions = []
-        
-        if sessions_response.status_code == 200:
-            sessions_data = sessions_response.json()
-            if isinstance(sessions_data, list):
-                active_sessions = sessions_data
-            else:
-                active_sessions = [sessions_data]
-        
-        # Construir un mapa de deviceId -> userId para sesiones activas
-        active_device_map = {}
-        for session in active_sessions:
-            if isinstance(session, dict):
-                user_id = session.get('UserId')
-                device_id = session.get('DeviceId')
-                if user_id and device_id:
-                    active_device_map[device_id] = user_id
-        
-        # Procesar cada usuario en el servidor
-        for user in server_users:
-            if not isinstance(user, dict):
-                continue
-                
-            user_id = user.get('Id')
-            user_name = user.get('Name')
-            
-            if not user_id or not user_name:
-                continue
-            
-            # Buscar la cuenta correspondiente en nuestra base de datos
-            account = next((acc for acc in accounts if acc.service_user_id == user_id), None)
-            
-            # Saltar usuarios admin o sin cuenta en nuestra base de datos
-            if not account or user.get('Policy', {}).get('IsAdministrator', False):
-                continue
-            
-            report['users_checked'] += 1
-            logger.info(f"Verificando límites para usuario {user_name} (ID: {user_id}, Plan: {account.plan})")
-            
-            # Determinar el límite de dispositivos según el plan
-            device_limit = plan_to_limit.get(account.plan, 1)
-            logger.info(f"Límite de dispositivos para {user_name}: {device_limit}")
-            
-            # Filtrar solo los dispositivos del usuario actual 
-            # IMPORTANTE: En Jellyfin buscamos por LastUserId igual que en Emby
-            user_devices = [d for d in all_devices if isinstance(d, dict) and d.get('LastUserId') == user_id]
-            logger.info(f"Usuario {user_name}: Se encontraron {len(user_devices)} dispositivos")
-            
-            # Si el usuario no excede su límite, continuar con el siguiente
-            if len(user_devices) <= device_limit:
-                logger.info(f"Usuario {user_name} tiene {len(user_devices)} dispositivos, dentro del límite de {device_limit}")
-                continue
-            
-            logger.warning(f"Usuario {user_name} excede límite: {len(user_devices)} dispositivos, límite {device_limit}")
-            
-            # Identificar dispositivos activos ahora
-            active_devices = []
-            devices_with_date = []
-            devices_without_date = []
-            
-            for device in user_devices:
-                device_id = device.get('Id')
-                device_name = device.get('Name', 'Desconocido')
-                app_name = device.get('AppName', '')
-                last_activity = device.get('DateLastActivity')
-                
-                # Verificar si el dispositivo está activo ahora
-                is_active_now = device_id in active_device_map and active_device_map[device_id] == user_id
-                
-                device_info = {
-                    'id': device_id,
-                    'name': device_name,
-                    'app': app_name,
-                    'active_now': is_active_now
-                }
-                
-                if is_active_now:
-                    # Priorizar mantener dispositivos activos
-                    active_devices.append(device_info)
-                elif last_activity:
-                    # Formato ISO 8601 para fecha de actividad
-                    try:
-                        activity_date = datetime.fromisoformat(last_activity.replace('Z', '+00:00'))
-                        device_info['date'] = activity_date
-                        devices_with_date.append(device_info)
-                    except (ValueError, TypeError):
-                        devices_without_date.append(device_info)
-                else:
-                    devices_without_date.append(device_info)
-            
-            # Ordenar dispositivos con fecha por más antiguos primero
-            devices_with_date.sort(key=lambda x: x['date'])
-            
-            # NUEVA ESTRATEGIA DE ELIMINACIÓN:
-            # 1. Preservar dispositivos activos si están dentro del límite
-            # 2. Eliminar primero dispositivos sin fecha de actividad
-            # 3. Luego eliminar los dispositivos más antiguos
-            
-            # Calcular cuántos dispositivos mantener vs cuántos eliminar
-            keep_count = min(device_limit, len(active_devices))
-            total_to_remove = len(user_devices) - device_limit
-            devices_to_keep = active_devices[:keep_count]
-            
-            # IDs de dispositivos que mantendremos
-            keep_ids = [d['id'] for d in devices_to_keep]
-            
-            # Crear lista de potenciales dispositivos a eliminar
-            potential_removals = []
-            
-            # Primero agregar dispositivos sin fecha (menos importantes)
-            potential_removals.extend(devices_without_date)
-            
-            # Luego agregar dispositivos con fecha, de más antiguos a más recientes
-            potential_removals.extend(devices_with_date)
-            
-            # Finalmente agregar dispositivos activos que exceden el límite
-            if len(active_devices) > keep_count:
-                potential_removals.extend(active_devices[keep_count:])
-            
-            # Crear lista final de dispositivos a eliminar
-            devices_to_remove = []
-            for device in potential_removals:
-                if device['id'] not in keep_ids and len(devices_to_remove) < total_to_remove:
-                    devices_to_remove.append(device)
-                    # Ya no necesitamos preservar este ID
-                    if device['id'] in keep_ids:
-                        keep_ids.remove(device['id'])
-            
-            # Log detallado sobre lo que vamos a hacer
-            logger.info(f"Usuario {user_name}: Manteniendo {len(devices_to_keep)} dispositivos activos, eliminando {len(devices_to_remove)} de {len(user_devices)} totales")
-            
-            # Eliminar los dispositivos seleccionados
-            user_removed_devices = []
-            
-            for device in devices_to_remove:
-                try:
-                    # URL de eliminación corregida y verificada
-                    delete_url = f"{url}/Devices/{device['id']}?api_key={server.api_key}"
-                    logger.info(f"Intentando eliminar dispositivo: {device['name']} (ID: {device['id']}) del usuario {user_name}")
-                    
-                    delete_response = await client.delete(delete_url)
-                    
-                    if delete_response.status_code in [204, 200]:
-                        report['devices_removed'] += 1
-                        user_removed_devices.append({
-                            'name': device['name'],
-                            'app': device['app']
-                        })
-                        logger.info(f"✓ Dispositivo {device['name']} eliminado para usuario {user_name}")
-                    else:
-                        logger.warning(f"✗ Error al eliminar dispositivo {device['name']} para usuario {user_name}: Código {delete_response.status_code}, Respuesta: {delete_response.text}")
-                except Exception as e:
-                    logger.error(f"✗ Error al eliminar dispositivo {device['name']} para usuario {user_name}: {e}")
-            
-            # Agregar detalles al reporte si se eliminaron dispositivos
-            if user_removed_devices:
-                report['users_details'].append({
-                    'username': user_name,
-                    'removed_devices': user_removed_devices,
-                    'plan': account.plan,
-                    'device_limit': device_limit,
-                    'total_devices': len(user_devices)
-                })
-        
-        return report
-        
-    except Exception as e:
-        logger.error(f"Error al procesar límites de dispositivos en servidor Jellyfin {server.name}: {e}")
-        import traceback
-        logger.error(traceback.format_exc())
-        return {
-            'users_checked': 0,
-            'devices_removed': 0,
-            'users_details': [],
-            'server_name': getattr(server, 'name', 'Desconocido')
-        }
+    return await _process_server_device_limits(server, accounts, media, "JELLYFIN")
 
 async def send_device_limits_report(context, total_users, total_devices, servers_report):
     """
     Envía un informe detallado sobre los límites de dispositivos a los administradores
     """
     try:
-        from database import Session, User
-        from config import ADMIN_IDS
-        
-        session = Session()
-        
-        # Obtener todos los usuarios con roles admin
-        admin_users = session.query(User).filter(User.role.in_(["SUPER_ADMIN", "ADMIN"])).all()
-        admin_telegram_ids = [user.telegram_id for user in admin_users]
-        
-        # Añadir los IDs de admin configurados 
-        for admin_id in ADMIN_IDS:
-            if admin_id not in admin_telegram_ids:
-                admin_telegram_ids.append(admin_id)
+        admin_telegram_ids = await _get_admin_chat_ids()
         
         # Construir mensaje de informe - Parte 1 (resumen)
         summary_message = (
@@ -1261,17 +1003,38 @@ async def send_device_limits_report(context, total_users, total_devices, servers
             f"🗑️ Dispositivos eliminados: {total_devices}\n\n"
         )
         
-        # Enviar resumen a todos los administradores
-        if context and context.bot:
-            for admin_id in admin_telegram_ids:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=summary_message,
-                        parse_mode="MARKDOWN"
+        # Detalle de dispositivos eliminados por usuario (se envía como archivo si es largo)
+        document = ReportDocument(
+            "limites_dispositivos",
+            ["servidor", "usuario", "plan", "limite", "total_dispositivos", "dispositivo", "app"]
+        )
+        for server in servers_report or []:
+            for user_detail in server['users_details']:
+                for device in user_detail['removed_devices']:
+                    document.add_row(
+                        server['name'],
+                        user_detail['username'],
+                        user_detail.get('plan', 'desconocido'),
+                        user_detail.get('device_limit', '?'),
+                        user_detail.get('total_devices', '?'),
+                        device['name'],
+                        device['app']
                     )
-                except Exception as e:
-                    logger.error(f"Error al enviar resumen de límites de dispositivos a admin {admin_id}: {e}")
+        
+        if document.exceeds_threshold():
+            # Un resumen compacto por servidor y el detalle completo como un único archivo
+            for server in servers_report:
+                summary_message += f"🖥️ *Servidor {server['name']}*: {server['devices_removed']} eliminados\n"
+            
+            if context and context.bot:
+                await _send_to_admins(context, admin_telegram_ids, [summary_message], "informe de límites de dispositivos")
+                await _send_document_to_admins(
+                    context, admin_telegram_ids, document,
+                    "📱 Detalle de dispositivos eliminados por límite", "informe de límites de dispositivos"
+                )
+            return
+        
+        messages = [summary_message]
         
         # Límite de longitud para mensajes de Telegram (4096 caracteres)
         MAX_MESSAGE_LENGTH = 4000  # Usamos un valor un poco menor para tener margen
@@ -1281,18 +1044,7 @@ async def send_device_limits_report(context, total_users, total_devices, servers
             for server in servers_report:
                 server_message = f"🖥️ *Servidor {server['name']}*:\n"
                 server_message += f"   🗑️ Dispositivos eliminados: {server['devices_removed']}\n\n"
-                
-                # Enviar mensaje inicial de servidor
-                if context and context.bot:
-                    for admin_id in admin_telegram_ids:
-                        try:
-                            await context.bot.send_message(
-                                chat_id=admin_id,
-                                text=server_message,
-                                parse_mode="MARKDOWN"
-                            )
-                        except Exception as e:
-                            logger.error(f"Error al enviar informe de servidor a admin {admin_id}: {e}")
+                messages.append(server_message)
                 
                 # Procesar detalles de usuarios en mensajes separados
                 for user_detail in server['users_details']:
@@ -1316,17 +1068,8 @@ async def send_device_limits_report(context, total_users, total_devices, servers
                         
                         # Verificar si añadir esta línea excedería el límite
                         if len(user_message + devices_message + device_line) > MAX_MESSAGE_LENGTH:
-                            # Enviar el mensaje actual y comenzar uno nuevo
-                            if context and context.bot:
-                                for admin_id in admin_telegram_ids:
-                                    try:
-                                        await context.bot.send_message(
-                                            chat_id=admin_id,
-                                            text=user_message + devices_message,
-                                            parse_mode="MARKDOWN"
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"Error al enviar parte del informe a admin {admin_id}: {e}")
+                            # Cerrar el mensaje actual y comenzar uno nuevo
+                            messages.append(user_message + devices_message)
                             
                             # Reiniciar con una cabecera para continuación
                             user_message = f"   👤 *{username}* (continuación):\n"
@@ -1334,20 +1077,13 @@ async def send_device_limits_report(context, total_users, total_devices, servers
                         else:
                             devices_message += device_line
                     
-                    # Enviar mensaje final para este usuario si hay contenido
+                    # Mensaje final para este usuario si hay contenido
                     if devices_message:
-                        if context and context.bot:
-                            for admin_id in admin_telegram_ids:
-                                try:
-                                    await context.bot.send_message(
-                                        chat_id=admin_id,
-                                        text=user_message + devices_message,
-                                        parse_mode="MARKDOWN"
-                                    )
-                                except Exception as e:
-                                    logger.error(f"Error al enviar informe final de usuario a admin {admin_id}: {e}")
+                        messages.append(user_message + devices_message)
         
-        session.close()
+        # Encolar todas las partes para todos los administradores (cada uno las recibe en orden)
+        if context and context.bot:
+            await _send_to_admins(context, admin_telegram_ids, messages, "informe de límites de dispositivos")
     
     except Exception as e:
         logger.error(f"Error al enviar informe de límites de dispositivos: {e}")
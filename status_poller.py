@@ -0,0 +1,108 @@
+"""
+Caché en memoria del estado de los servidores Emby/Jellyfin.
+
+Una tarea programada (refresh_server_status_snapshots) consulta todos los
+servidores cada STATUS_POLL_INTERVAL segundos, con un desfase aleatorio de
+hasta STATUS_POLL_JITTER segundos, y guarda el resultado con su fecha. La
+pantalla de estado y el informe periódico a los administradores leen de esta
+caché, de modo que responden al instante y la carga sobre los servidores no
+depende de cuántas veces se consulte el estado.
+"""
+import asyncio
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ("EMBY", "JELLYFIN")
+
+# servicio -> (success, result, updated_at)
+_snapshots = {}
+
+# Evita consultas en vivo duplicadas si se pide el estado antes del primer sondeo
+_refresh_locks = {}
+
+
+async def _fetch_status(service):
+    # Importación diferida: los handlers importan módulos que dependen de este
+    if service == "EMBY":
+        from handlers.emby_handler import get_emby_servers_status
+        return await get_emby_servers_status()
+
+    from handlers.jellyfin_handler import get_jellyfin_servers_status
+    return await get_jellyfin_servers_status()
+
+
+async def _store_snapshot(service):
+    success, result = await _fetch_status(service)
+    updated_at = datetime.utcnow()
+
+    if success:
+        for server_status in result:
+            server_status['updated_at'] = updated_at
+
+    _snapshots[service] = (success, result, updated_at)
+    return _snapshots[service]
+
+
+async def refresh_status_snapshot(service):
+    """
+    Consulta los servidores de un servicio y actualiza su entrada en la caché
+
+    Returns:
+        Tuple (success, result, updated_at)
+    """
+    async with _refresh_locks.setdefault(service, asyncio.Lock()):
+        return await _store_snapshot(service)
+
+
+async def refresh_server_status_snapshots(context=None):
+    """Tarea programada: refresca la caché de todos los servicios en paralelo"""
+    results = await asyncio.gather(
+        *(refresh_status_snapshot(service) for service in SERVICES),
+        return_exceptions=True
+    )
+    for service, result in zip(SERVICES, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error al refrescar el estado de los servidores {service}: {result}")
+
+
+async def get_status_snapshot(service):
+    """
+    Devuelve el último estado conocido de los servidores de un servicio.
+
+    Si aún no hay datos (p. ej. justo después de arrancar), los consulta en vivo
+    una única vez aunque haya varias peticiones simultáneas.
+
+    Args:
+        service: "EMBY" o "JELLYFIN"
+
+    Returns:
+        Tuple (success, result, updated_at)
+    """
+    service = service.upper()
+    snapshot = _snapshots.get(service)
+    if snapshot is not None:
+        return snapshot
+
+    async with _refresh_locks.setdefault(service, asyncio.Lock()):
+        # Otra petición pudo completar la consulta mientras se esperaba el lock
+        snapshot = _snapshots.get(service)
+        if snapshot is None:
+            snapshot = await _store_snapshot(service)
+        return snapshot
+
+
+def peek_status_snapshot(service):
+    """Último estado guardado de un servicio, sin consultar los servidores (None si aún no hay)"""
+    return _snapshots.get(service.upper())
+
+
+def format_snapshot_age(updated_at):
+    """Antigüedad de los datos en texto legible ("hace 45 s", "hace 3 min")"""
+    seconds = int((datetime.utcnow() - updated_at).total_seconds())
+    if seconds < 60:
+        return f"hace {seconds} s"
+    if seconds < 3600:
+        return f"hace {seconds // 60} min"
+    return f"hace {seconds // 3600} h {(seconds % 3600) // 60} min"
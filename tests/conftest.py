@@ -0,0 +1,33 @@
+"""
+Configuración común de las pruebas.
+
+Las pruebas usan una base de datos SQLite temporal (con aiosqlite para el
+engine asíncrono) y nunca la base de datos configurada en .env: las variables
+se fijan antes de importar config.
+"""
+import os
+import tempfile
+
+import pytest
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="emby_jellyfin_bot_tests_"), "test.db")
+os.environ["DB_URL"] = f"sqlite:///{_db_path}"
+os.environ["ASYNC_DB_URL"] = f"sqlite+aiosqlite:///{_db_path}"
+os.environ.setdefault("BOT_TOKEN", "test-token")
+os.environ.setdefault("SUPER_ADMIN_ID", "1")
+
+import database  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def schema():
+    database.Base.metadata.create_all(database.engine)
+
+
+@pytest.fixture
+def db(schema):
+    """Tablas vacías para cada prueba"""
+    yield
+    with database.engine.begin() as connection:
+        for table in reversed(database.Base.metadata.sorted_tables):
+            connection.execute(table.delete())
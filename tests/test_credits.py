@@ -0,0 +1,121 @@
+"""Libro de movimientos de créditos (credits) y devolución de compras fallidas"""
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+import bulk_purchase
+from credits import (
+    charge_credits, credit_credits, debit_credits, get_credit_history,
+    ledger_balance, refund_credits, set_credits
+)
+from database import CreditTransaction, Price, Server, User, get_async_db_session
+
+
+async def _add_user(credits, role="RESELLER"):
+    """Crea un usuario con su saldo inicial registrado en el libro"""
+    async with get_async_db_session() as session:
+        user = User(telegram_id=1000 + int(credits), full_name="Test", role=role, credits=0)
+        session.add(user)
+        await session.flush()
+        await set_credits(session, user.id, credits, "opening_balance")
+    return user.id
+
+
+async def _balances(user_id):
+    """(users.credits, suma del libro, número de movimientos)"""
+    async with get_async_db_session() as session:
+        credits = await session.scalar(select(User.credits).where(User.id == user_id))
+        rows = (await session.scalars(select(CreditTransaction).filter_by(user_id=user_id))).all()
+        return credits, await ledger_balance(session, user_id), len(rows)
+
+
+def test_debit_without_enough_credits_changes_nothing(db):
+    async def scenario():
+        user_id = await _add_user(20)
+        async with get_async_db_session() as session:
+            result = await debit_credits(session, user_id, 50, "purchase")
+        return result, await _balances(user_id)
+
+    result, balances = asyncio.run(scenario())
+    assert result is None
+    assert balances == (20, 20, 1)
+
+
+def test_concurrent_charges_never_go_negative(db):
+    async def scenario():
+        user_id = await _add_user(100)
+        results = await asyncio.gather(*(charge_credits(user_id, 30, "purchase") for _ in range(10)))
+        return results, await _balances(user_id)
+
+    results, (credits, ledger, rows) = asyncio.run(scenario())
+    assert sorted(result for result in results if result is not None) == [10, 40, 70]
+    assert results.count(None) == 7
+    assert credits == ledger == 10
+    assert rows == 4
+
+
+def test_refund_restores_balance_and_is_recorded(db):
+    async def scenario():
+        user_id = await _add_user(100)
+        await charge_credits(user_id, 40, "purchase", "EMBY:1_screen")
+        await refund_credits(user_id, 40, "EMBY:1_screen")
+        async with get_async_db_session() as session:
+            history = await get_credit_history(session, user_id)
+        return await _balances(user_id), [(row.reason, row.amount) for row in history]
+
+    balances, history = asyncio.run(scenario())
+    assert balances == (100, 100, 3)
+    assert history[:2] == [("refund", 40), ("purchase", -40)]
+
+
+def test_set_credits_records_the_difference(db):
+    async def scenario():
+        user_id = await _add_user(50)
+        async with get_async_db_session() as session:
+            previous = await set_credits(session, user_id, 80, "admin_set")
+            await credit_credits(session, user_id, 5, "admin_add")
+        return previous, await _balances(user_id)
+
+    previous, balances = asyncio.run(scenario())
+    assert previous == 50
+    assert balances == (85, 85, 3)
+
+
+def test_failed_bulk_creations_are_refunded_and_released(db, monkeypatch):
+    created = []
+
+    async def create_user(server, plan, duration_days):
+        # Falla una de cada dos creaciones
+        created.append(server.id)
+        if len(created) % 2 == 0:
+            return False, "Error al crear usuario: HTTP 500"
+        return True, {
+            "username": f"user{len(created)}",
+            "password": "secret",
+            "user_id": f"remote{len(created)}",
+            "expiry_date": datetime.utcnow() + timedelta(days=duration_days),
+            "plan": plan
+        }
+
+    monkeypatch.setitem(bulk_purchase.CREATE_USER, "EMBY", create_user)
+    monkeypatch.setattr(bulk_purchase, "log_account_created", lambda *args: None)
+
+    async def scenario():
+        user_id = await _add_user(500)
+        async with get_async_db_session() as session:
+            telegram_id = await session.scalar(select(User.telegram_id).where(User.id == user_id))
+            session.add(Price(service="EMBY", role="RESELLER", plan="1_screen", amount=50))
+            server = Server(name="S1", service="EMBY", url="http://s1", api_key="k",
+                            current_users=0, max_users=10, max_devices=100, is_active=True)
+            session.add(server)
+        success, result = await bulk_purchase.bulk_create_accounts(telegram_id, "EMBY", "1_screen", 4)
+        async with get_async_db_session() as session:
+            current_users = await session.scalar(select(Server.current_users).where(Server.id == server.id))
+        return success, result, current_users, await _balances(user_id)
+
+    success, result, current_users, (credits, ledger, _) = asyncio.run(scenario())
+    assert success
+    assert (result["created"], result["failed"], result["charged"]) == (2, 2, 100)
+    assert current_users == 2
+    assert credits == ledger == 400
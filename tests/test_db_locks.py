@@ -0,0 +1,124 @@
+"""Reserva y liberación de plazas de servidor (db_locks)"""
+import asyncio
+
+from sqlalchemy import select
+
+from database import Account, Server, get_async_db_session
+from db_locks import release_server_slot, reserve_server_slot, reserve_server_slots
+from handlers import emby_handler
+
+
+async def _add_servers(*limits, service="EMBY"):
+    """Crea un servidor activo por cada (current_users, max_users)"""
+    async with get_async_db_session() as session:
+        servers = [
+            Server(name=f"S{i}", service=service, url=f"http://s{i}", api_key="k",
+                   current_users=current, max_users=maximum, max_devices=100, is_active=True)
+            for i, (current, maximum) in enumerate(limits, start=1)
+        ]
+        session.add_all(servers)
+    return [server.id for server in servers]
+
+
+async def _current_users():
+    async with get_async_db_session() as session:
+        return dict((await session.execute(select(Server.id, Server.current_users).order_by(Server.id))).all())
+
+
+def test_concurrent_reservations_never_overbook(db):
+    async def scenario():
+        (server_id,) = await _add_servers((0, 5))
+        results = await asyncio.gather(*(reserve_server_slot("EMBY") for _ in range(20)))
+        return server_id, results, await _current_users()
+
+    server_id, results, current = asyncio.run(scenario())
+    assert sum(result is not None for result in results) == 5
+    assert current[server_id] == 5
+
+
+def test_reservation_skips_full_servers(db):
+    async def scenario():
+        full_id, free_id = await _add_servers((3, 3), (0, 3))
+        server = await reserve_server_slot("EMBY")
+        rejected = await reserve_server_slot("EMBY", server_id=full_id)
+        return free_id, server, rejected
+
+    free_id, server, rejected = asyncio.run(scenario())
+    assert server.id == free_id
+    assert server.current_users == 1
+    assert rejected is None
+
+
+def test_release_returns_slots_without_going_negative(db):
+    async def scenario():
+        (server_id,) = await _add_servers((0, 5))
+        await reserve_server_slot("EMBY")
+        await reserve_server_slot("EMBY")
+        await release_server_slot(server_id)
+        after_one = (await _current_users())[server_id]
+        await release_server_slot(server_id, 5)
+        return after_one, (await _current_users())[server_id]
+
+    assert asyncio.run(scenario()) == (1, 0)
+
+
+def test_reservation_during_account_delete_keeps_the_counter(db, monkeypatch):
+    reserved = []
+
+    async def slow_delete_user(server, service_user_id):
+        # Otra compra reserva plaza mientras la eliminación espera al servidor
+        reserved.append(await reserve_server_slot("EMBY"))
+        return True, "ok"
+
+    monkeypatch.setattr(emby_handler, "delete_emby_user", slow_delete_user)
+
+    async def scenario():
+        (server_id,) = await _add_servers((1, 5))
+        async with get_async_db_session() as session:
+            session.add(Account(service="EMBY", username="User0001AA", server_id=server_id,
+                                service_user_id="abc", is_active=True))
+        result = await emby_handler.delete_emby_account("User0001AA")
+        return server_id, result, await _current_users()
+
+    server_id, (success, _), current = asyncio.run(scenario())
+    assert success
+    assert reserved[0] is not None
+    assert current[server_id] == 1
+
+
+def test_bulk_reservation_is_all_or_nothing(db):
+    async def scenario():
+        first_id, second_id = await _add_servers((0, 3), (0, 2))
+        too_many = await reserve_server_slots("EMBY", 6)
+        unchanged = await _current_users()
+        exact = await reserve_server_slots("EMBY", 5)
+        return first_id, second_id, too_many, unchanged, exact, await _current_users()
+
+    first_id, second_id, too_many, unchanged, exact, current = asyncio.run(scenario())
+    assert too_many is None
+    assert unchanged == {first_id: 0, second_id: 0}
+    assert sorted(taken for _, taken in exact) == [2, 3]
+    assert current == {first_id: 3, second_id: 2}
+
+
+def test_bulk_reservation_spreads_across_servers(db):
+    async def scenario():
+        await _add_servers((0, 10), (0, 10))
+        return await reserve_server_slots("EMBY", 6, spread=True)
+
+    reservations = asyncio.run(scenario())
+    assert [taken for _, taken in reservations] == [3, 3]
+
+
+def test_concurrent_bulk_reservations_never_overbook(db):
+    async def scenario():
+        await _add_servers((0, 6), (0, 4))
+        results = await asyncio.gather(*(reserve_server_slots("EMBY", 3) for _ in range(4)))
+        return results, await _current_users()
+
+    results, current = asyncio.run(scenario())
+    granted = [result for result in results if result is not None]
+    assert len(granted) == 3
+    assert all(sum(taken for _, taken in result) == 3 for result in granted)
+    assert sum(current.values()) == 9
+    assert all(value <= limit for value, limit in zip(current.values(), (6, 4)))
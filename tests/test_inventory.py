@@ -0,0 +1,77 @@
+"""Inventario compartido entre la limpieza de huérfanos y el control de límites"""
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import inventory
+import scheduled_tasks
+from database import Account, Server, get_async_db_session
+from handlers import emby_handler
+
+
+class FakeMedia:
+    """Servidor Emby con un usuario con cuenta y un dispositivo huérfano"""
+
+    name = "S1"
+
+    def __init__(self, fetches):
+        self.fetches = fetches
+
+    async def get_users(self):
+        self.fetches.append("users")
+        return [{"Id": "u1", "Name": "User0001AA"}]
+
+    async def get_devices(self):
+        self.fetches.append("devices")
+        return [
+            {"Id": "d1", "LastUserId": "u1", "LastUserName": "User0001AA", "DateLastActivity": "1"},
+            {"Id": "d2", "LastUserName": "Borrado", "DateLastActivity": "1"},
+        ]
+
+    async def get_sessions(self):
+        self.fetches.append("sessions")
+        return []
+
+    async def delete_device(self, device_id):
+        return True
+
+
+def test_maintenance_cycle_syncs_each_server_once(db, monkeypatch):
+    fetches = []
+    clock = SimpleNamespace(now=1000.0)
+
+    @asynccontextmanager
+    async def fake_client(server, timeout=None):
+        yield FakeMedia(fetches)
+
+    monkeypatch.setattr(emby_handler, "media_server_client", fake_client)
+    monkeypatch.setattr(scheduled_tasks, "media_server_client", fake_client)
+    monkeypatch.setattr(inventory.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(scheduled_tasks, "_device_maintenance_cycles", 0)
+
+    # Entre la limpieza y el control pasan los mismos 300 s que separaban sus tareas
+    cleanup = scheduled_tasks.cleanup_orphaned_devices
+
+    async def cleanup_then_wait(context=None):
+        await cleanup(context)
+        clock.now += 300
+
+    monkeypatch.setattr(scheduled_tasks, "cleanup_orphaned_devices", cleanup_then_wait)
+
+    async def scenario():
+        async with get_async_db_session() as session:
+            server = Server(name="S1", service="EMBY", url="http://s1", api_key="k",
+                            current_users=1, max_users=5, max_devices=100, is_active=True)
+            session.add(server)
+            await session.flush()
+            session.add(Account(service="EMBY", username="User0001AA", server_id=server.id,
+                                service_user_id="u1", plan="1_screen", is_active=True))
+        inventory.reset_inventory(server.id)
+        await scheduled_tasks.run_device_maintenance()
+        return inventory.get_inventory(server.id)
+
+    server_inventory = asyncio.run(scenario())
+    assert sorted(fetches) == ["devices", "sessions", "users"]
+    # El control de límites vio el inventario ya sin el huérfano
+    assert list(server_inventory.devices_by_id) == ["d1"]
+    assert scheduled_tasks.DEVICE_LIMITS_CHECKPOINT in server_inventory.checkpoints
@@ -0,0 +1,26 @@
+"""Sesión por actualización (unit_of_work) y autorización"""
+import asyncio
+from types import SimpleNamespace
+
+from auth_cache import auth_cache
+from bot import auth_wrapper
+from database import User, get_async_db_session
+
+
+def test_handler_runs_without_holding_a_transaction(db):
+    seen = {}
+
+    @auth_wrapper
+    async def handler(update, context):
+        seen["in_transaction"] = context.db_session.in_transaction()
+        seen["role"] = context.db_user.role
+
+    async def scenario():
+        async with get_async_db_session() as session:
+            session.add(User(telegram_id=7001, full_name="Test", role="RESELLER", is_authorized=True))
+        auth_cache.invalidate(7001)
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=7001))
+        await handler(update, SimpleNamespace())
+
+    asyncio.run(scenario())
+    assert seen == {"in_transaction": False, "role": "RESELLER"}
@@ -0,0 +1,98 @@
+"""Paginación por clave (role, id) de /list"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from database import User, get_async_db_session
+from handlers import command_handler
+from handlers.command_handler import _fetch_user_page, _render_user_list_page, handle_user_list_page
+
+ROLES = ("RESELLER", "ADMIN", "DISTRIBUTOR", "RESELLER", "ADMIN", "DISTRIBUTOR", "RESELLER")
+
+
+@pytest.fixture
+def users(db, monkeypatch):
+    """23 usuarios con los roles intercalados; páginas de 4"""
+    monkeypatch.setattr(command_handler, "USER_LIST_PAGE_SIZE", 4)
+
+    async def create():
+        async with get_async_db_session() as session:
+            session.add_all([
+                User(telegram_id=5000 + i, full_name=f"User {i}", role=ROLES[i % len(ROLES)])
+                for i in range(23)
+            ])
+
+    asyncio.run(create())
+
+
+async def _walk(role_filter):
+    """Recorre todas las páginas hacia delante y después hacia atrás"""
+    async with get_async_db_session() as session:
+        forward = []
+        users, has_prev, has_next = await _fetch_user_page(session, role_filter, None, "next")
+        assert not has_prev
+        forward.append([(user.role, user.id) for user in users])
+        while has_next:
+            users, has_prev, has_next = await _fetch_user_page(session, role_filter, forward[-1][-1], "next")
+            assert has_prev
+            forward.append([(user.role, user.id) for user in users])
+
+        backward = [forward[-1]]
+        has_prev = len(forward) > 1
+        while has_prev:
+            users, has_prev, has_next = await _fetch_user_page(session, role_filter, backward[-1][0], "prev")
+            assert has_next
+            backward.append([(user.role, user.id) for user in users])
+
+        return forward, backward
+
+
+async def _expected(role_filter):
+    async with get_async_db_session() as session:
+        rows = (await session.execute(select(User.role, User.id))).all()
+    return sorted((role, user_id) for role, user_id in rows if role_filter in (None, role))
+
+
+@pytest.mark.parametrize("role_filter", [None, "RESELLER"])
+def test_paging_neither_skips_nor_repeats(users, role_filter):
+    forward, backward = asyncio.run(_walk(role_filter))
+    expected = asyncio.run(_expected(role_filter))
+
+    assert [key for page in forward for key in page] == expected
+    assert all(len(page) == 4 for page in forward[:-1])
+    # Volver atrás reproduce exactamente las mismas páginas
+    assert list(reversed(backward)) == forward
+
+
+def test_navigation_survives_long_role_names(db, monkeypatch):
+    monkeypatch.setattr(command_handler, "USER_LIST_PAGE_SIZE", 2)
+    role = "REVENDEDOR:MAYORISTA_DE_LA_REGION_NORTE"
+    edits = []
+
+    async def scenario():
+        async with get_async_db_session() as session:
+            session.add_all([User(telegram_id=6000 + i, full_name=f"User {i}", role=role) for i in range(3)])
+            session.add(User(telegram_id=6100, full_name="Other", role="RESELLER"))
+        async with get_async_db_session() as session:
+            users, has_prev, has_next = await _fetch_user_page(session, role, None, "next")
+            _, markup = _render_user_list_page(users, role, has_prev, has_next)
+            (next_button,) = markup.inline_keyboard[-2]
+
+            async def answer(*args):
+                pass
+
+            async def edit_message_text(message, **kwargs):
+                edits.append(message)
+
+            query = SimpleNamespace(data=next_button.callback_data, answer=answer, edit_message_text=edit_message_text)
+            context = SimpleNamespace(db_user=SimpleNamespace(role="ADMIN"), db_session=session)
+            await handle_user_list_page(SimpleNamespace(callback_query=query), context)
+        return next_button.callback_data
+
+    callback_data = asyncio.run(scenario())
+    assert len(callback_data.encode()) <= 64
+    # La segunda página conserva el filtro: solo el tercer usuario del rol
+    assert "User 2" in edits[0]
+    assert "Other" not in edits[0] and "User 0" not in edits[0]
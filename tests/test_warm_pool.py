@@ -0,0 +1,100 @@
+"""Plazas del pool de usuarios precreados (warm_pool)"""
+import asyncio
+
+import pytest
+from sqlalchemy import delete, select
+
+import warm_pool
+from database import PooledUser, Server, get_async_db_session
+from db_locks import reserve_server_slot, reserve_server_slots
+
+
+@pytest.fixture
+def pool_enabled(db, monkeypatch):
+    monkeypatch.setattr(warm_pool, "WARM_POOL_SIZE", 2)
+    monkeypatch.setattr(warm_pool, "WARM_POOL_PLANS", ["1_screen", "demo"])
+
+
+async def _add_server_with_pool(current_users, max_users, pooled):
+    """Servidor con pooled usuarios precreados del plan 1_screen"""
+    async with get_async_db_session() as session:
+        server = Server(name="S1", service="EMBY", url="http://s1", api_key="k",
+                        current_users=current_users, max_users=max_users, max_devices=100, is_active=True)
+        session.add(server)
+        await session.flush()
+        session.add_all([
+            PooledUser(server_id=server.id, plan="1_screen", username=f"User000{i}AA",
+                       password="p", service_user_id=f"u{i}")
+            for i in range(pooled)
+        ])
+    return server
+
+
+async def _current_users(server_id):
+    async with get_async_db_session() as session:
+        return await session.scalar(select(Server.current_users).where(Server.id == server_id))
+
+
+def test_demo_is_never_pooled(pool_enabled):
+    assert warm_pool.is_pooled_plan("1_screen")
+    assert not warm_pool.is_pooled_plan("demo")
+
+
+def test_reservations_do_not_sell_pooled_slots(pool_enabled):
+    async def scenario():
+        server = await _add_server_with_pool(3, 5, pooled=2)
+        rejected = [
+            await reserve_server_slot("EMBY"),
+            await reserve_server_slot("EMBY", plan="2_screens"),
+            await reserve_server_slots("EMBY", 1, plan="2_screens"),
+        ]
+        # Una compra del plan del pool ocupa la plaza del usuario que reclamará
+        first = await reserve_server_slot("EMBY", plan="1_screen")
+        before_claim = await reserve_server_slot("EMBY", plan="1_screen")
+        async with get_async_db_session() as session:
+            await session.execute(delete(PooledUser).where(PooledUser.service_user_id == "u0"))
+        second = await reserve_server_slot("EMBY", plan="1_screen")
+        return server.id, rejected, first, before_claim, second
+
+    server_id, rejected, first, before_claim, second = asyncio.run(scenario())
+    assert rejected == [None, None, None]
+    assert first is not None and before_claim is None and second is not None
+    assert asyncio.run(_current_users(server_id)) == 5
+
+
+def test_bulk_reservation_can_use_its_own_pool(pool_enabled):
+    async def scenario():
+        server = await _add_server_with_pool(3, 5, pooled=2)
+        return server.id, await reserve_server_slots("EMBY", 2, plan="1_screen")
+
+    server_id, reservations = asyncio.run(scenario())
+    assert [taken for _, taken in reservations] == [2]
+    assert asyncio.run(_current_users(server_id)) == 5
+
+
+class FakeMedia:
+    def __init__(self, users):
+        self.users = users
+        self.deleted = []
+
+    async def get_users(self):
+        return self.users
+
+    async def delete_user(self, user_id):
+        self.deleted.append(user_id)
+
+
+def test_reconcile_trims_pool_when_free_slots_shrink(pool_enabled):
+    async def scenario():
+        # Se vendieron plazas después de reponer el pool: solo queda sitio para uno
+        server = await _add_server_with_pool(4, 5, pooled=2)
+        media = FakeMedia([{"Id": f"u{i}", "Policy": {"IsDisabled": True}} for i in range(2)])
+        kept = await warm_pool._reconcile(server, media)
+        async with get_async_db_session() as session:
+            remaining = (await session.scalars(select(PooledUser.service_user_id))).all()
+        return kept, media.deleted, remaining
+
+    kept, deleted, remaining = asyncio.run(scenario())
+    assert kept["1_screen"] == 1
+    assert deleted == ["u1"]
+    assert remaining == ["u0"]
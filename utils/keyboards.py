@@ -1,5 +1,6 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from database import Role, Session, User, check_demo_limit
+from database import Role
+from config import BULK_MAX_ACCOUNTS
 
 def main_menu_keyboard():
     keyboard = [
@@ -48,26 +49,25 @@ def back_to_main_menu_keyboard():
     ]
     return InlineKeyboardMarkup(keyboard)
 
-def create_account_keyboard(service, role="DISTRIBUTOR", user_telegram_id=None):
-    """Crea un teclado para opciones de creación de cuenta"""
+def create_account_keyboard(service, role="DISTRIBUTOR", demo_status=None):
+    """
+    Crea un teclado para opciones de creación de cuenta
+
+    Args:
+        service: "emby" o "jellyfin"
+        role: Rol del usuario
+        demo_status: Tupla (can_create, current_count, limit) devuelta por check_demo_limit (opcional)
+    """
     keyboard = []
     
-    # Verificar límite de demos si se proporciona el ID del usuario
+    # Verificar límite de demos si se proporciona el estado calculado por el handler
     demo_available = True
     demo_info = ""
     
-    if user_telegram_id:
-        try:
-            session = Session()
-            db_user = session.query(User).filter_by(telegram_id=user_telegram_id).first()
-            if db_user:
-                can_create, current_count, limit = check_demo_limit(db_user.id, session)
-                demo_available = can_create
-                demo_info = f" ({current_count}/{limit})"
-            session.close()
-        except Exception:
-            # En caso de error, permitir demos por defecto
-            demo_available = True
+    if demo_status:
+        can_create, current_count, limit = demo_status
+        demo_available = can_create
+        demo_info = f" ({current_count}/{limit})"
     
     if service == "emby":
         keyboard = [
@@ -93,7 +93,7 @@ def create_account_keyboard(service, role="DISTRIBUTOR", user_telegram_id=None):
             ])
         
         keyboard.append([
-            InlineKeyboardButton("🛒 Compra masiva (Max. 3)", callback_data=f"{service}_create_bulk")
+            InlineKeyboardButton(f"🛒 Compra masiva (hasta {BULK_MAX_ACCOUNTS} cuentas)", callback_data=f"{service}_create_bulk")
         ])
             
     elif service == "jellyfin":
@@ -120,7 +120,7 @@ def create_account_keyboard(service, role="DISTRIBUTOR", user_telegram_id=None):
             ])
         
         keyboard.append([
-            InlineKeyboardButton("🛒 Compra masiva (Max. 5)", callback_data=f"{service}_create_bulk")
+            InlineKeyboardButton(f"🛒 Compra masiva (hasta {BULK_MAX_ACCOUNTS} cuentas)", callback_data=f"{service}_create_bulk")
         ])
         
         # Add special TV button for eligible roles
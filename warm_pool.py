@@ -0,0 +1,310 @@
+"""
+Pool de usuarios precreados para entregar cuentas casi al instante.
+
+Crear un usuario en Emby/Jellyfin cuesta varias peticiones seguidas (crear,
+contraseña, políticas). Con WARM_POOL_SIZE > 0 se mantienen en cada servidor
+activo hasta WARM_POOL_SIZE usuarios deshabilitados por cada plan de
+WARM_POOL_PLANS, creados ya con su contraseña. Una compra reclama uno
+(claim_pooled_user) y solo tiene que habilitarlo con la política del plan: una
+única petición. El hueco se repone en segundo plano.
+
+La tarea programada refill_warm_pools concilia además el pool con el servidor:
+olvida los usuarios que ya no existen y elimina del servidor los que aparecen
+habilitados (nadie los ha pagado) y los que sobran (planes retirados de
+WARM_POOL_PLANS, tamaño reducido o menos plazas libres). Los usuarios del pool
+no cuentan en current_users, pero db_locks no vende sus plazas salvo a una
+compra de su plan, que reclamará uno de ellos: el pool nunca supera las plazas
+libres del servidor. Las demos (vencen en una hora) nunca se precrean.
+
+Usage:
+    result = await claim_pooled_user(server, plan, duration_days)
+    if result is not None:
+        return True, result
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, select
+
+from circuit_breaker import is_available
+from config import WARM_POOL_SIZE, WARM_POOL_PLANS, WARM_POOL_CONCURRENCY
+from database import PooledUser, Server, get_async_db_session
+from media_client import media_server_client
+
+logger = logging.getLogger(__name__)
+
+# server_id -> tarea de reposición en curso
+_refill_tasks = {}
+
+# Una sola reposición/conciliación a la vez por servidor
+_refill_locks = {}
+
+
+def is_pooled_plan(plan):
+    """True si las cuentas de este plan se entregan desde el pool (nunca las demos)"""
+    return WARM_POOL_SIZE > 0 and plan in WARM_POOL_PLANS and plan != 'demo'
+
+
+def _generate_credentials(service):
+    # Importación diferida: los handlers importan este módulo
+    if service == "EMBY":
+        from handlers.emby_handler import generate_username, generate_password
+    else:
+        from handlers.jellyfin_handler import generate_username, generate_password
+    return generate_username(), generate_password()
+
+
+async def claim_pooled_user(server, plan, duration_days=30):
+    """
+    Entrega un usuario del pool habilitándolo con la política del plan.
+
+    Args:
+        server: Objeto Server (con la plaza ya reservada)
+        plan: Plan de la cuenta
+        duration_days: Días hasta el vencimiento
+
+    Returns:
+        dict con username, password, user_id, expiry_date y plan (como
+        create_emby_user/create_jellyfin_user), o None si no hay usuarios en el
+        pool o no se pudo habilitar (la cuenta se crea entonces de la forma normal)
+    """
+    if not is_pooled_plan(plan):
+        return None
+
+    try:
+        async with get_async_db_session() as session:
+            pooled = await session.scalar(
+                select(PooledUser)
+                .filter_by(server_id=server.id, plan=plan)
+                .order_by(PooledUser.id)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            # Otra compra pudo reclamarlo a la vez (SQLite no admite SKIP LOCKED)
+            if pooled is not None:
+                result = await session.execute(delete(PooledUser).where(PooledUser.id == pooled.id))
+                if result.rowcount != 1:
+                    pooled = None
+    except Exception as e:
+        logger.error(f"Error al reclamar un usuario del pool de {server.name}: {e}")
+        return None
+
+    schedule_refill(server.id)
+    if pooled is None:
+        return None
+
+    try:
+        async with media_server_client(server, timeout=15.0) as media:
+            await media.set_policy(pooled.service_user_id, media.build_policy(plan))
+    except Exception as e:
+        logger.warning(f"No se pudo habilitar el usuario {pooled.username} del pool de {server.name}: {e}")
+        await _release_claimed(server, pooled)
+        return None
+
+    return {
+        "username": pooled.username,
+        "password": pooled.password,
+        "user_id": pooled.service_user_id,
+        "expiry_date": datetime.utcnow() + timedelta(days=duration_days),
+        "plan": plan
+    }
+
+
+async def _release_claimed(server, pooled):
+    """
+    Deshace un reclamo fallido.
+
+    Tras un timeout o un 5xx el servidor pudo aplicar igualmente la política
+    habilitada, así que el usuario se vuelve a deshabilitar de forma explícita
+    antes de devolverlo al pool; si no se puede, se elimina del servidor. Si
+    tampoco se puede eliminar, se devuelve al pool y la conciliación lo
+    eliminará al verlo habilitado.
+    """
+    returned = False
+    try:
+        async with media_server_client(server, timeout=15.0) as media:
+            try:
+                policy = media.build_policy(pooled.plan)
+                policy["IsDisabled"] = True
+                await media.set_policy(pooled.service_user_id, policy)
+                returned = True
+            except Exception as e:
+                logger.warning(f"No se pudo volver a deshabilitar {pooled.username} en {server.name}: {e}")
+                await media.delete_user(pooled.service_user_id)
+                return
+    except Exception as e:
+        logger.error(f"No se pudo eliminar {pooled.username} de {server.name} tras un reclamo fallido: {e}")
+
+    try:
+        async with get_async_db_session() as session:
+            session.add(PooledUser(
+                server_id=pooled.server_id,
+                plan=pooled.plan,
+                username=pooled.username,
+                password=pooled.password,
+                service_user_id=pooled.service_user_id
+            ))
+    except Exception as e:
+        logger.error(
+            f"No se pudo devolver {pooled.username} al pool de {server.name} "
+            f"({'deshabilitado' if returned else 'estado desconocido'}): {e}"
+        )
+
+
+async def _provision(server, media, plan, semaphore):
+    """Crea un usuario deshabilitado y lo añade al pool"""
+    async with semaphore:
+        username, password = _generate_credentials(server.service)
+        user_id = await media.create_user(username, password, copy_from_user_id=server.admin_id)
+        if not user_id:
+            raise RuntimeError("No se pudo obtener el ID del usuario creado")
+
+        try:
+            policy = media.build_policy(plan)
+            policy["IsDisabled"] = True
+            await media.set_policy(user_id, policy)
+        except Exception:
+            # Sin la política deshabilitada no se puede dejar en el servidor
+            await media.delete_user(user_id)
+            raise
+
+    async with get_async_db_session() as session:
+        session.add(PooledUser(
+            server_id=server.id,
+            plan=plan,
+            username=username,
+            password=password,
+            service_user_id=user_id
+        ))
+
+
+async def _reconcile(server, media):
+    """
+    Compara el pool con los usuarios del servidor y lo recorta si ocupa más
+    plazas de las que quedan libres (los más recientes se eliminan primero).
+
+    Returns:
+        Counter: plan -> usuarios que siguen en el pool
+    """
+    users_by_id = {user['Id']: user for user in await media.get_users() if user.get('Id')}
+
+    async with get_async_db_session() as session:
+        pooled = (await session.scalars(
+            select(PooledUser).filter_by(server_id=server.id).order_by(PooledUser.id)
+        )).all()
+
+    kept = Counter()
+    kept_rows = []
+    forgotten_ids = []
+    removed_ids = []
+    for row in pooled:
+        user = users_by_id.get(row.service_user_id)
+        if user is None:
+            # Ya no existe en el servidor: deja de ofrecerse
+            forgotten_ids.append(row.id)
+        elif not user.get('Policy', {}).get('IsDisabled'):
+            # Habilitado sin cuenta que lo respalde (reclamo fallido o cambio fuera del bot)
+            removed_ids.append(row.id)
+        elif not is_pooled_plan(row.plan) or kept[row.plan] >= WARM_POOL_SIZE:
+            removed_ids.append(row.id)
+        else:
+            kept[row.plan] += 1
+            kept_rows.append(row)
+
+    # Plazas vendidas desde la última reposición (o max_users reducido)
+    excess = server.current_users + len(kept_rows) - server.max_users
+    for row in kept_rows[len(kept_rows) - max(excess, 0):]:
+        kept[row.plan] -= 1
+        removed_ids.append(row.id)
+
+    if not forgotten_ids and not removed_ids:
+        return kept
+
+    async with get_async_db_session() as session:
+        await session.execute(delete(PooledUser).where(PooledUser.id.in_(forgotten_ids)))
+        # Solo se eliminan del servidor los que no reclamó una compra mientras tanto
+        removed = (await session.execute(
+            delete(PooledUser)
+            .where(PooledUser.id.in_(removed_ids))
+            .returning(PooledUser.service_user_id)
+        )).scalars().all()
+
+    for service_user_id in removed:
+        try:
+            await media.delete_user(service_user_id)
+        except Exception as e:
+            logger.error(f"No se pudo eliminar el usuario {service_user_id} del pool de {server.name}: {e}")
+
+    logger.info(
+        f"Pool de {server.name} conciliado: {len(forgotten_ids)} usuarios olvidados, "
+        f"{len(removed)} eliminados del servidor"
+    )
+    return kept
+
+
+async def refill_server_pool(server_id, reconcile=False):
+    """Repone el pool de un servidor hasta WARM_POOL_SIZE usuarios por plan (conciliándolo antes si se indica)"""
+    if WARM_POOL_SIZE <= 0:
+        return
+
+    async with _refill_locks.setdefault(server_id, asyncio.Lock()):
+        try:
+            async with get_async_db_session() as session:
+                server = await session.get(Server, server_id)
+                counts = Counter(dict((await session.execute(
+                    select(PooledUser.plan, func.count())
+                    .filter_by(server_id=server_id)
+                    .group_by(PooledUser.plan)
+                )).all()))
+
+            if not server or not server.is_active or not is_available(server_id):
+                return
+
+            async with media_server_client(server, timeout=30.0) as media:
+                if reconcile:
+                    counts = await _reconcile(server, media)
+
+                missing = [
+                    plan
+                    for plan in WARM_POOL_PLANS
+                    for _ in range(WARM_POOL_SIZE - counts[plan])
+                ]
+                # Cada usuario del pool ocupará una plaza al venderse
+                free_slots = server.max_users - server.current_users - sum(counts.values())
+                missing = missing[:max(free_slots, 0)]
+                if not missing:
+                    return
+
+                semaphore = asyncio.Semaphore(WARM_POOL_CONCURRENCY)
+                results = await asyncio.gather(
+                    *(_provision(server, media, plan, semaphore) for plan in missing),
+                    return_exceptions=True
+                )
+
+            errors = [result for result in results if isinstance(result, Exception)]
+            logger.info(
+                f"Pool de {server.name}: {len(missing) - len(errors)} usuarios precreados"
+                + (f", {len(errors)} errores (último: {errors[-1]})" if errors else "")
+            )
+        except Exception as e:
+            logger.error(f"Error al reponer el pool del servidor {server_id}: {e}")
+
+
+def schedule_refill(server_id):
+    """Repone el pool de un servidor en segundo plano (una sola tarea por servidor)"""
+    task = _refill_tasks.get(server_id)
+    if task is None or task.done():
+        _refill_tasks[server_id] = asyncio.create_task(refill_server_pool(server_id))
+
+
+async def refill_warm_pools(context=None):
+    """Tarea programada: concilia y repone el pool de todos los servidores activos"""
+    if WARM_POOL_SIZE <= 0:
+        return
+
+    async with get_async_db_session() as session:
+        server_ids = (await session.scalars(select(Server.id).filter_by(is_active=True))).all()
+
+    await asyncio.gather(*(refill_server_pool(server_id, reconcile=True) for server_id in server_ids))